@@ -0,0 +1,417 @@
+import os
+import copy
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EPOCH = date(1970, 1, 1)
+
+# Периоды регулярных платежей: от недели до ~полутора месяцев
+RECURRING_MIN_PERIOD = 6
+RECURRING_MAX_PERIOD = 40
+# Ключ группировки регулярных платежей: категория | сумма в копейках (30 бит) | день (12 бит)
+_AMOUNT_BITS = 30
+_DAY_BITS = 12
+
+
+def to_day(value) -> int:
+    """Номер дня от 1970-01-01 для date/datetime"""
+    if isinstance(value, datetime):
+        value = value.date()
+    return (value - EPOCH).days
+
+
+def to_date(day: int) -> date:
+    return EPOCH + timedelta(days=int(day))
+
+
+def _months(days: np.ndarray) -> np.ndarray:
+    """Номер месяца от 1970-01 для каждого дня"""
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int32)
+
+
+def _month_first_day(month: int) -> int:
+    return int(np.datetime64(month, "M").astype("datetime64[D]").astype(np.int64))
+
+
+def _month_days(days: np.ndarray, months: np.ndarray) -> np.ndarray:
+    """Число месяца с нуля для каждого дня"""
+    return (days - months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)).astype(np.int8)
+
+
+COLUMNS = ("_days", "_months", "_month_days", "_amounts", "_categories", "_expense")
+
+
+class UserHistory:
+    """История пользователя в колонках NumPy: день, месяц, число месяца, сумма, код категории, расход ли
+
+    Колонки выделяются с запасом и растут удвоением - добавление строки
+    амортизированно O(1). Порядок строк не важен: все расчеты либо
+    агрегируют через bincount, либо сортируют сами.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.size = 0
+        self._days = np.empty(capacity, dtype=np.int32)
+        self._months = np.empty(capacity, dtype=np.int32)
+        self._month_days = np.empty(capacity, dtype=np.int8)
+        self._amounts = np.empty(capacity, dtype=np.float64)
+        self._categories = np.empty(capacity, dtype=np.int32)
+        self._expense = np.empty(capacity, dtype=np.bool_)
+
+    @property
+    def days(self) -> np.ndarray:
+        return self._days[:self.size]
+
+    @property
+    def months(self) -> np.ndarray:
+        return self._months[:self.size]
+
+    @property
+    def month_days(self) -> np.ndarray:
+        return self._month_days[:self.size]
+
+    @property
+    def amounts(self) -> np.ndarray:
+        return self._amounts[:self.size]
+
+    @property
+    def categories(self) -> np.ndarray:
+        return self._categories[:self.size]
+
+    @property
+    def expense(self) -> np.ndarray:
+        return self._expense[:self.size]
+
+    def extend(self, days, amounts, categories, expense):
+        """Добавление строк (массивы или последовательности одной длины)"""
+
+        days = np.asarray(days, dtype=np.int32)
+        count = len(days)
+        if not count:
+            return
+
+        needed = self.size + count
+        if needed > len(self._days):
+            capacity = max(needed, 2 * len(self._days))
+            for name in COLUMNS:
+                column = getattr(self, name)
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.size] = column[:self.size]
+                setattr(self, name, grown)
+
+        window = slice(self.size, needed)
+        self._days[window] = days
+        months = _months(days)
+        self._months[window] = months
+        self._month_days[window] = _month_days(days, months)
+        self._amounts[window] = amounts
+        self._categories[window] = categories
+        self._expense[window] = expense
+        self.size = needed
+
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in COLUMNS)
+
+
+def spend_rates(history: UserHistory, today: int) -> Dict[str, float]:
+    """Средний расход в день за 7 и 30 дней до today включительно и за 30 дней до этого"""
+
+    start = today - 59
+    days = history.days
+    recent = history.expense & (days >= start) & (days <= today)
+    daily = np.bincount(days[recent] - start, weights=history.amounts[recent], minlength=60)
+    cumulative = np.concatenate(([0.0], np.cumsum(daily)))
+
+    return {
+        "rate_7": float(cumulative[60] - cumulative[53]) / 7,
+        "rate_30": float(cumulative[60] - cumulative[30]) / 30,
+        "rate_prev_30": float(cumulative[30]) / 30,
+    }
+
+
+def month_forecast(history: UserHistory, today: int, rate: float) -> Dict[str, float]:
+    """Расход месяца на сегодня, прогноз на конец месяца по дневному темпу rate и итог прошлого месяца"""
+
+    month = int(_months(np.array([today]))[0])
+    first_day = _month_first_day(month)
+    days_left = _month_first_day(month + 1) - today - 1
+
+    expense = history.expense
+    months = history.months
+    spent = float(history.amounts[expense & (months == month) & (history.days <= today)].sum())
+    return {
+        "spent": spent,
+        "forecast": spent + rate * days_left,
+        "last_month": float(history.amounts[expense & (months == month - 1)].sum()),
+        "days_left": days_left,
+    }
+
+
+def category_anomalies(history: UserHistory, today: int, months: int = 12,
+                       threshold: float = 2.0) -> List[Dict[str, Any]]:
+    """Категории, где расход с начала месяца выше обычного (z-оценка по прошлым месяцам)
+
+    Сравнение честное по времени: в прошлых месяцах берутся только дни до
+    того же числа. Месяцы до первой операции пользователя не учитываются;
+    нужно минимум три месяца истории.
+    """
+
+    current = int(_months(np.array([today]))[0])
+    history_months = min(months, current - int(history.months.min())) if history.size else 0
+    if history_months < 3:
+        return []
+
+    months = history.months
+    in_window = (
+        history.expense & (months >= current - history_months) & (months <= current)
+        & (history.month_days <= today - _month_first_day(current))
+    )
+    codes = history.categories[in_window]
+    if not len(codes):
+        return []
+    age = current - months[in_window]
+
+    # Матрица категория x месяц (0 - текущий) одним bincount
+    slots = history_months + 1
+    totals = np.bincount(
+        codes * slots + age, weights=history.amounts[in_window],
+        minlength=(int(codes.max()) + 1) * slots
+    ).reshape(-1, slots)
+
+    past = totals[:, 1:]
+    mean = past.mean(axis=1)
+    # Пол стандартного отклонения - чтобы ровные категории не давали огромных z от мелких колебаний
+    std = np.maximum(past.std(axis=1, ddof=1), 0.1 * mean + 1.0)
+    z = (totals[:, 0] - mean) / std
+
+    flagged = np.flatnonzero((z >= threshold) & (mean > 0))
+    return [
+        {"category": int(code), "current": float(totals[code, 0]), "mean": float(mean[code]), "z": float(z[code])}
+        for code in flagged[np.argsort(-z[flagged])]
+    ]
+
+
+def recurring_payments(history: UserHistory, today: int, lookback: int = 180,
+                       min_count: int = 4) -> List[Dict[str, Any]]:
+    """Регулярные платежи: одна категория и сумма до копейки с устойчивым интервалом от недели до месяца
+
+    Строки расходов за lookback дней кодируются в int64 (категория, сумма в
+    копейках, день) и сортируются одним np.sort; группы и статистика
+    интервалов считаются через reduceat без цикла по группам.
+    """
+
+    start = today - lookback
+    days = history.days
+    recent = history.expense & (days >= start) & (days <= today)
+    if np.count_nonzero(recent) < min_count:
+        return []
+
+    cents = np.minimum(np.rint(history.amounts[recent] * 100).astype(np.int64), (1 << _AMOUNT_BITS) - 1)
+    keys = (
+        (history.categories[recent].astype(np.int64) << (_AMOUNT_BITS + _DAY_BITS))
+        | (cents << _DAY_BITS)
+        | (days[recent] - start).astype(np.int64)
+    )
+    keys.sort()
+
+    groups = keys >> _DAY_BITS
+    offsets = keys & ((1 << _DAY_BITS) - 1)
+    starts = np.concatenate(([0], np.flatnonzero(groups[1:] != groups[:-1]) + 1))
+    counts = np.diff(np.append(starts, len(keys)))
+
+    intervals = np.diff(offsets).astype(np.float64)
+    intervals[starts[1:] - 1] = 0.0  # разрывы между группами
+    squares = np.append(intervals ** 2, 0.0)
+
+    first = offsets[starts]
+    last = offsets[starts + counts - 1]
+    steps = np.maximum(counts - 1, 1)
+    period = (last - first) / steps
+    spread = np.sqrt(np.maximum(np.add.reduceat(squares, starts) / steps - period ** 2, 0.0))
+
+    regular = (
+        (counts >= min_count)
+        & (period >= RECURRING_MIN_PERIOD) & (period <= RECURRING_MAX_PERIOD)
+        & (spread <= np.maximum(1.5, 0.1 * period))
+        & (lookback - last <= 1.5 * period)  # платеж еще идет
+    )
+
+    found = []
+    for index in np.flatnonzero(regular):
+        group = int(groups[starts[index]])
+        found.append({
+            "category": group >> _AMOUNT_BITS,
+            "amount": (group & ((1 << _AMOUNT_BITS) - 1)) / 100,
+            "period": float(period[index]),
+            "count": int(counts[index]),
+            "next_day": start + int(last[index]) + int(round(period[index])),
+        })
+    return sorted(found, key=lambda item: item["amount"], reverse=True)
+
+
+def compute_insights(history: UserHistory, today: int, months: int = 12, threshold: float = 2.0) -> Dict[str, Any]:
+    """Все расчеты /insights по истории пользователя"""
+
+    rates = spend_rates(history, today)
+    return {
+        "rows": history.size,
+        **rates,
+        **month_forecast(history, today, rates["rate_30"]),
+        "anomalies": category_anomalies(history, today, months, threshold),
+        "recurring": recurring_payments(history, today),
+    }
+
+
+class SpendingAnalytics:
+    """Аналитика трат по историям пользователей, загруженным в память
+
+    История читается из БД один раз (одним запросом с массивами по
+    категориям) и дальше дополняется на месте: DatabaseManager вызывает
+    append() после коммита каждой записи. В памяти держится не больше
+    ANALYTICS_MAX_USERS историй (LRU). Если запись пришла, пока история
+    пользователя загружается, загруженная копия не кэшируется - следующий
+    запрос перечитает ее (как поколения в ReadThroughCache). Суммы в
+    историях - в рублях по курсу на дату операции (db_manager.fx).
+    """
+
+    def __init__(self, db_manager, max_users: Optional[int] = None,
+                 months: Optional[int] = None, z_threshold: Optional[float] = None):
+        self.db_manager = db_manager
+        self.max_users = max_users or int(os.getenv("ANALYTICS_MAX_USERS", "200"))
+        self.months = months or int(os.getenv("ANALYTICS_ANOMALY_MONTHS", "12"))
+        self.z_threshold = z_threshold or float(os.getenv("ANALYTICS_ANOMALY_Z", "2.0"))
+
+        self.categories: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._histories: "OrderedDict[int, UserHistory]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._generations: Dict[int, int] = {}
+
+        self.loads = 0
+        self.hits = 0
+        self.appended = 0
+
+    def code(self, category: str) -> int:
+        """Код категории (общий для всех пользователей)"""
+        code = self._codes.get(category)
+        if code is None:
+            code = self._codes[category] = len(self.categories)
+            self.categories.append(category)
+        return code
+
+    async def history(self, telegram_id: int) -> UserHistory:
+        """История пользователя из памяти или из БД (одна загрузка на пользователя за раз)"""
+
+        history = self._histories.get(telegram_id)
+        if history is not None:
+            self.hits += 1
+            self._histories.move_to_end(telegram_id)
+            return history
+
+        loading = self._loading.get(telegram_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[telegram_id] = future
+        generation = self._generations.get(telegram_id, 0)
+        try:
+            history = await self._load(telegram_id)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # ошибку получит вызывающий, не "never retrieved"
+            raise
+        finally:
+            self._loading.pop(telegram_id, None)
+
+        if self._generations.get(telegram_id, 0) == generation:
+            self._histories[telegram_id] = history
+            if len(self._histories) > self.max_users:
+                self._histories.popitem(last=False)
+        future.set_result(history)
+        return history
+
+    async def _load(self, telegram_id: int) -> UserHistory:
+        started = time.perf_counter()
+        groups = await self.db_manager.get_history_columns(telegram_id)
+
+        history = UserHistory(max(64, sum(len(group['days']) for group in groups)))
+        for group in groups:
+            days = np.array(group['days'], dtype=np.int32)
+            history.extend(
+                days,
+                np.array(group['amounts'], dtype=np.float64),
+                np.full(len(days), self.code(group['category_or_source']), dtype=np.int32),
+                np.full(len(days), group['type'] == 'expense', dtype=np.bool_)
+            )
+
+        self.loads += 1
+        logger.info(
+            f"✅ История {telegram_id} загружена для аналитики: {history.size} строк "
+            f"за {(time.perf_counter() - started) * 1000:.0f} мс"
+        )
+        return history
+
+    def append(self, records: Iterable[Sequence]):
+        """Новые строки после коммита (формат TRANSACTION_COLUMNS)"""
+
+        by_user: Dict[int, List[Sequence]] = {}
+        for record in records:
+            by_user.setdefault(record[1], []).append(record)
+
+        for telegram_id, rows in by_user.items():
+            history = self._histories.get(telegram_id)
+            if history is None:
+                if telegram_id in self._loading:
+                    self._generations[telegram_id] = self._generations.get(telegram_id, 0) + 1
+                continue
+            history.extend(
+                [to_day(row[7]) for row in rows],
+                self.db_manager.fx.convert_records(rows),
+                [self.code(row[5]) for row in rows],
+                [row[2] == 'expense' for row in rows]
+            )
+            self.appended += len(rows)
+
+    def forget(self, telegram_ids: Iterable[int]):
+        """Сброс историй (например, после смены курсов) - следующий запрос перечитает их из БД"""
+
+        for telegram_id in telegram_ids:
+            self._histories.pop(telegram_id, None)
+            if telegram_id in self._loading:
+                self._generations[telegram_id] = self._generations.get(telegram_id, 0) + 1
+
+    async def insights(self, telegram_id: int, today: Optional[date] = None) -> Dict[str, Any]:
+        """Темп трат, прогноз на конец месяца, аномалии по категориям и регулярные платежи"""
+
+        history = await self.history(telegram_id)
+        # Снимок делит буферы с историей, но размер зафиксирован: строки, дописанные
+        # во время расчета, в него не попадут. Считаем вне цикла событий - на миллионе
+        # строк это десятки миллисекунд
+        snapshot = copy.copy(history)
+        result = await asyncio.to_thread(
+            compute_insights, snapshot, to_day(today or date.today()), self.months, self.z_threshold
+        )
+        for item in result["anomalies"] + result["recurring"]:
+            item["category"] = self.categories[item["category"]]
+        for item in result["recurring"]:
+            item["next_date"] = to_date(item.pop("next_day"))
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": len(self._histories),
+            "rows": sum(history.size for history in self._histories.values()),
+            "bytes": sum(history.nbytes() for history in self._histories.values()),
+            "loads": self.loads,
+            "hits": self.hits,
+            "appended": self.appended,
+        }
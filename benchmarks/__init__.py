@@ -0,0 +1 @@
+"""Бенчмарки и нагрузочные сценарии финансового бота"""
@@ -0,0 +1,184 @@
+"""Бенчмарк аналитики /insights на больших историях
+
+Запуск:
+    python -m benchmarks.analytics_bench --rows 1000000
+    DATABASE_URL=postgresql://... python -m benchmarks.analytics_bench --rows 1000000 --db
+
+В памяти: синтетическая история --rows строк за --days дней с тремя
+подписками и всплеском трат в кафе в текущем месяце. Печатается время
+каждого расчета (темп трат, прогноз, z-оценки категорий, регулярные
+платежи), добавления одной строки и найденные подписки/аномалии.
+
+С --db та же работа идет через PostgreSQL: история пользователя
+генерируется benchmarks.seed, замеряются первая загрузка в колонки,
+/insights из памяти, запрос "категория x месяц" в SQL для сравнения и
+дописывание истории после save_transaction.
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import date, datetime
+
+import numpy as np
+
+from analytics import (
+    UserHistory, SpendingAnalytics, category_anomalies, compute_insights, month_forecast,
+    recurring_payments, spend_rates, to_day
+)
+from models import EXPENSE_CATEGORIES
+
+ANALYTICS_USER_ID = 950_000_001
+
+SUBSCRIPTIONS = (("Связь", 700.0, 30), ("Развлечения", 299.0, 30), ("Спорт", 3500.0, 28))
+
+
+def synthetic_history(rows: int, days: int, today: int, seed: int = 20):
+    """История с шумом, подписками и всплеском "Кафе/Рестораны" в текущем месяце; возвращает (история, категории)"""
+
+    rng = np.random.default_rng(seed)
+    categories = list(EXPENSE_CATEGORIES) + ["Зарплата"]
+    salary = len(categories) - 1
+
+    history = UserHistory(rows)
+    day_numbers = today - rng.integers(0, days, rows)
+    codes = rng.integers(0, len(EXPENSE_CATEGORIES), rows)
+    amounts = np.round(rng.lognormal(6.0, 1.0, rows), 2)
+    income = rng.random(rows) < 0.02
+    codes[income] = salary
+    history.extend(day_numbers, amounts, codes, ~income)
+
+    for name, amount, period in SUBSCRIPTIONS:
+        paid = np.arange(today - days + period, today + 1, period)
+        history.extend(paid, np.full(len(paid), amount), np.full(len(paid), categories.index(name)),
+                       np.ones(len(paid), dtype=bool))
+
+    # Всплеск: втрое больше обычного в кафе с начала текущего месяца
+    month_start = to_day(date.today().replace(day=1))
+    cafe = categories.index("Кафе/Рестораны")
+    mask = (history.categories == cafe) & (history.days >= month_start) & history.expense
+    extra = int(mask.sum()) * 2
+    history.extend(
+        rng.integers(month_start, today + 1, extra), np.round(rng.lognormal(6.0, 1.0, extra), 2),
+        np.full(extra, cafe), np.ones(extra, dtype=bool)
+    )
+    return history, categories
+
+
+def timed(function, repeat: int) -> float:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies)
+
+
+def in_memory(args):
+    today = to_day(date.today())
+    started = time.perf_counter()
+    history, categories = synthetic_history(args.rows, args.days, today)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    print(f"в памяти: {history.size} строк за {args.days} дней, "
+          f"{history.nbytes() / 1024 / 1024:.1f} МБ колонок, генерация {build_ms:.0f} мс")
+    rates = spend_rates(history, today)
+    steps = {
+        "темп трат 7/30 дней": lambda: spend_rates(history, today),
+        "прогноз на месяц": lambda: month_forecast(history, today, rates["rate_30"]),
+        "z-оценки категорий": lambda: category_anomalies(history, today),
+        "регулярные платежи": lambda: recurring_payments(history, today),
+        "все /insights": lambda: compute_insights(history, today),
+    }
+    for title, function in steps.items():
+        print(f"  {title:<22} {timed(function, args.repeat):8.1f} мс")
+
+    one = UserHistory(history.size)
+    one.extend(history.days, history.amounts, history.categories, history.expense)
+    appended = timed(lambda: one.extend([today], [150.0], [0], [True]), args.repeat * 20)
+    print(f"  {'добавление строки':<22} {appended * 1000:8.1f} мкс")
+
+    insights = compute_insights(history, today)
+    for item in insights["recurring"]:
+        print(f"  подписка: {categories[item['category']]} {item['amount']:.0f} RUB раз в {item['period']:.1f} дн.")
+    for item in insights["anomalies"]:
+        print(f"  аномалия: {categories[item['category']]} {item['current']:.0f} RUB "
+              f"при обычных {item['mean']:.0f} (z={item['z']:.1f})")
+
+
+async def with_database(args):
+    from database import DatabaseManager
+    from benchmarks.seed import seed_user
+
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+    try:
+        if not args.skip_seed:
+            started = time.perf_counter()
+            await seed_user(db_manager, ANALYTICS_USER_ID, args.rows, args.days)
+            print(f"PostgreSQL: {args.rows} строк сгенерировано за {time.perf_counter() - started:.1f} с")
+
+        loads = []
+        for _ in range(3):
+            analytics = SpendingAnalytics(db_manager)
+            db_manager.analytics = analytics
+            started = time.perf_counter()
+            history = await analytics.history(ANALYTICS_USER_ID)
+            loads.append((time.perf_counter() - started) * 1000)
+        print(f"  загрузка истории в колонки  {statistics.median(loads):8.1f} мс ({history.size} строк)")
+
+        warm = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            await analytics.insights(ANALYTICS_USER_ID)
+            warm.append((time.perf_counter() - started) * 1000)
+        print(f"  /insights из памяти         {statistics.median(warm):8.1f} мс")
+
+        async with db_manager.pool.acquire() as conn:
+            sql = []
+            for _ in range(3):
+                started = time.perf_counter()
+                await conn.fetch("""
+                    SELECT category_or_source, date_trunc('month', transaction_date) AS month, SUM(amount)
+                    FROM transactions
+                    WHERE telegram_id = $1 AND type = 'expense'
+                      AND transaction_date >= date_trunc('month', NOW()) - INTERVAL '12 months'
+                      AND EXTRACT(day FROM transaction_date) <= EXTRACT(day FROM NOW())
+                    GROUP BY 1, 2
+                """, ANALYTICS_USER_ID)
+                sql.append((time.perf_counter() - started) * 1000)
+        print(f"  SQL: категория x месяц      {statistics.median(sql):8.1f} мс (только одна из четырех метрик)")
+
+        before = history.size
+        saved = []
+        for _ in range(20):
+            started = time.perf_counter()
+            await db_manager.save_transaction(ANALYTICS_USER_ID, {
+                "type": "expense", "amount": 150.0, "category_or_source": "Кафе/Рестораны", "date": datetime.now()
+            })
+            saved.append((time.perf_counter() - started) * 1000)
+        history = await analytics.history(ANALYTICS_USER_ID)
+        print(f"  save_transaction + дописать {statistics.median(saved):8.1f} мс, строк в памяти "
+              f"{before} -> {history.size}, загрузок из БД {analytics.loads}")
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--db", action="store_true", help="замерить загрузку и /insights через PostgreSQL")
+    parser.add_argument("--skip-seed", action="store_true", help="не пересоздавать историю в БД")
+    args = parser.parse_args()
+
+    in_memory(args)
+    if args.db:
+        asyncio.run(with_database(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Бенчмарк выгрузки истории (/export)
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.export_bench --transactions 10000 100000 1000000
+
+Для каждого размера истории засевает пользователя и выгружает его историю
+в CSV через серверный курсор. Печатает время, размер файла и пиковую
+память Python (tracemalloc, отдельным проходом). Для сравнения - пик памяти
+при чтении той же истории списком через get_user_transactions(limit=N).
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+
+from database import DatabaseManager
+from exporter import export_transactions
+from benchmarks.seed import seed_user
+
+EXPORT_USER_ID = 970_000_001
+
+
+async def export_once(db_manager, export_format):
+    with tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024) as buffer:
+        count = await export_transactions(db_manager, EXPORT_USER_ID, export_format, buffer)
+        return count, buffer.tell()
+
+
+async def traced_peak(coroutine_factory):
+    tracemalloc.start()
+    await coroutine_factory()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+async def run(args):
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+
+    print(f"{'операций':>10} {'время':>8} {'строк/с':>10} {'файл':>9} {'пик /export':>12} {'пик списком':>12}")
+    try:
+        for transactions in args.transactions:
+            await seed_user(db_manager, EXPORT_USER_ID, transactions)
+
+            started = time.perf_counter()
+            count, size = await export_once(db_manager, args.format)
+            elapsed = time.perf_counter() - started
+
+            export_peak = await traced_peak(lambda: export_once(db_manager, args.format))
+            list_peak = await traced_peak(lambda: db_manager.get_user_transactions(EXPORT_USER_ID, limit=transactions))
+
+            print(
+                f"{count:>10} {elapsed:>7.2f}с {count / elapsed:>10.0f} {size / 1024 / 1024:>7.1f}МБ "
+                f"{export_peak:>10.1f}МБ {list_peak:>10.1f}МБ"
+            )
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
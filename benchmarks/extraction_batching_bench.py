@@ -0,0 +1,111 @@
+"""Бенчмарк пакетного извлечения: операций на вызов модели и задержка под нагрузкой
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.extraction_batching_bench --rate 40 --windows 50 200
+
+Сообщения приходят с постоянной частотой --rate в секунду от разных
+пользователей (открытая нагрузка, как в боте); доля --multi содержит 2-3
+операции ("кофе 150, такси 400"). Поток прогоняется без окна группировки и с
+каждым окном из --windows (LLM_BATCH_WINDOW_MS). Модель-заглушка отвечает за
+--latency секунд плюс --item-latency на каждую операцию в ответе; вызовы
+ограничены LLM_MAX_CONCURRENCY, как в проде. Кэш извлечений выключен.
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+from database import DatabaseManager
+from agent import FinancialAgent
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.llm_load import percentile
+
+BATCH_USER_BASE = 985_000_000
+
+ITEMS = ("шаурма", "озон", "стирка", "ключи", "самокат", "парикмахер", "ашан", "подписка", "хозтовары")
+
+
+def message_stream(count: int, multi_share: float, seed: int = 16):
+    random_ = random.Random(seed)
+    for index in range(count):
+        items = random_.choice((2, 3)) if random_.random() < multi_share else 1
+        parts = [f"{random_.choice(ITEMS)} {random_.randint(1, 60) * 10}" for _ in range(items)]
+        yield index, "Заплатил за " + ", ".join(parts)
+
+
+async def replay(agent, args):
+    latencies = []
+
+    async def one(index, text):
+        started = time.perf_counter()
+        await agent.process_message(text, BATCH_USER_BASE + index % args.users)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    tasks = []
+    started = time.perf_counter()
+    for index, text in message_stream(args.messages, args.multi):
+        tasks.append(asyncio.create_task(one(index, text)))
+        # Открытая нагрузка: следующее сообщение приходит по расписанию, не дожидаясь ответа
+        await asyncio.sleep(max(0.0, started + (index + 1) / args.rate - time.perf_counter()))
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - started
+
+
+async def count_rows(db_manager, args) -> int:
+    async with db_manager.pool.acquire() as conn:
+        return await conn.fetchval(
+            "SELECT count(*) FROM transactions WHERE telegram_id >= $1 AND telegram_id < $2",
+            BATCH_USER_BASE, BATCH_USER_BASE + args.users
+        )
+
+
+async def run(args):
+    os.environ["EXTRACTION_CACHE_ENABLED"] = "false"
+
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+
+    try:
+        print(
+            f"{args.messages} сообщений, {args.rate:.0f}/с, {args.multi:.0%} с несколькими операциями, "
+            f"задержка модели {args.latency} с + {args.item_latency * 1000:.0f} мс/операция, "
+            f"LLM_MAX_CONCURRENCY={os.getenv('LLM_MAX_CONCURRENCY', '8')}"
+        )
+        for window in [0, *args.windows]:
+            os.environ["LLM_BATCH_WINDOW_MS"] = str(window)
+            model = FakeChatModel(latency=args.latency, item_latency=args.item_latency)
+            agent = FinancialAgent(db_manager, model=model)
+
+            rows_before = await count_rows(db_manager, args)
+            latencies, elapsed = await replay(agent, args)
+            saved = await count_rows(db_manager, args) - rows_before
+
+            title = f"окно {window} мс" if window else "без группировки"
+            print(
+                f"  {title:<16} вызовов модели {model.calls:>5}  операций {saved:>5}  "
+                f"{saved / max(model.calls, 1):5.1f} оп./вызов  "
+                f"p50 {statistics.median(latencies):7.0f} мс  p95 {percentile(latencies, 95):7.0f} мс  "
+                f"p99 {percentile(latencies, 99):7.0f} мс  всего {elapsed:5.1f} с"
+            )
+    finally:
+        os.environ.pop("LLM_BATCH_WINDOW_MS", None)
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=40, help="сообщений в секунду")
+    parser.add_argument("--multi", type=float, default=0.3, help="доля сообщений с несколькими операциями")
+    parser.add_argument("--latency", type=float, default=0.8)
+    parser.add_argument("--item-latency", type=float, default=0.02)
+    parser.add_argument("--windows", type=int, nargs="+", default=[50, 200], help="окна группировки, мс")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Бенчмарк кэша извлечений: повторяющиеся формулировки с разными суммами
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.extraction_cache_bench --messages 2000 --latency 0.8
+
+Поток сообщений, которые быстрый парсер не разбирает: пользователи каждый день
+пишут одни и те же фразы ("Потратил 250 на шаурму") с разными суммами, часть
+сообщений уникальна. Поток прогоняется без кэша и с кэшем (модель-заглушка с
+задержкой --latency); печатаются число вызовов модели, доля попаданий и задержка.
+С --persist второй прогон с кэшем идет на новом агенте - попадания берутся
+из таблицы extraction_cache, как после перезапуска.
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+from database import DatabaseManager
+from agent import FinancialAgent
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.llm_load import percentile
+
+CACHE_USER_BASE = 980_000_000
+
+PHRASES = (
+    "Потратил {n} на шаурму", "Заплатил {n} за озон", "Купил вейп за {n}",
+    "Потратил {n} во вкусно и точка", "Заплатил {n} за стирку", "Потратил {n} на wildberries",
+    "Заплатил {n} за ключи", "Купил {n} рублей самокат на час", "Заплатил {n} за парикмахера Ане",
+    "Потратил {n} на шаверму у метро", "Заплатил за яндекс плюс {n}", "Потратил {n} в ашане",
+)
+
+
+def message_stream(count: int, unique_share: float, seed: int = 11):
+    random_ = random.Random(seed)
+    for index in range(count):
+        amount = random_.randint(1, 60) * 10
+        if random_.random() < unique_share:
+            yield index, f"Потратил {amount} на штуку номер {index} для дачи и всякое разное"
+        else:
+            yield index, random_.choice(PHRASES).format(n=amount)
+
+
+async def replay(agent, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(index, text):
+        async with semaphore:
+            started = time.perf_counter()
+            await agent.process_message(text, CACHE_USER_BASE + index % args.users)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index, text) for index, text in message_stream(args.messages, args.unique)))
+    return latencies, time.perf_counter() - started
+
+
+async def run(args):
+    if args.persist:
+        os.environ["EXTRACTION_CACHE_PERSIST"] = "true"
+
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+
+    try:
+        async with db_manager.pool.acquire() as conn:
+            await conn.execute("DELETE FROM extraction_cache")
+
+        runs = [("без кэша", False), ("с кэшем", True)]
+        if args.persist:
+            runs.append(("после перезапуска", True))
+
+        print(f"{args.messages} сообщений, {args.unique:.0%} уникальных, задержка модели {args.latency} с")
+        for title, enabled in runs:
+            model = FakeChatModel(latency=args.latency)
+            agent = FinancialAgent(db_manager, model=model)
+            if not enabled:
+                agent.extraction_cache = None
+
+            latencies, elapsed = await replay(agent, args)
+            cache = agent.extraction_cache.stats() if agent.extraction_cache else None
+            hit_ratio = f"{cache['hit_ratio']:.0%} (из БД {cache['db_hits']})" if cache else "—"
+            print(
+                f"  {title:<18} вызовов модели {model.calls:>5}  попаданий {hit_ratio:<16} "
+                f"p50 {statistics.median(latencies):7.1f} мс  p95 {percentile(latencies, 95):7.1f} мс  "
+                f"всего {elapsed:5.1f} с"
+            )
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--unique", type=float, default=0.2, help="доля уникальных сообщений")
+    parser.add_argument("--latency", type=float, default=0.8)
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных сообщений (как LLM_MAX_CONCURRENCY)")
+    parser.add_argument("--persist", action="store_true", help="проверить кэш в Postgres после перезапуска")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import re
+import json
+import asyncio
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_AMOUNT_RE = re.compile(r"\d+(?:[.,]\d+)?")
+_SEGMENT_RE = re.compile(r",\s+|;\s*|\s+и\s+")
+_INCOME_WORDS = ("получил", "зарплат", "доход", "премия")
+
+
+class FakeChatModel(BaseChatModel):
+    """Детерминированная модель-заглушка для Trustcall экстрактора
+    
+    Вместо обращения к OpenAI ждет `latency` секунд и возвращает вызов
+    инструмента Transaction, собранный из текста последнего сообщения пользователя:
+    по одной операции на фрагмент с суммой ("кофе 150, такси 400"). Для
+    BatchTransaction разбирает JSON-список сообщений пакета.
+    """
+    
+    latency: float = 0.5
+    # Добавка к задержке за каждую операцию в ответе (генерация токенов)
+    item_latency: float = 0.0
+    calls: int = 0
+    
+    @property
+    def _llm_type(self) -> str:
+        return "fake-transaction-model"
+    
+    def bind_tools(self, tools: List[Any], tool_choice: Optional[str] = None, **kwargs):
+        return self.bind(tool_choice=tool_choice, **kwargs)
+    
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        result = self._respond(messages, kwargs.get("tool_choice"))
+        time.sleep(self._latency(result))
+        return result
+    
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        result = self._respond(messages, kwargs.get("tool_choice"))
+        await asyncio.sleep(self._latency(result))
+        return result
+    
+    def _latency(self, result: ChatResult) -> float:
+        return self.latency + self.item_latency * len(result.generations[0].message.tool_calls)
+    
+    def _respond(self, messages: List[BaseMessage], tool_choice: Optional[str] = None) -> ChatResult:
+        self.calls += 1
+        
+        user_text = next(
+            (m.content for m in reversed(messages) if isinstance(m, HumanMessage)),
+            messages[-1].content
+        )
+        
+        if tool_choice == "BatchTransaction":
+            tool_calls = []
+            for item in json.loads(user_text):
+                for segment in self._segments(item["text"]):
+                    tool_calls.append(
+                        self._tool_call("BatchTransaction", segment, len(tool_calls), message=item["id"])
+                    )
+        else:
+            tool_calls = [
+                self._tool_call("Transaction", segment, index)
+                for index, segment in enumerate(self._segments(user_text))
+            ]
+        
+        message = AIMessage(content="", tool_calls=tool_calls)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    @staticmethod
+    def _segments(text: str) -> List[str]:
+        segments = [segment for segment in _SEGMENT_RE.split(text) if _AMOUNT_RE.search(segment)]
+        return segments or [text]
+    
+    def _tool_call(self, name: str, text: str, index: int, **extra) -> dict:
+        text_lower = text.lower()
+        match = _AMOUNT_RE.search(text)
+        amount = float(match.group().replace(",", ".")) if match else 100.0
+        is_income = any(word in text_lower for word in _INCOME_WORDS)
+        
+        return {
+            "name": name,
+            "args": {
+                "type": "income" if is_income else "expense",
+                "amount": amount,
+                "currency": "RUB",
+                "category_or_source": "Зарплата" if is_income else "Другое",
+                **extra
+            },
+            "id": f"call_{self.calls}_{index}",
+        }
@@ -0,0 +1,62 @@
+"""Заглушка Telegram Bot API для стендов: ответы без сети и апдейты из текста"""
+
+import json
+import time
+from typing import Dict, List, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+
+class FakeTelegramRequest(BaseRequest):
+    """HTTP-клиент Telegram, отвечающий локально без сети"""
+
+    def __init__(self):
+        self.sent: Dict[int, List[Tuple[float, str]]] = {}
+        self._message_id = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data: RequestData = None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif api_method == "sendMessage":
+            chat_id = int(parameters["chat_id"])
+            self.sent.setdefault(chat_id, []).append((time.perf_counter(), parameters.get("text", "")))
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": parameters.get("text", "")
+            }
+        else:
+            result = True
+
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def make_update(bot, update_id: int, chat_id: int, text: str) -> Update:
+    payload = {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": text,
+        },
+    }
+    if text.startswith("/"):
+        payload["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return Update.de_json(payload, bot)
@@ -0,0 +1,72 @@
+"""Бенчмарк быстрого парсера на размеченном корпусе
+
+Запуск:
+    python -m benchmarks.fast_parser_bench --llm-latency 1.2 --llm-cost 0.00015
+
+Показывает долю сообщений, разобранных без LLM, точность этих разборов,
+стоимость разбора и оценку сэкономленных времени и денег на 1000 сообщений.
+"""
+
+import os
+import time
+import argparse
+
+from fast_parser import FastTransactionParser
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "corpus", "transactions.tsv")
+
+
+def load_corpus(path: str = CORPUS_PATH):
+    """Строки корпуса: (текст, ожидаемая транзакция или None)"""
+    corpus = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            text, expected_type, amount, category = (line.rstrip("\n").split("\t") + [""] * 3)[:4]
+            expected = (expected_type, float(amount), category) if expected_type else None
+            corpus.append((text, expected))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency", type=float, default=1.2, help="средняя задержка Trustcall вызова, сек")
+    parser.add_argument("--llm-cost", type=float, default=0.00015, help="стоимость одного вызова, USD")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    fast_parser = FastTransactionParser()
+
+    correct, wrong = 0, []
+    for text, expected in corpus:
+        transaction = fast_parser.parse(text)
+        if transaction is None:
+            continue
+        got = (transaction.type, transaction.amount, transaction.category_or_source)
+        if got == expected:
+            correct += 1
+        else:
+            wrong.append((text, got, expected))
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for text, _ in corpus:
+            fast_parser.parse_with_confidence(text)
+    per_message_us = (time.perf_counter() - started) / (args.repeat * len(corpus)) * 1e6
+
+    stats = fast_parser.stats()
+    hits_per_1k = stats["hit_rate"] * 1000
+    print(f"сообщений в корпусе:      {len(corpus)}")
+    print(f"разобрано без LLM:        {stats['hits']} ({stats['hit_rate']:.1%})")
+    print(f"точность на попаданиях:   {correct / max(stats['hits'], 1):.1%}")
+    print(f"время разбора:            {per_message_us:.1f} мкс/сообщение")
+    print(f"экономия на 1k сообщений: {hits_per_1k * args.llm_latency:.0f} сек LLM, "
+          f"${hits_per_1k * args.llm_cost:.4f}")
+    for text, got, expected in wrong:
+        print(f"  ошибка: {text!r}: {got} вместо {expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Бенчмарк пересчета сумм в рубли по курсам валют
+
+Запуск:
+    python -m benchmarks.fx_bench --batch 1000 --foreign 0.1
+    DATABASE_URL=postgresql://... python -m benchmarks.fx_bench --db --rows 200000
+
+В памяти: пакет из --batch строк формата TRANSACTION_COLUMNS, доля
+--foreign из них в USD/EUR/CNY. Сравнивается пересчет построчным циклом
+(FxRates.to_base на каждую строку) с векторным convert_records, который
+идет на запись в агрегаты, и пересчет миллиона строк колонками.
+
+С --db у синтетического пользователя (--rows строк) доля --foreign
+операций переводится в валюту, и запросы за период (balance_period,
+expenses_by_category_period) с пересчетом по курсу на дату сравниваются
+с прежним суммированием сырых сумм. Отдельно - те же запросы, когда все
+операции в рублях (цена CASE без вызовов fx_rate).
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from fx_rates import FxRates, read_rates
+
+FX_USER_ID = 950_000_021
+FOREIGN = ("USD", "EUR", "CNY")
+
+RAW_QUERIES = {
+    "balance_period": """
+        SELECT
+            COALESCE(SUM(amount) FILTER (WHERE type = 'income'), 0) AS total_income,
+            COALESCE(SUM(amount) FILTER (WHERE type = 'expense'), 0) AS total_expense,
+            COUNT(*) AS transaction_count
+        FROM transactions
+        WHERE telegram_id = $1 AND transaction_date >= $2 AND transaction_date < $3
+    """,
+    "expenses_by_category_period": """
+        SELECT category_or_source, SUM(amount) as total
+        FROM transactions
+        WHERE telegram_id = $1 AND type = 'expense'
+          AND transaction_date >= $2 AND transaction_date < $3
+        GROUP BY category_or_source
+        ORDER BY total DESC
+    """,
+}
+
+
+def synthetic_records(count: int, foreign: float, seed: int = 21):
+    rng = random.Random(seed)
+    now = datetime.now()
+    return [
+        (
+            None, FX_USER_ID, "expense", round(rng.uniform(50, 5000), 2),
+            rng.choice(FOREIGN) if rng.random() < foreign else "RUB",
+            "Продукты", None, now - timedelta(days=rng.randrange(900))
+        )
+        for _ in range(count)
+    ]
+
+
+def timed_us(function, repeat: int) -> float:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(latencies)
+
+
+def in_memory(args, fx: FxRates):
+    print(f"курсов в памяти: {len(fx)} ({', '.join(fx.currencies)})")
+    for foreign in sorted({0.0, args.foreign}):
+        records = synthetic_records(args.batch, foreign)
+        loop = timed_us(lambda: [fx.to_base(r[3], r[4], r[7]) for r in records], args.repeat)
+        vector = timed_us(lambda: fx.convert_records(records), args.repeat)
+        expected = np.array([fx.to_base(r[3], r[4], r[7]) for r in records])
+        assert np.allclose(fx.convert_records(records), expected)
+        print(f"  пакет {args.batch}, в валюте {foreign:4.0%}: построчно {loop / args.batch:6.2f} мкс/строка, "
+              f"convert_records {vector / args.batch:6.2f} мкс/строка")
+
+    rows = 1_000_000
+    rng = np.random.default_rng(21)
+    amounts = np.round(rng.uniform(50, 5000, rows), 2)
+    currencies = np.where(rng.random(rows) < args.foreign, rng.choice(FOREIGN, rows), "RUB").astype(object)
+    days = rng.integers(19_000, 20_300, rows)
+    columns = timed_us(lambda: fx.convert(amounts, currencies, days), 5)
+    print(f"  колонки, {rows} строк, в валюте {args.foreign:.0%}: {columns / 1000:6.1f} мс")
+
+
+async def with_database(args):
+    from database import DatabaseManager, HOT_QUERIES
+    from benchmarks.seed import seed_user
+
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+    try:
+        await seed_user(db_manager, FX_USER_ID, args.rows, args.days)
+        period = (datetime.now() - timedelta(days=args.days + 1), datetime.now() + timedelta(days=1))
+
+        async def measure(query: str) -> float:
+            latencies = []
+            async with db_manager.pool.acquire() as conn:
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    await conn.fetch(query, FX_USER_ID, *period)
+                    latencies.append((time.perf_counter() - started) * 1000)
+            return statistics.median(latencies)
+
+        async def report(title: str):
+            print(f"PostgreSQL, {args.rows} строк, {title}:")
+            for name, raw in RAW_QUERIES.items():
+                print(f"  {name:<28} сырые суммы {await measure(raw):7.1f} мс, "
+                      f"в рублях {await measure(HOT_QUERIES[name]):7.1f} мс")
+
+        await report("все в рублях")
+
+        async with db_manager.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE transactions SET currency = ($2::text[])[1 + (hashtext(id::text) & 1023) % 3]
+                WHERE telegram_id = $1 AND (hashtext(id::text) & 1023) < $3 * 1024
+            """, FX_USER_ID, list(FOREIGN), args.foreign)
+            await conn.execute("ANALYZE transactions")
+        await db_manager.reconcile_balances(FX_USER_ID)
+        await db_manager.rebuild_rollups(FX_USER_ID)
+        await report(f"в валюте {args.foreign:.0%}")
+
+        balance = await db_manager.get_balance(FX_USER_ID)
+        in_period = await db_manager.get_balance(FX_USER_ID, *period)
+        print(f"  баланс из агрегатов {balance['balance']:.2f}, за период из transactions {in_period['balance']:.2f}")
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--foreign", type=float, default=0.1, help="доля операций в валюте")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--db", action="store_true", help="замерить запросы за период в PostgreSQL")
+    args = parser.parse_args()
+
+    in_memory(args, FxRates(read_rates()))
+    if args.db:
+        asyncio.run(with_database(args))
+
+
+if __name__ == "__main__":
+    main()
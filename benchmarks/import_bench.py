@@ -0,0 +1,103 @@
+"""Бенчмарк импорта банковской выписки
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.import_bench --rows 100000
+
+Генерирует CSV в формате выгрузки банка (cp1251, ';', суммы с запятой) во
+временный файл, импортирует его через StatementImporter, затем импортирует
+повторно - все строки должны оказаться дублями. Печатает время обоих
+проходов и пиковую память Python (tracemalloc) еще одного повторного прохода -
+трассировка памяти сильно замедляет разбор, поэтому время меряется без нее.
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+from database import DatabaseManager
+from importer import StatementImporter
+
+IMPORT_USER_ID = 960_000_001
+
+BANK_CATEGORIES = (
+    "Супермаркеты", "Рестораны", "Такси", "Аптеки", "Мобильная связь", "Одежда и обувь",
+    "Кино", "Топливо", "Фастфуд", "Переводы", "Разное"
+)
+
+
+def write_statement(path: str, rows: int, seed: int = 7):
+    """CSV-выписка на rows операций за последние два года"""
+
+    random_ = random.Random(seed)
+    started = datetime.now() - timedelta(days=730)
+    step = timedelta(days=730) / rows
+
+    with open(path, "w", encoding="cp1251", newline="") as statement:
+        statement.write("Дата операции;Статус;Сумма операции;Валюта операции;Категория;Описание\r\n")
+        for index in range(rows):
+            date = started + step * index
+            if index % 25 == 0:
+                amount, category, description = random_.randint(30000, 90000), "Зарплата", "ООО Ромашка"
+            else:
+                amount = -random_.randint(50, 5000) - random_.randint(0, 99) / 100
+                category = random_.choice(BANK_CATEGORIES)
+                description = f"Покупка {category.lower()} #{random_.randint(1, 300)}"
+            status = "FAILED" if index % 500 == 0 else "OK"
+            amount = f"{amount:.2f}".replace(".", ",")
+            statement.write(f"{date:%d.%m.%Y %H:%M:%S};{status};{amount};RUB;{category};{description}\r\n")
+
+
+async def import_once(importer, path):
+    with open(path, "rb") as raw:
+        return await importer.import_file(IMPORT_USER_ID, raw, os.path.basename(path))
+
+
+async def run(args):
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+    importer = StatementImporter(db_manager, chunk_size=args.chunk_size)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "statement.csv")
+        write_statement(path, args.rows)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        try:
+            async with db_manager.pool.acquire() as conn:
+                await conn.execute("DELETE FROM transactions WHERE telegram_id = $1", IMPORT_USER_ID)
+                await conn.execute("DELETE FROM monthly_rollups WHERE telegram_id = $1", IMPORT_USER_ID)
+                await conn.execute("DELETE FROM user_balances WHERE telegram_id = $1", IMPORT_USER_ID)
+
+            print(f"выписка: {args.rows} строк, {size_mb:.1f} МБ, пакеты по {importer.chunk_size}")
+            for title in ("первый импорт", "повторный импорт"):
+                started = time.perf_counter()
+                stats = await import_once(importer, path)
+                elapsed = time.perf_counter() - started
+                print(f"  {title:<18} {elapsed:6.2f} с  {args.rows / elapsed:9.0f} строк/с  {stats}")
+
+            tracemalloc.start()
+            await import_once(importer, path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  пик памяти Python при импорте: {peak / 1024 / 1024:.1f} МБ")
+
+            balance = await db_manager.get_balance(IMPORT_USER_ID)
+            print(f"  операций в балансе: {balance['transaction_count']}")
+        finally:
+            await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Бенчмарк классификатора намерений: локальная модель против ключевых слов
+
+Запуск:
+    python -m benchmarks.intent_bench --batch 256 --repeat 50
+
+Модель обучается на data/intents.tsv и проверяется на отложенных
+формулировках benchmarks/corpus/intents.tsv плюс все сообщения
+corpus/transactions.tsv (намерение "transaction"). Печатаются точность по
+намерениям для обоих классификаторов, ошибки модели, кросс-валидация на
+обучающем корпусе (--folds), время обучения и классификации одного сообщения
+и пакета из --batch, а также доля сообщений, разобранных быстрым парсером
+без LLM, с подсказкой категории от модели и без нее.
+"""
+
+import os
+import time
+import random
+import argparse
+from collections import Counter
+
+from fast_parser import FastTransactionParser
+from intent_classifier import INTENTS, IntentClassifier, KeywordClassifier, load_corpus
+from benchmarks.fast_parser_bench import load_corpus as load_transactions
+
+HOLDOUT_PATH = os.path.join(os.path.dirname(__file__), "corpus", "intents.tsv")
+
+
+def holdout():
+    """Отложенная выборка: (текст, намерение, "тип:категория" или "")"""
+    rows = load_corpus(HOLDOUT_PATH)
+    for text, expected in load_transactions():
+        rows.append((text, "transaction", f"{expected[0]}:{expected[2]}" if expected else ""))
+    return rows
+
+
+def accuracy(classifier, rows):
+    predicted = classifier.predict([text for text, _, _ in rows])
+    total, correct = Counter(), Counter()
+    for (_, intent, _), got in zip(rows, predicted):
+        total[intent] += 1
+        correct[intent] += got == intent
+    return sum(correct.values()) / len(rows), {intent: correct[intent] / total[intent] for intent in total}, predicted
+
+
+def cross_validate(rows, folds: int, seed: int = 19) -> float:
+    rows = list(rows)
+    random.Random(seed).shuffle(rows)
+    correct = 0
+    for fold in range(folds):
+        test = rows[fold::folds]
+        train = [row for index, row in enumerate(rows) if index % folds != fold]
+        predicted = IntentClassifier.train(train).predict([text for text, _, _ in test])
+        correct += sum(got == intent for (_, intent, _), got in zip(test, predicted))
+    return correct / len(rows)
+
+
+def per_message_us(function, texts, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function(texts)
+    return (time.perf_counter() - started) / (repeat * len(texts)) * 1e6
+
+
+def fast_parser_coverage(parser, rows):
+    hits = correct = 0
+    for text, _, label in rows:
+        transaction = parser.parse(text)
+        if transaction is None:
+            continue
+        hits += 1
+        correct += f"{transaction.type}:{transaction.category_or_source}" == label
+    return hits, correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=256, help="размер пакета для пакетной классификации")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--folds", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    rows = holdout()
+
+    started = time.perf_counter()
+    model = IntentClassifier.train(corpus)
+    train_ms = (time.perf_counter() - started) * 1000
+    keywords = KeywordClassifier()
+
+    print(f"обучающий корпус: {len(corpus)} строк, отложенная выборка: {len(rows)} строк, "
+          f"обучение {train_ms:.0f} мс")
+    print(f"  {'':<12} {'всего':>7}" + "".join(f" {intent:>15}" for intent in INTENTS))
+    for title, classifier in (("ключевые", keywords), ("модель", model)):
+        total, per_intent, _ = accuracy(classifier, rows)
+        print(f"  {title:<12} {total:7.1%}" + "".join(f" {per_intent.get(intent, 0):15.1%}" for intent in INTENTS))
+
+    _, _, predicted = accuracy(model, rows)
+    for (text, intent, _), got in zip(rows, predicted):
+        if got != intent:
+            print(f"  ошибка модели: {text!r}: {got} вместо {intent}")
+
+    if args.folds > 1:
+        print(f"кросс-валидация на обучающем корпусе ({args.folds} частей): {cross_validate(corpus, args.folds):.1%}")
+
+    texts = [text for text, _, _ in rows]
+    batch = (texts * (args.batch // len(texts) + 1))[:args.batch]
+    # Прогрев: таблица вкладов токенов заполняется при первой встрече слова
+    model.predict(batch)
+    print("время классификации, мкс/сообщение:")
+    print(f"  ключевые слова:          {per_message_us(lambda items: [keywords.predict_one(t) for t in items], texts, args.repeat):6.2f}")
+    print(f"  модель, по одному:       {per_message_us(lambda items: [model.predict_one(t) for t in items], texts, args.repeat):6.2f}")
+    print(f"  модель, пакет {args.batch:<5}      {per_message_us(model.predict, batch, args.repeat):6.2f}")
+
+    categorized = [row for row in rows if row[2]]
+    print(f"быстрый парсер на {len(categorized)} операциях с категорией:")
+    for title, fast_parser in (("словари", FastTransactionParser()),
+                               ("словари + модель", FastTransactionParser(classifier=model))):
+        hits, correct = fast_parser_coverage(fast_parser, categorized)
+        print(f"  {title:<17} без LLM {hits:>4} ({hits / len(categorized):5.1%}), "
+              f"верных {correct / max(hits, 1):5.1%}")
+
+
+if __name__ == "__main__":
+    main()
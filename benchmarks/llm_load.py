@@ -0,0 +1,82 @@
+"""Нагрузочный тест: задержка команд без LLM при множестве параллельных извлечений
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.llm_load --extractions 200 --latency 1.0
+
+Сначала измеряется задержка запроса баланса без нагрузки, затем - пока
+`--extractions` транзакций ждут ответа модели-заглушки. При неблокирующем
+извлечении p99 в обоих замерах должен быть сопоставим.
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+from database import DatabaseManager
+from agent import FinancialAgent
+from benchmarks.fake_llm import FakeChatModel
+
+BALANCE_USER_ID = 900_000_001
+EXTRACTION_USER_BASE = 900_100_000
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def probe_balance(agent: FinancialAgent, probes: int, interval: float):
+    latencies = []
+    for _ in range(probes):
+        started = time.perf_counter()
+        await agent.process_message("Какой у меня баланс?", BALANCE_USER_ID)
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def report(title, latencies):
+    print(f"{title:<28} p50={statistics.median(latencies):7.2f} ms  "
+          f"p99={percentile(latencies, 99):7.2f} ms  max={max(latencies):7.2f} ms")
+
+
+async def run(args):
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+    agent = FinancialAgent(db_manager, model=FakeChatModel(latency=args.latency))
+    
+    try:
+        baseline = await probe_balance(agent, args.probes, args.interval)
+        
+        extractions = [
+            asyncio.create_task(
+                agent.process_message(f"Заплатил {100 + i} за разное", EXTRACTION_USER_BASE + i)
+            )
+            for i in range(args.extractions)
+        ]
+        await asyncio.sleep(0)
+        loaded = await probe_balance(agent, args.probes, args.interval)
+        started = time.perf_counter()
+        await asyncio.gather(*extractions)
+        
+        report("balance, без нагрузки", baseline)
+        report(f"balance, {args.extractions} извлечений", loaded)
+        print(f"извлечения завершились через {time.perf_counter() - started:.2f} сек после замера")
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--extractions", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=1.0, help="задержка модели-заглушки, сек")
+    parser.add_argument("--probes", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=0.005)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Бенчмарк допуска к LLM: спамеры, обычные пользователи и запросы баланса
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.llm_scheduler_bench --duration 20 --spammers 20
+
+Апдейты идут через обработчики main.py (Telegram и OpenAI - заглушки из
+fake_telegram и fake_llm). За --duration секунд:
+- --spammers чатов шлют сообщения для LLM каждые --spam-interval секунд;
+- --users обычных чатов присылают по одному такому сообщению в случайный момент;
+- --probes чатов раз в секунду запрашивают /balance.
+Прогон без планировщика (только LLM_MAX_CONCURRENCY и таймаут, общая очередь
+апдейтов) сравнивается с прогоном с лимитами по умолчанию. Для обычных
+пользователей и /balance печатаются задержка ответа и доля ответов
+"повторите позже"/таймаутов.
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from typing import Dict, List
+
+import main as bot_main
+from database import DatabaseManager
+from agent import FinancialAgent
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.llm_load import percentile
+from benchmarks.fake_telegram import FakeTelegramRequest, make_update
+
+SPAM_BASE = 987_000_000
+USER_BASE = 987_100_000
+PROBE_BASE = 987_200_000
+
+# Без планировщика: нулевые лимиты отключены, ждать слота можно до LLM_TIMEOUT
+UNLIMITED = {
+    "USER_LLM_PER_MINUTE": "0",
+    "LLM_TOKENS_PER_MINUTE": "0",
+    "LLM_MAX_QUEUE": "0",
+    "LLM_MAX_WAIT": "3600",
+    "MAX_PRIORITY_UPDATES": "0",
+}
+
+
+def schedule(args, seed: int = 17):
+    """(время отправки, чат, текст); два числа в тексте - мимо быстрого парсера, в LLM"""
+    rng = random.Random(seed)
+    events = []
+    for spammer in range(args.spammers):
+        moment, seq = rng.random() * args.spam_interval, 0
+        while moment < args.duration:
+            events.append((moment, SPAM_BASE + spammer, f"Заплатил {rng.randint(1, 900)} за разное #{seq}"))
+            moment += args.spam_interval
+            seq += 1
+    for user in range(args.users):
+        events.append((rng.random() * args.duration, USER_BASE + user, f"Заплатил {rng.randint(1, 900)} за разное #1"))
+    for probe in range(args.probes):
+        moment = rng.random()
+        while moment < args.duration:
+            events.append((moment, PROBE_BASE + probe, "/balance"))
+            moment += 1.0
+    return sorted(events)
+
+
+def is_rejected(text: str) -> bool:
+    return text.startswith("⏳")
+
+
+async def replay(db_manager, args, environment: Dict[str, str]):
+    saved = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    try:
+        agent = FinancialAgent(db_manager, model=FakeChatModel(latency=args.latency))
+        agent.extraction_cache = None
+        bot_main.agent = agent
+        request = FakeTelegramRequest()
+        application = bot_main.build_application("123456:BENCHMARK", request=request)
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    events = schedule(args)
+    sent_at: Dict[int, List[float]] = {}
+
+    async with application:
+        await application.start()
+        started = time.perf_counter()
+        for update_id, (moment, chat_id, text) in enumerate(events, start=1):
+            await asyncio.sleep(max(0.0, started + moment - time.perf_counter()))
+            sent_at.setdefault(chat_id, []).append(time.perf_counter())
+            await application.update_queue.put(make_update(application.bot, update_id, chat_id, text))
+
+        deadline = time.perf_counter() + float(os.getenv("LLM_TIMEOUT", "30")) + 5
+        while sum(len(replies) for replies in request.sent.values()) < len(events) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        await application.stop()
+
+    def collect(base: int, count: int):
+        latencies, rejected, total = [], 0, 0
+        for chat_id in range(base, base + count):
+            replies = request.sent.get(chat_id, [])
+            total += len(sent_at.get(chat_id, []))
+            rejected += sum(1 for _, text in replies if is_rejected(text))
+            latencies.extend(
+                (reply_time - sent_time) * 1000
+                for (reply_time, text), sent_time in zip(replies, sent_at.get(chat_id, []))
+                if not is_rejected(text)
+            )
+        return latencies, rejected, total
+
+    return {
+        "пользователи": collect(USER_BASE, args.users),
+        "/balance": collect(PROBE_BASE, args.probes),
+        "спамеры": collect(SPAM_BASE, args.spammers),
+    }, agent.model.calls, agent.llm_scheduler.stats()
+
+
+def report(title: str, latencies: List[float], rejected: int, total: int):
+    if latencies:
+        timing = (f"p50 {statistics.median(latencies):7.0f} мс  p95 {percentile(latencies, 95):7.0f} мс  "
+                  f"p99 {percentile(latencies, 99):7.0f} мс")
+    else:
+        timing = "нет ответов"
+    print(f"    {title:<13} {total:>5} сообщ.  отказов {rejected:>5} ({rejected / max(total, 1):4.0%})  {timing}")
+
+
+async def run(args):
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+    bot_main.db_manager = db_manager
+    bot_main.is_initialized = True
+
+    try:
+        print(
+            f"{args.duration:.0f} с: {args.spammers} спамеров (каждые {args.spam_interval} с), "
+            f"{args.users} пользователей, {args.probes} чатов /balance; модель {args.latency} с, "
+            f"LLM_MAX_CONCURRENCY={os.getenv('LLM_MAX_CONCURRENCY', '8')}"
+        )
+        for title, environment in (("без планировщика", UNLIMITED), ("с планировщиком", {})):
+            results, calls, stats = await replay(db_manager, args, environment)
+            print(f"  {title}: вызовов модели {calls}, отклонено планировщиком {stats['shed']} "
+                  f"(лимит пользователя {stats['shed_user']})")
+            for group, (latencies, rejected, total) in results.items():
+                report(group, latencies, rejected, total)
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--spammers", type=int, default=20)
+    parser.add_argument("--spam-interval", type=float, default=0.2)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--probes", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.8)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
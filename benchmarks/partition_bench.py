@@ -0,0 +1,126 @@
+"""Бенчмарк запросов за период на партиционированной таблице транзакций
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.partition_bench --users 200 --per-user 10000
+
+Засевает users * per-user транзакций за --days дней, копирует их в обычную
+(непартиционированную) таблицу в схеме bench_plain с теми же индексами и
+сравнивает одни и те же запросы (balance_period, expenses_by_category_period
+и категории за все время) на обеих таблицах. Кэш чтения не участвует -
+запросы выполняются напрямую.
+"""
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+import asyncpg
+
+from database import DatabaseManager, HOT_QUERIES, add_months, month_start
+from benchmarks.seed import seed_users
+
+FIRST_USER_ID = 950_000_000
+
+
+async def prepare_plain_copy(conn, user_ids):
+    await conn.execute("DROP SCHEMA IF EXISTS bench_plain CASCADE")
+    await conn.execute("CREATE SCHEMA bench_plain")
+    await conn.execute("""
+        CREATE TABLE bench_plain.transactions AS 
+        SELECT * FROM public.transactions WHERE telegram_id = ANY($1::bigint[])
+    """, user_ids)
+    await conn.execute("""
+        CREATE INDEX ON bench_plain.transactions(telegram_id, transaction_date DESC);
+        CREATE INDEX ON bench_plain.transactions(telegram_id, type);
+        CREATE INDEX ON bench_plain.transactions(telegram_id, type) INCLUDE (category_or_source, amount);
+    """)
+    await conn.execute("VACUUM ANALYZE bench_plain.transactions")
+
+
+async def measure(conn, query_name, args_factory, repeat):
+    query = HOT_QUERIES[query_name]
+    latencies = []
+    for _ in range(repeat):
+        args = args_factory()
+        started = time.perf_counter()
+        await conn.fetch(query, *args)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), max(latencies)
+
+
+async def run(args):
+    database_url = os.environ["DATABASE_URL"]
+    db_manager = DatabaseManager(database_url)
+    await db_manager.initialize()
+    if not db_manager.partitioned:
+        raise SystemExit("transactions не партиционирована: python manage.py partition-transactions")
+
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    try:
+        if not args.skip_seed:
+            started = time.perf_counter()
+            await seed_users(db_manager, user_ids, args.per_user, args.days)
+            async with db_manager.pool.acquire() as conn:
+                await prepare_plain_copy(conn, user_ids)
+                await conn.execute("VACUUM ANALYZE transactions")
+            print(f"засеяно {args.users * args.per_user} строк за {time.perf_counter() - started:.0f} с")
+    finally:
+        await db_manager.close()
+
+    this_month = month_start(datetime.now())
+    months = [add_months(this_month, -offset) for offset in range(args.days // 31)]
+
+    def month_args():
+        month = random.choice(months)
+        start = datetime.combine(month, datetime.min.time())
+        end = datetime.combine(add_months(month, 1), datetime.min.time())
+        return random.choice(user_ids), start, end
+
+    def quarter_args():
+        _, start, end = month_args()
+        return random.choice(user_ids), start - timedelta(days=61), end
+
+    cases = [
+        ("balance_period, месяц", "balance_period", month_args),
+        ("категории, месяц", "expenses_by_category_period", month_args),
+        ("категории, квартал", "expenses_by_category_period", quarter_args),
+        ("категории, все время", "expenses_by_category", lambda: (random.choice(user_ids),)),
+    ]
+
+    layouts = {
+        "партиции": await asyncpg.connect(database_url),
+        "обычная таблица": await asyncpg.connect(database_url, server_settings={"search_path": "bench_plain,public"}),
+    }
+
+    print(f"{args.users} пользователей x {args.per_user} транзакций, p50 / max из {args.repeat} запросов (мс):")
+    print(f"  {'запрос':<24}" + "".join(f"{name:>22}" for name in layouts))
+    try:
+        for title, query_name, args_factory in cases:
+            cells = []
+            for conn in layouts.values():
+                # Прогрев: план и кэш страниц
+                await measure(conn, query_name, args_factory, 5)
+                p50, worst = await measure(conn, query_name, args_factory, args.repeat)
+                cells.append(f"{p50:8.2f} / {worst:8.2f}")
+            print(f"  {title:<24}" + "".join(f"{cell:>22}" for cell in cells))
+    finally:
+        for conn in layouts.values():
+            await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--per-user", type=int, default=10_000)
+    parser.add_argument("--days", type=int, default=1095)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--skip-seed", action="store_true", help="использовать уже засеянные данные")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Проверка пула соединений на голодание при параллельной записи
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.pool_starvation --writers 200
+
+Запускает `--writers` одновременных save_transaction для новых пользователей
+(каждому нужна запись в users) и падает, если они не успели за `--timeout`.
+Раньше каждая запись держала одно соединение и ждала второе, и при
+max_size параллельных записях пул блокировался навсегда.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+from database import DatabaseManager
+
+USER_BASE = 910_000_000
+
+
+async def run(args) -> bool:
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+    user_base = USER_BASE + int(time.time()) % 100_000 * 1000
+
+    try:
+        started = time.perf_counter()
+        saves = [
+            db_manager.save_transaction(user_base + i, {
+                "type": "expense",
+                "amount": 100 + i,
+                "category_or_source": "Другое",
+            })
+            for i in range(args.writers)
+        ]
+        try:
+            await asyncio.wait_for(asyncio.gather(*saves), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            print(f"❌ {args.writers} записей не завершились за {args.timeout} сек - пул заблокирован")
+            return False
+
+        elapsed = time.perf_counter() - started
+        print(f"✅ {args.writers} параллельных записей за {elapsed:.2f} сек "
+              f"({args.writers / elapsed:.0f} записей/сек)")
+        return True
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    ok = asyncio.run(run(parser.parse_args()))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
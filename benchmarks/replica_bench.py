@@ -0,0 +1,121 @@
+"""Бенчмарк чтения с реплик: read-your-writes, доля чтений с реплик, переключение при отставании
+
+Запуск:
+    DATABASE_URL=postgresql://primary/... DATABASE_REPLICA_URLS=postgresql://replica/... \\
+        python -m benchmarks.replica_bench --users 50 --rounds 20
+
+Кэш чтения отключается, чтобы каждое чтение шло в базу.
+
+1. --users пользователей по --rounds раз пишут операцию и сразу читают
+   баланс. Считается, сколько чтений не увидели свою запись: с окном
+   REPLICA_STICKY_SECONDS и без него (окно 0 - чтение сразу с реплики).
+2. Отчеты (get_report_data) пользователей, которые давно не писали: доля
+   чтений с реплики и задержка на реплике и на primary.
+3. Применение WAL на реплике ставится на паузу (pg_wal_replay_pause), пишутся
+   новые операции: после замера отставания больше REPLICA_MAX_LAG чтения
+   уходят на primary и видят свежие данные; после возобновления - снова на реплику.
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+os.environ["CACHE_BACKEND"] = "none"
+
+from database import DatabaseManager
+
+USER_BASE = 970_000_000
+
+
+async def write_then_read(db_manager: DatabaseManager, telegram_id: int, rounds: int) -> int:
+    stale = 0
+    for i in range(rounds):
+        before = (await db_manager.get_balance(telegram_id))['transaction_count']
+        await db_manager.save_transaction(telegram_id, {
+            "type": "expense", "amount": 100 + i, "category_or_source": "Продукты"
+        })
+        after = (await db_manager.get_balance(telegram_id))['transaction_count']
+        stale += after != before + 1
+    return stale
+
+
+async def timed_reads(db_manager: DatabaseManager, user_ids, repeat: int) -> float:
+    latencies = []
+    for _ in range(repeat):
+        for telegram_id in user_ids:
+            started = time.perf_counter()
+            await db_manager.get_report_data(telegram_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies)
+
+
+async def run(args):
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+    router = db_manager.replicas
+    if router is None:
+        raise SystemExit("Нет доступных реплик: задайте DATABASE_REPLICA_URLS")
+
+    try:
+        user_base = USER_BASE + int(time.time()) % 100_000 * 100
+        user_ids = [user_base + index for index in range(args.users)]
+
+        for window in (router.sticky_window, 0.0):
+            router.sticky_window = window
+            router._written.clear()
+            stale = sum(await asyncio.gather(*(
+                write_then_read(db_manager, telegram_id, args.rounds) for telegram_id in user_ids
+            )))
+            print(f"запись + чтение баланса, окно {window:.1f} с: {args.users * args.rounds} раз, "
+                  f"не увидели свою запись: {stale}, маршруты {dict(router.routes)}")
+            router.routes.clear()
+
+        # Чтения пользователей, которые давно не писали
+        router._written.clear()
+        on_replica = await timed_reads(db_manager, user_ids, 3)
+        replica_share = router.routes["replica"] / max(sum(router.routes.values()), 1)
+        saved, router.replicas = router.replicas, []
+        on_primary = await timed_reads(db_manager, user_ids, 3)
+        router.replicas = saved
+        print(f"отчеты: с реплики {replica_share:.0%} чтений, медиана {on_replica:.1f} мс на реплике, "
+              f"{on_primary:.1f} мс на primary")
+
+        replica_pool = router.replicas[0].pool
+        async with replica_pool.acquire() as conn:
+            await conn.execute("SELECT pg_wal_replay_pause()")
+        try:
+            telegram_id = user_ids[0]
+            router._written.clear()
+            router.routes.clear()
+            for i in range(int((router.max_lag + 2 * router.check_interval) / 0.5)):
+                await db_manager.save_transaction(telegram_id + 1, {
+                    "type": "expense", "amount": 1, "category_or_source": "Продукты"
+                })
+                await asyncio.sleep(0.5)
+            expected = (await db_manager.get_balance(telegram_id + 1))['transaction_count']
+            print(f"WAL на паузе: отставание {router.replicas[0].lag:.1f} с (порог {router.max_lag:.0f} с), "
+                  f"маршруты {dict(router.routes)}, чтения свежие: "
+                  f"{expected == (await db_manager.get_balance(telegram_id + 1))['transaction_count']}")
+        finally:
+            async with replica_pool.acquire() as conn:
+                await conn.execute("SELECT pg_wal_replay_resume()")
+
+        await asyncio.sleep(2 * router.check_interval)
+        router.routes.clear()
+        await db_manager.get_report_data(user_ids[-1])
+        print(f"после возобновления: отставание {router.replicas[0].lag:.1f} с, маршруты {dict(router.routes)}")
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
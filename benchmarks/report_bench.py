@@ -0,0 +1,81 @@
+"""Бенчмарк /report на пользователе с большой историей
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.report_bench --transactions 10000 100000 1000000
+
+Для каждого размера истории сравнивает прежнюю сборку отчета (три
+последовательных запроса) с get_report_data (один запрос), полным
+рендерингом отчета агентом и отчетами за период (/report month, year, delta),
+которые читают только monthly_rollups. Кэш чтения отключается, чтобы мерить
+именно работу БД.
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+os.environ["CACHE_BACKEND"] = "none"
+
+from database import DatabaseManager
+from agent import FinancialAgent, REPORT_MODES
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.seed import seed_user
+
+REPORT_USER_ID = 940_000_001
+
+
+async def timed(coroutine_factory, repeat: int):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await coroutine_factory()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies)
+
+
+async def run(args):
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+    agent = FinancialAgent(db_manager, model=FakeChatModel(latency=0))
+
+    try:
+        for transactions in args.transactions:
+            await run_size(db_manager, agent, transactions, args)
+    finally:
+        await db_manager.close()
+
+
+async def run_size(db_manager, agent, transactions, args):
+    if not args.skip_seed:
+        await seed_user(db_manager, REPORT_USER_ID, transactions)
+
+    async def sequential():
+        await db_manager.get_balance(REPORT_USER_ID)
+        await db_manager.get_expenses_by_category(REPORT_USER_ID)
+        await db_manager.get_user_transactions(REPORT_USER_ID, limit=10)
+
+    results = {
+        "3 последовательных запроса": await timed(sequential, args.repeat),
+        "get_report_data": await timed(lambda: db_manager.get_report_data(REPORT_USER_ID), args.repeat),
+        "отчет агента целиком": await timed(lambda: agent.process_report(REPORT_USER_ID), args.repeat),
+    }
+    for mode in REPORT_MODES:
+        results[f"/report {mode}"] = await timed(lambda: agent.process_report(REPORT_USER_ID, mode), args.repeat)
+
+    print(f"пользователь с {transactions} транзакциями, p50 из {args.repeat} запусков:")
+    for name, p50 in results.items():
+        print(f"  {name:<28} {p50:8.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--skip-seed", action="store_true", help="использовать уже засеянного пользователя")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Генерация синтетической истории пользователей прямо в PostgreSQL"""
+
+from datetime import datetime, timedelta
+from typing import Sequence
+
+from models import EXPENSE_CATEGORIES, INCOME_SOURCES
+
+
+async def seed_users(db_manager, telegram_ids: Sequence[int], count: int, days: int = 730):
+    """Заменяет историю пользователей на `count` синтетических транзакций каждому за `days` дней
+
+    Строки генерируются на стороне сервера (generate_series), партиции за
+    период создаются заранее, агрегаты пересчитываются через reconcile_balances и rebuild_rollups.
+    """
+
+    now = datetime.now()
+    await db_manager.ensure_partitions(start=now - timedelta(days=days), end=now)
+
+    async with db_manager.pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("""
+                INSERT INTO users (telegram_id) SELECT unnest($1::bigint[]) ON CONFLICT DO NOTHING
+            """, list(telegram_ids))
+            await conn.execute("DELETE FROM transactions WHERE telegram_id = ANY($1::bigint[])", list(telegram_ids))
+            await conn.execute("""
+                INSERT INTO transactions (telegram_id, type, amount, currency, category_or_source, transaction_date)
+                SELECT 
+                    u,
+                    CASE WHEN g % 20 = 0 THEN 'income' ELSE 'expense' END,
+                    CASE WHEN g % 20 = 0 THEN 20000 + (g * 7919) % 60000 ELSE 50 + (g * 7919) % 4950 END,
+                    'RUB',
+                    CASE WHEN g % 20 = 0 
+                        THEN ($4::text[])[1 + (g / 20) % array_length($4::text[], 1)]
+                        ELSE ($3::text[])[1 + (g * 31 + u) % array_length($3::text[], 1)]
+                    END,
+                    $6::timestamp - make_interval(secs => ($5::float8 * 86400) * g / $2)
+                FROM unnest($1::bigint[]) u, generate_series(1, $2::bigint) g
+            """, list(telegram_ids), count, EXPENSE_CATEGORIES, INCOME_SOURCES, days, now)
+            await conn.execute("ANALYZE transactions")
+
+    only_user = telegram_ids[0] if len(telegram_ids) == 1 else None
+    await db_manager.reconcile_balances(only_user)
+    await db_manager.rebuild_rollups(only_user)
+
+
+async def seed_user(db_manager, telegram_id: int, count: int, days: int = 730):
+    """Заменяет историю одного пользователя на `count` синтетических транзакций"""
+
+    await seed_users(db_manager, [telegram_id], count, days)
@@ -0,0 +1,129 @@
+"""Бенчмарк шардирования: распределение по кольцу, запись на N шард, перенос пользователя
+
+Запуск:
+    python -m benchmarks.shard_bench --ring-only
+    DATABASE_SHARDS="a=postgresql://...:5432/finbot_s1,b=postgresql://...:5433/finbot_s2" \\
+        python -m benchmarks.shard_bench --writers 200 --per-writer 20
+
+Без баз: доли пользователей на 2..8 шардах, сколько пользователей меняет
+шарду при добавлении еще одной (для консистентного хеширования ~1/(N+1),
+для telegram_id % N - большинство) и время выбора шарды.
+
+С DATABASE_SHARDS: пропускная способность save_transaction для --writers
+одновременных пользователей на первой шарде против всех шард, подсчет
+пользователей на всех шардах параллельно против по очереди, перенос
+пользователя с --move-rows операциями в другую шарду (баланс до и после
+должен совпасть).
+"""
+
+import os
+import time
+import asyncio
+import argparse
+import statistics
+
+from sharding import HashRing, ShardedDatabaseManager, parse_shards
+from benchmarks.seed import seed_user
+
+USER_BASE = 930_000_000
+MOVE_USER_ID = 939_999_999
+
+
+def ring_report(users: int):
+    ids = range(USER_BASE, USER_BASE + users)
+    for count in range(2, 9):
+        names = [f"shard{index}" for index in range(count)]
+        ring, grown = HashRing(names), HashRing(names + [f"shard{count}"])
+        placed = [ring.shard(telegram_id) for telegram_id in ids]
+        shares = [placed.count(name) / users for name in names]
+        moved = sum(a != grown.shard(telegram_id) for telegram_id, a in zip(ids, placed)) / users
+        modulo = sum(telegram_id % count != telegram_id % (count + 1) for telegram_id in ids) / users
+        print(f"  {count} шард: доли {min(shares):5.1%}..{max(shares):5.1%}, при добавлении шарды "
+              f"переезжает {moved:5.1%} (ожидается {1 / (count + 1):5.1%}, у id % N - {modulo:5.1%})")
+
+    ring = HashRing([f"shard{index}" for index in range(8)])
+    started = time.perf_counter()
+    for telegram_id in ids:
+        ring.shard(telegram_id)
+    print(f"  выбор шарды: {(time.perf_counter() - started) / users * 1e6:.2f} мкс")
+
+
+async def writer(db_manager, telegram_id: int, count: int):
+    for i in range(count):
+        await db_manager.save_transaction(telegram_id, {
+            "type": "expense", "amount": 10 + i, "category_or_source": "Продукты"
+        })
+
+
+async def throughput(db_manager, writers: int, per_writer: int) -> float:
+    user_base = USER_BASE + int(time.time() * 1000) % 1_000_000 * 100
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(db_manager, user_base + w, per_writer) for w in range(writers)))
+    return writers * per_writer / (time.perf_counter() - started)
+
+
+async def with_shards(args, shards):
+    single = ShardedDatabaseManager(shards[:1])
+    sharded = ShardedDatabaseManager(shards)
+    await single.initialize()
+    await sharded.initialize()
+    try:
+        one = await throughput(single, args.writers, args.per_writer)
+        many = await throughput(sharded, args.writers, args.per_writer)
+        print(f"запись, {args.writers} пользователей x {args.per_writer}: 1 шарда {one:.0f} зап/с, "
+              f"{len(shards)} шард {many:.0f} зап/с ({many / one:.1f}x)")
+
+        parallel, sequential = [], []
+        for _ in range(5):
+            started = time.perf_counter()
+            stats = await sharded.shard_stats()
+            parallel.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            for shard in sharded.shards.values():
+                await shard.count_users()
+            sequential.append((time.perf_counter() - started) * 1000)
+        print(f"подсчет пользователей: параллельно {statistics.median(parallel):.1f} мс, "
+              f"по очереди {statistics.median(sequential):.1f} мс")
+        for name, item in stats.items():
+            print(f"  {name}: пользователей {item['users']}, операций ~{item['transactions']}")
+
+        source = sharded.shard_name(MOVE_USER_ID)
+        target = next(name for name in sharded.shards if name != source)
+        await seed_user(sharded.shards[source], MOVE_USER_ID, args.move_rows)
+        before = await sharded.get_balance(MOVE_USER_ID)
+        started = time.perf_counter()
+        copied = await sharded.move_users([(MOVE_USER_ID, source, target)], grace=0)
+        moved_s = time.perf_counter() - started
+        after = await sharded.get_balance(MOVE_USER_ID)
+        left = await sharded.shards[source].get_user(MOVE_USER_ID)
+        print(f"перенос {args.move_rows} операций {source} -> {target}: {moved_s:.1f} с, скопировано {copied}, "
+              f"баланс {before['balance']:.2f} -> {after['balance']:.2f}, "
+              f"в старой шарде {'остался' if left else 'удален'}")
+
+        # Возвращаем пользователя туда, куда ведет кольцо, и снимаем закрепление
+        await sharded.move_users([(MOVE_USER_ID, target, source)], grace=0)
+    finally:
+        await single.close()
+        await sharded.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000, help="пользователей для проверки кольца")
+    parser.add_argument("--writers", type=int, default=200)
+    parser.add_argument("--per-writer", type=int, default=20)
+    parser.add_argument("--move-rows", type=int, default=50_000)
+    parser.add_argument("--ring-only", action="store_true", help="только кольцо, без баз")
+    args = parser.parse_args()
+
+    print("кольцо шард:")
+    ring_report(args.users)
+    if not args.ring_only:
+        shards = parse_shards(os.environ["DATABASE_SHARDS"])
+        if len(shards) < 2:
+            raise SystemExit("Для записи и переноса нужно хотя бы две шарды в DATABASE_SHARDS")
+        asyncio.run(with_shards(args, shards))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Бенчмарк холодного старта: время от запуска процесса до первого ответа
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.startup_bench --runs 5
+
+Каждый прогон - новый процесс Python (импорты не кэшированы в памяти).
+Процесс импортирует main, собирает приложение с заглушкой Telegram
+(FakeTelegramRequest), вызывает post_init так же, как run_polling, и сразу
+после этого получает апдейты /help и /balance - как накопившиеся за время
+перезапуска. Печатаются медианы от запуска процесса до: окончания импорта
+main, приема апдейтов, ответа на /help, ответа на /balance (нужна база) и
+готовности LLM-экстракторов.
+
+Прогоны идут дважды: с пустой таблицей schema_version (initialize выполняет
+весь DDL) и с записанной текущей версией (DDL пропускается).
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+import asyncpg
+
+HELP_CHAT = 960_000_001
+BALANCE_CHAT = 960_000_002
+STAGES = (
+    ("import", "импорт main"),
+    ("accepting", "прием апдейтов"),
+    ("help", "ответ на /help"),
+    ("balance", "ответ на /balance"),
+    ("llm", "LLM готова"),
+)
+
+
+async def child(spawned: float, timeout: float):
+    marks = {}
+    import main as bot_main
+    from benchmarks.fake_telegram import FakeTelegramRequest, make_update
+    marks["import"] = time.time()
+
+    request = FakeTelegramRequest()
+    application = bot_main.build_application("123456:BENCHMARK", request=request)
+    async with application:
+        # run_polling вызывает post_init до того, как начинает получать апдейты
+        await bot_main.post_init(application)
+        await application.start()
+        marks["accepting"] = time.time()
+
+        for update_id, (chat_id, text) in enumerate(((HELP_CHAT, "/help"), (BALANCE_CHAT, "/balance")), start=1):
+            await application.update_queue.put(make_update(application.bot, update_id, chat_id, text))
+
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline and not all(chat in request.sent for chat in (HELP_CHAT, BALANCE_CHAT)):
+            await asyncio.sleep(0.001)
+        for name, chat_id in (("help", HELP_CHAT), ("balance", BALANCE_CHAT)):
+            if chat_id in request.sent:
+                # Заглушка отмечает время ответа по perf_counter - переводим в абсолютное
+                marks[name] = time.time() - (time.perf_counter() - request.sent[chat_id][0][0])
+
+        if bot_main.agent is not None:
+            await bot_main.agent.warmup()
+            marks["llm"] = time.time()
+
+        await application.stop()
+
+    if bot_main.db_manager is not None:
+        await bot_main.db_manager.close()
+    print(json.dumps({name: moment - spawned for name, moment in marks.items()}))
+
+
+def run_child(timeout: float) -> dict:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    spawned = time.time()
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup_bench", "--child", str(spawned), "--timeout", str(timeout)],
+        env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+async def reset_schema_version(database_url: str, ddl: bool):
+    conn = await asyncpg.connect(database_url)
+    try:
+        if ddl and await conn.fetchval("SELECT to_regclass('schema_version') IS NOT NULL"):
+            await conn.execute("DELETE FROM schema_version")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--child", type=float, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        asyncio.run(child(args.child, args.timeout))
+        return
+
+    database_url = os.environ["DATABASE_URL"]
+    # Прогрев: схема создана, файлы модулей в кэше ОС
+    run_child(args.timeout)
+    for title, ddl in (("весь DDL", True), ("версия схемы текущая", False)):
+        samples = []
+        for _ in range(args.runs):
+            asyncio.run(reset_schema_version(database_url, ddl))
+            samples.append(run_child(args.timeout))
+        print(f"{title}, {args.runs} запусков, медиана от старта процесса:")
+        for key, label in STAGES:
+            values = [sample[key] for sample in samples if key in sample]
+            if values:
+                print(f"  {label:<20} {statistics.median(values) * 1000:7.0f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Сквозной набор бенчмарков: FinancialAgent и DatabaseManager на одноразовой базе
+
+Запуск:
+    DATABASE_URL=postgresql://postgres@localhost/postgres python -m benchmarks.suite
+    python -m benchmarks.suite --sizes 1000 100000 --requests 100 --compare benchmarks/results/old.json
+
+На сервере из DATABASE_URL создается отдельная база finbot_bench_<pid>
+(удаляется в конце, --keep - оставить). Для каждого размера истории из
+--sizes (по умолчанию 1k, 100k и 1M операций) засевается свой синтетический
+пользователь, и на нем прогоняются сценарии:
+
+- balance - "Какой у меня баланс?" через process_message;
+- report, report_month, report_year, report_delta - /report и отчеты за период;
+- message_fast - "кофе 150": быстрый парсер, запись, баланс;
+- message_llm - "Вчера вечером отдал 500 соседу за помощь" (быстрый парсер
+  не разбирает): Trustcall с FakeChatModel (--llm-latency секунд на вызов),
+  запись, баланс;
+- import - CSV-выписка на --import-rows строк через StatementImporter.
+
+Запросы сценария идут в --concurrency потоков. Кэш чтения, кэш извлечений и
+лимиты LLM на пользователя отключены - меряется работа агента и БД.
+Для каждого сценария печатаются пропускная способность и перцентили задержки,
+все результаты с метаданными запуска (коммит, версии, параметры) пишутся в
+JSON (--output). --compare сравнивает с прошлым JSON и завершается с кодом 1,
+если p95 какого-то сценария вырос больше чем на --threshold.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+os.environ["CACHE_BACKEND"] = "none"
+os.environ["EXTRACTION_CACHE_ENABLED"] = "false"
+os.environ["USER_LLM_BURST"] = "0"
+os.environ["USER_LLM_PER_MINUTE"] = "0"
+os.environ["LLM_TOKENS_PER_MINUTE"] = "0"
+
+import asyncpg
+
+from database import DatabaseManager
+from agent import FinancialAgent
+from importer import StatementImporter
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.import_bench import write_statement
+from benchmarks.llm_load import percentile
+from benchmarks.seed import seed_user
+
+USER_BASE = 990_000_000
+SCENARIOS = (
+    "balance", "report", "report_month", "report_year", "report_delta",
+    "message_fast", "message_llm", "import"
+)
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def with_database(url: str, name: str) -> str:
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=f"/{name}"))
+
+
+async def create_database(url: str, name: str):
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        await conn.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        await conn.close()
+
+
+async def drop_database(url: str, name: str):
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        await conn.close()
+
+
+def failed(response) -> bool:
+    return isinstance(response, str) and response.startswith(("❌", "⏳"))
+
+
+async def measure(scenario: str, size: int, call, requests: int, concurrency: int, items: int = 1) -> Dict:
+    """requests вызовов call(i) в concurrency потоков: пропускная способность и перцентили"""
+
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                errors += failed(await call(index))
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, requests))))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": scenario,
+        "size": size,
+        "requests": requests,
+        "concurrency": min(concurrency, requests),
+        "errors": errors,
+        "throughput": requests * items / elapsed,
+        "unit": "строк/с" if items > 1 else "запр/с",
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies),
+    }
+
+
+async def run_size(db_manager, agent, size: int, args, directory: str) -> List[Dict]:
+    telegram_id = USER_BASE + size
+    started = time.perf_counter()
+    await seed_user(db_manager, telegram_id, size)
+    print(f"пользователь с {size} операциями засеян за {time.perf_counter() - started:.1f} с")
+
+    scenarios = {
+        "balance": lambda i: agent.process_message("Какой у меня баланс?", telegram_id),
+        "report": lambda i: agent.process_report(telegram_id),
+        "report_month": lambda i: agent.process_report(telegram_id, "month"),
+        "report_year": lambda i: agent.process_report(telegram_id, "year"),
+        "report_delta": lambda i: agent.process_report(telegram_id, "delta"),
+        "message_fast": lambda i: agent.process_message(f"кофе {100 + i % 400}", telegram_id),
+        "message_llm": lambda i: agent.process_message(
+            f"Вчера вечером отдал {100 + i % 400} соседу за помощь", telegram_id
+        ),
+    }
+
+    results = []
+    for scenario in args.scenarios:
+        if scenario == "import":
+            importer = StatementImporter(db_manager)
+            paths = []
+            for index in range(args.import_repeat):
+                paths.append(os.path.join(directory, f"statement_{size}_{index}.csv"))
+                write_statement(paths[-1], args.import_rows, seed=size + index)
+
+            async def import_statement(index):
+                with open(paths[index], "rb") as raw:
+                    return await importer.import_file(telegram_id, raw, os.path.basename(paths[index]))
+
+            result = await measure(scenario, size, import_statement, args.import_repeat, 1, args.import_rows)
+        else:
+            calls = agent.model.calls
+            result = await measure(scenario, size, scenarios[scenario], args.requests, args.concurrency)
+            result["llm_calls"] = agent.model.calls - calls
+        results.append(result)
+        print_result(result)
+    return results
+
+
+def print_result(result: Dict):
+    print(f"  {result['scenario']:<13} {result['size']:>8}  {result['throughput']:9.1f} {result['unit']:<7}  "
+          f"p50 {result['p50_ms']:8.2f}  p95 {result['p95_ms']:8.2f}  p99 {result['p99_ms']:8.2f} мс"
+          + (f"  ошибок {result['errors']}" if result['errors'] else ""))
+
+
+def compare(results: List[Dict], previous_path: str, threshold: float) -> bool:
+    """Сравнение p95 и пропускной способности с прошлым запуском; True - есть регрессия"""
+
+    with open(previous_path, encoding="utf-8") as previous_file:
+        previous = json.load(previous_file)
+    baseline = {(item["scenario"], item["size"]): item for item in previous["results"]}
+
+    print(f"сравнение с {previous_path} (коммит {previous['meta'].get('commit')}):")
+    regressed = False
+    for result in results:
+        old = baseline.get((result["scenario"], result["size"]))
+        if old is None:
+            continue
+        p95 = result["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+        throughput = result["throughput"] / old["throughput"] - 1 if old["throughput"] else 0.0
+        mark = ""
+        if p95 > threshold:
+            regressed = True
+            mark = "  ❌ регрессия"
+        print(f"  {result['scenario']:<13} {result['size']:>8}  p95 {old['p95_ms']:8.2f} -> {result['p95_ms']:8.2f} мс "
+              f"({p95:+.0%}), пропускная способность {throughput:+.0%}{mark}")
+    return regressed
+
+
+async def run(args) -> List[Dict]:
+    server_url = os.environ["DATABASE_URL"]
+    name = f"finbot_bench_{os.getpid()}"
+    await create_database(server_url, name)
+    db_manager = DatabaseManager(with_database(server_url, name), replica_urls=[])
+    try:
+        await db_manager.initialize()
+        agent = FinancialAgent(db_manager, model=FakeChatModel(latency=args.llm_latency))
+        await agent.warmup()
+
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            for size in args.sizes:
+                results.extend(await run_size(db_manager, agent, size, args, directory))
+        return results
+    finally:
+        await db_manager.close()
+        if args.keep:
+            print(f"база {name} оставлена")
+        else:
+            await drop_database(server_url, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000],
+                        help="операций в истории пользователя")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="задержка модели-заглушки, сек")
+    parser.add_argument("--import-rows", type=int, default=5_000)
+    parser.add_argument("--import-repeat", type=int, default=3, help="выписок на размер истории")
+    parser.add_argument("--output", help="JSON с результатами (по умолчанию benchmarks/results/<время>-<коммит>.json)")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимый рост p95 при сравнении")
+    parser.add_argument("--keep", action="store_true", help="не удалять базу бенчмарка")
+    args = parser.parse_args()
+
+    started = datetime.now()
+    results = asyncio.run(run(args))
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"{started:%Y%m%d-%H%M%S}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump({
+            "meta": {
+                "started_at": started.isoformat(timespec="seconds"),
+                "commit": commit,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            },
+            "results": results,
+        }, output_file, ensure_ascii=False, indent=2)
+    print(f"результаты: {output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Нагрузочный стенд: прогон синтетических апдейтов Telegram через обработчики main.py
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.update_replay --chats 200 --messages 20
+
+Telegram API подменяется заглушкой (FakeTelegramRequest), OpenAI - FakeChatModel.
+Апдейты кладутся в очередь приложения так же, как это делают polling и webhook.
+Стенд печатает устойчивую пропускную способность (сообщений/сек), перцентили
+времени до ответа и проверяет, что ответы внутри каждого чата пришли по порядку.
+"""
+
+import os
+import re
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from typing import Dict, List
+
+import main as bot_main
+from database import DatabaseManager
+from agent import FinancialAgent
+from benchmarks.fake_llm import FakeChatModel
+from benchmarks.fake_telegram import FakeTelegramRequest, make_update
+
+CHAT_BASE = 930_000_000
+_SEQUENCE_RE = re.compile(r"#(\d+)")
+
+
+def synthetic_messages(chats: int, per_chat: int, seed: int = 42):
+    """Смешанная нагрузка: команды, быстрые и LLM-транзакции, общие сообщения с номером"""
+    rng = random.Random(seed)
+    templates = [
+        "/balance",
+        "/report",
+        "кофе {amount}",
+        "Потратил {amount} рублей на продукты",
+        "Заплатил {amount} за разное",
+        "Привет, это сообщение #{seq}",
+    ]
+    messages = []
+    for seq in range(per_chat):
+        for chat in range(chats):
+            text = rng.choice(templates).format(amount=rng.randint(50, 5000), seq=seq)
+            messages.append((CHAT_BASE + chat, text))
+    return messages
+
+
+async def run(args):
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+
+    bot_main.db_manager = db_manager
+    bot_main.agent = FinancialAgent(db_manager, model=FakeChatModel(latency=args.llm_latency))
+    bot_main.is_initialized = True
+
+    request = FakeTelegramRequest()
+    application = bot_main.build_application("123456:BENCHMARK", request=request)
+
+    messages = synthetic_messages(args.chats, args.messages)
+    sent_at: Dict[int, List[float]] = {}
+
+    async with application:
+        await application.start()
+
+        started = time.perf_counter()
+        for update_id, (chat_id, text) in enumerate(messages, start=1):
+            sent_at.setdefault(chat_id, []).append(time.perf_counter())
+            await application.update_queue.put(make_update(application.bot, update_id, chat_id, text))
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+
+        expected_replies = len(messages)
+        while sum(len(replies) for replies in request.sent.values()) < expected_replies:
+            if time.perf_counter() - started > args.timeout:
+                break
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        await application.stop()
+
+    await db_manager.close()
+
+    replies = sum(len(r) for r in request.sent.values())
+    out_of_order = 0
+    for chat_replies in request.sent.values():
+        sequence = [int(m.group(1)) for _, text in chat_replies for m in [_SEQUENCE_RE.search(text)] if m]
+        out_of_order += sum(1 for a, b in zip(sequence, sequence[1:]) if b < a)
+
+    # Ответы чата идут в порядке его апдейтов - i-й ответ относится к i-му апдейту
+    latencies = sorted(
+        (reply_time - sent_time) * 1000
+        for chat_id, chat_replies in request.sent.items()
+        for (reply_time, _), sent_time in zip(chat_replies, sent_at.get(chat_id, []))
+    )
+
+    print(f"апдейтов: {len(messages)}, ответов: {replies}, "
+          f"параллельно: {application.update_processor.max_running}")
+    print(f"пропускная способность: {replies / elapsed:.0f} сообщений/сек за {elapsed:.2f} сек")
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"время до ответа: p50={statistics.median(latencies):.0f} мс, "
+              f"p99={p99:.0f} мс, max={latencies[-1]:.0f} мс")
+    print(f"нарушений порядка внутри чатов: {out_of_order}, отброшено: {application.update_processor.shed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20, help="сообщений на чат")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--rate", type=float, default=0, help="апдейтов/сек (0 - без ограничения)")
+    parser.add_argument("--timeout", type=float, default=120)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Пропускная способность записи: по одной вставке против пакетной записи
+
+Запуск:
+    DATABASE_URL=postgresql://... python -m benchmarks.write_throughput --writers 10 100 1000
+
+Для каждого числа одновременных писателей каждый делает `--per-writer`
+последовательных save_transaction и сразу читает баланс (read-your-writes
+проверяется по счетчику операций). Сравниваются прямой путь и WriteBehindQueue.
+"""
+
+import os
+import time
+import asyncio
+import argparse
+
+from database import DatabaseManager
+from write_behind import WriteBehindQueue
+
+USER_BASE = 920_000_000
+
+
+async def writer(db_manager: DatabaseManager, telegram_id: int, count: int):
+    before = (await db_manager.get_balance(telegram_id))['transaction_count']
+    for i in range(count):
+        await db_manager.save_transaction(telegram_id, {
+            "type": "expense",
+            "amount": 10 + i,
+            "category_or_source": "Продукты",
+        })
+        seen = (await db_manager.get_balance(telegram_id))['transaction_count']
+        if seen != before + i + 1:
+            raise AssertionError(f"баланс не видит свою запись: {seen} != {before + i + 1}")
+
+
+async def measure(db_manager: DatabaseManager, writers: int, per_writer: int, batched: bool) -> float:
+    if batched:
+        db_manager.write_queue = WriteBehindQueue(db_manager)
+        db_manager.write_queue.start()
+
+    user_base = USER_BASE + int(time.time() * 1000) % 1_000_000 * 1000
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(writer(db_manager, user_base + w, per_writer) for w in range(writers)))
+    finally:
+        if batched:
+            await db_manager.write_queue.stop()
+            db_manager.write_queue = None
+    return writers * per_writer / (time.perf_counter() - started)
+
+
+async def run(args):
+    db_manager = DatabaseManager(os.environ["DATABASE_URL"])
+    await db_manager.initialize()
+
+    try:
+        print(f"{'писателей':>10} {'по одной, зап/с':>18} {'пакетами, зап/с':>18} {'ускорение':>10}")
+        for writers in args.writers:
+            direct = await measure(db_manager, writers, args.per_writer, batched=False)
+            batched = await measure(db_manager, writers, args.per_writer, batched=True)
+            print(f"{writers:>10} {direct:>18.0f} {batched:>18.0f} {batched / direct:>9.1f}x")
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--per-writer", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _approx_size(value: Any) -> int:
+    """Приблизительный размер значения в памяти (байт)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_approx_size(k) + _approx_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_approx_size(v) for v in value)
+    return size
+
+
+class MemoryCacheBackend:
+    """Кэш в памяти процесса: LRU с ограничением числа записей и TTL"""
+
+    # Значения видит только этот процесс
+    shared = False
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.memory_bytes = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at, size = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any):
+        if key in self._entries:
+            self._remove(key)
+
+        size = _approx_size(key) + _approx_size(value)
+        self._entries[key] = (value, time.monotonic() + self.ttl, size)
+        self.memory_bytes += size
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    async def delete(self, keys: Iterable[str]):
+        for key in keys:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.memory_bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "entries": len(self._entries), "memory_bytes": self.memory_bytes}
+
+
+class RedisCacheBackend:
+    """Общий кэш в Redis для нескольких реплик бота (нужен пакет redis)"""
+
+    shared = True
+
+    def __init__(self, redis_url: str, ttl: float, prefix: str = "finbot:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ImportError("Для CACHE_BACKEND=redis установите пакет redis: pip install redis") from e
+
+        self.client = redis.from_url(redis_url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any):
+        await self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(self.ttl)))
+
+    async def delete(self, keys: Iterable[str]):
+        keys = [self.prefix + key for key in keys]
+        if keys:
+            await self.client.delete(*keys)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis"}
+
+
+class ReadThroughCache:
+    """Кэш чтения по пользователям с точной инвалидацией при записи
+
+    Значения загружаются при промахе и сбрасываются, когда транзакция
+    пользователя закоммичена. Поколения защищают от записи в кэш значения,
+    прочитанного до коммита, но загруженного уже после инвалидации.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._generations: Dict[int, int] = {}
+
+    @staticmethod
+    def key(kind: str, telegram_id: int) -> str:
+        return f"{kind}:{telegram_id}"
+
+    async def get_or_load(self, kind: str, telegram_id: int, loader: Callable[[], Awaitable[Any]]) -> Any:
+        key = self.key(kind, telegram_id)
+
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения кэша: {e}")
+            value = None
+
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        generation = self._generations.get(telegram_id, 0)
+        value = await loader()
+
+        if self._generations.get(telegram_id, 0) == generation:
+            try:
+                await self.backend.set(key, value)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи в кэш: {e}")
+        return value
+
+    async def invalidate(self, telegram_id: int, kinds: Iterable[str]):
+        """Сброс значений пользователя после коммита его транзакции"""
+
+        self._generations[telegram_id] = self._generations.get(telegram_id, 0) + 1
+        if len(self._generations) > 100_000:
+            self._generations.clear()
+
+        try:
+            await self.backend.delete([self.key(kind, telegram_id) for kind in kinds])
+        except Exception as e:
+            logger.error(f"❌ Ошибка инвалидации кэша: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            **self.backend.stats()
+        }
+
+
+def create_cache() -> Optional[ReadThroughCache]:
+    """Кэш по настройкам окружения: CACHE_BACKEND=memory|redis|none"""
+
+    backend_name = os.getenv("CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("CACHE_TTL", "300"))
+
+    if backend_name == "none":
+        return None
+    if backend_name == "redis":
+        redis_url = os.getenv("REDIS_URL")
+        if not redis_url:
+            raise ValueError("REDIS_URL не установлен")
+        return ReadThroughCache(RedisCacheBackend(redis_url, ttl))
+
+    max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+    return ReadThroughCache(MemoryCacheBackend(max_entries, ttl))
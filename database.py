@@ -1,18 +1,306 @@
+import os
+import re
+import time
+import asyncio
 import asyncpg
 import json
 import uuid
-from typing import List, Dict, Optional
-from datetime import datetime
+import contextvars
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from decimal import Decimal
+from typing import AsyncIterator, Iterable, List, Dict, Optional, Tuple
+from datetime import date, datetime
 import logging
 
+from metrics import Histogram, LabeledHistogram, record_stage, span
+from cache import create_cache
+from write_behind import WriteBehindQueue
+from analytics import SpendingAnalytics
+from fx_rates import BASE_CURRENCY, FxRates, read_rates
+from replicas import Replica, ReplicaRouter
+
 logger = logging.getLogger(__name__)
 
+# Чтения текущей задачи идут на primary (загрузка значения для общего кэша)
+_primary_reads: contextvars.ContextVar[bool] = contextvars.ContextVar("primary_reads", default=False)
+
+# Сумма операции в рублях по курсу на ее дату; fx_rate вызывается только для строк в валюте
+AMOUNT_BASE = (
+    f"CASE WHEN currency = '{BASE_CURRENCY}' THEN amount "
+    f"ELSE ROUND(amount * fx_rate(currency, transaction_date::date), 2) END"
+)
+
+# Горячие запросы - постоянный текст, подготавливаются один раз на соединение
+HOT_QUERIES = {
+    "insert_transaction": """
+        INSERT INTO transactions 
+        (telegram_id, type, amount, currency, category_or_source, comment, transaction_date)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        RETURNING id
+    """,
+    "apply_balance": """
+        INSERT INTO user_balances (telegram_id, total_income, total_expense, transaction_count)
+        VALUES (
+            $1,
+            CASE WHEN $2 = 'income' THEN $3::numeric ELSE 0 END,
+            CASE WHEN $2 = 'expense' THEN $3::numeric ELSE 0 END,
+            1
+        )
+        ON CONFLICT (telegram_id) DO UPDATE SET
+            total_income = user_balances.total_income + EXCLUDED.total_income,
+            total_expense = user_balances.total_expense + EXCLUDED.total_expense,
+            transaction_count = user_balances.transaction_count + 1,
+            updated_at = NOW()
+    """,
+    "apply_balances": """
+        INSERT INTO user_balances (telegram_id, total_income, total_expense, transaction_count)
+        SELECT * FROM unnest($1::bigint[], $2::numeric[], $3::numeric[], $4::integer[])
+        ON CONFLICT (telegram_id) DO UPDATE SET
+            total_income = user_balances.total_income + EXCLUDED.total_income,
+            total_expense = user_balances.total_expense + EXCLUDED.total_expense,
+            transaction_count = user_balances.transaction_count + EXCLUDED.transaction_count,
+            updated_at = NOW()
+    """,
+    "apply_rollup": """
+        INSERT INTO monthly_rollups (telegram_id, month, type, category_or_source, total, count)
+        VALUES ($1, date_trunc('month', $2::timestamp)::date, $3, $4, $5::numeric, 1)
+        ON CONFLICT (telegram_id, month, type, category_or_source) DO UPDATE SET
+            total = monthly_rollups.total + EXCLUDED.total,
+            count = monthly_rollups.count + 1
+    """,
+    "apply_rollups": """
+        INSERT INTO monthly_rollups (telegram_id, month, type, category_or_source, total, count)
+        SELECT * FROM unnest($1::bigint[], $2::date[], $3::text[], $4::text[], $5::numeric[], $6::integer[])
+        ON CONFLICT (telegram_id, month, type, category_or_source) DO UPDATE SET
+            total = monthly_rollups.total + EXCLUDED.total,
+            count = monthly_rollups.count + EXCLUDED.count
+    """,
+    "balance": """
+        SELECT total_income, total_expense, transaction_count
+        FROM user_balances 
+        WHERE telegram_id = $1
+    """,
+    "balance_period": f"""
+        SELECT 
+            COALESCE(SUM({AMOUNT_BASE}) FILTER (WHERE type = 'income'), 0) AS total_income,
+            COALESCE(SUM({AMOUNT_BASE}) FILTER (WHERE type = 'expense'), 0) AS total_expense,
+            COUNT(*) AS transaction_count
+        FROM transactions 
+        WHERE telegram_id = $1 AND transaction_date >= $2 AND transaction_date < $3
+    """,
+    "recent_transactions": """
+        SELECT 
+            id, type, amount, currency, category_or_source, 
+            comment, transaction_date, created_at
+        FROM transactions 
+        WHERE telegram_id = $1 
+        ORDER BY transaction_date DESC 
+        LIMIT $2
+    """,
+    "user_context": """
+        SELECT 
+            b.total_income, b.total_expense, b.transaction_count,
+            t.id, t.type, t.amount, t.currency, t.category_or_source,
+            t.comment, t.transaction_date, t.created_at
+        FROM (SELECT $1::bigint AS telegram_id) u
+        LEFT JOIN user_balances b ON b.telegram_id = u.telegram_id
+        LEFT JOIN LATERAL (
+            SELECT 
+                id, type, amount, currency, category_or_source, 
+                comment, transaction_date, created_at
+            FROM transactions 
+            WHERE telegram_id = u.telegram_id 
+            ORDER BY transaction_date DESC 
+            LIMIT $2
+        ) t ON TRUE
+        ORDER BY t.transaction_date DESC
+    """,
+    "expenses_by_category": """
+        SELECT category_or_source, SUM(total) as total
+        FROM monthly_rollups 
+        WHERE telegram_id = $1 AND type = 'expense'
+        GROUP BY category_or_source
+        ORDER BY total DESC
+    """,
+    "expenses_by_category_period": f"""
+        SELECT category_or_source, SUM({AMOUNT_BASE}) as total
+        FROM transactions 
+        WHERE telegram_id = $1 AND type = 'expense'
+          AND transaction_date >= $2 AND transaction_date < $3
+        GROUP BY category_or_source
+        ORDER BY total DESC
+    """,
+    "report": """
+        WITH recent AS (
+            SELECT type, amount, currency, category_or_source, transaction_date
+            FROM transactions 
+            WHERE telegram_id = $1 
+            ORDER BY transaction_date DESC 
+            LIMIT $2
+        ),
+        categories AS (
+            SELECT category_or_source, SUM(total) AS total
+            FROM monthly_rollups 
+            WHERE telegram_id = $1 AND type = 'expense'
+            GROUP BY category_or_source
+        )
+        SELECT 'balance' AS section, NULL AS type, NULL AS category_or_source,
+               total_income AS amount, NULL AS currency, total_expense, transaction_count,
+               NULL::timestamp AS transaction_date
+        FROM user_balances WHERE telegram_id = $1
+        UNION ALL
+        SELECT 'category', NULL, category_or_source, total, NULL, NULL, NULL, NULL
+        FROM categories
+        UNION ALL
+        SELECT 'recent', type, category_or_source, amount, currency, NULL, NULL, transaction_date
+        FROM recent
+    """,
+    "export_transactions": """
+        SELECT id, type, amount, currency, category_or_source, comment, transaction_date
+        FROM transactions 
+        WHERE telegram_id = $1 
+        ORDER BY transaction_date
+    """,
+    "history_columns": f"""
+        SELECT type, category_or_source,
+               array_agg(transaction_date::date - DATE '1970-01-01') AS days,
+               array_agg(({AMOUNT_BASE})::float8) AS amounts
+        FROM transactions 
+        WHERE telegram_id = $1
+        GROUP BY type, category_or_source
+    """,
+    "cached_extraction": """
+        UPDATE extraction_cache SET hits = hits + 1
+        WHERE template = $1 AND updated_at > NOW() - make_interval(secs => $2)
+        RETURNING result
+    """,
+    "save_extraction": """
+        INSERT INTO extraction_cache (template, result) VALUES ($1, $2::jsonb)
+        ON CONFLICT (template) DO UPDATE SET result = EXCLUDED.result, updated_at = NOW()
+    """,
+    "rollups": """
+        SELECT month, type, category_or_source, total, count
+        FROM monthly_rollups 
+        WHERE telegram_id = $1 AND month >= $2 AND month <= $3
+    """,
+}
+
+DB_ACQUIRE_SECONDS = Histogram("db_pool_acquire_seconds", "Ожидание свободного соединения в пуле")
+DB_QUERY_SECONDS = LabeledHistogram("db_query_seconds", "Время выполнения запросов к БД", "query")
+
+# Метка запроса в метриках: имя из HOT_QUERIES или "<команда>_<таблица>"
+HOT_QUERY_NAMES = {text: name for name, text in HOT_QUERIES.items()}
+_SQL_TABLE_RE = re.compile(r"\b(?:from|into|update|table)\s+(?:if\s+(?:not\s+)?exists\s+)?([a-z_][a-z0-9_]*)", re.I)
+
+
+def query_label(query: str) -> str:
+    name = HOT_QUERY_NAMES.get(query)
+    if name is not None:
+        return name
+    if "RESET ALL" in query:
+        # Сброс состояния соединения при возврате в пул
+        return "pool_reset"
+    words = query.split(None, 1)
+    verb = words[0].rstrip(";").lower() if words else "empty"
+    match = _SQL_TABLE_RE.search(query)
+    return f"{verb}_{match.group(1).lower()}" if match else verb
+
+# Значения кэша чтения, зависящие от транзакций пользователя
+CACHED_KINDS = ("balance", "expenses_by_category", "report")
+
+# Последних операций в /report; кэшируется только отчет с этим числом операций
+REPORT_RECENT_LIMIT = 5
+
+TRANSACTION_COLUMNS = (
+    'id', 'telegram_id', 'type', 'amount', 'currency',
+    'category_or_source', 'comment', 'transaction_date'
+)
+
+# Версия схемы: initialize выполняет DDL, только если в schema_version записана
+# меньшая. Увеличивать при любом изменении таблиц, индексов и функций в _create_schema
+SCHEMA_VERSION = 2
+
+# Ключ advisory-блокировки для создания партиций (одна реплика за раз)
+PARTITION_LOCK_KEY = 7_230_001
+
+# Курс валюты на дату: последний известный на эту дату, до первого известного - самый ранний
+FX_RATE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION fx_rate(code TEXT, day DATE) RETURNS NUMERIC
+    LANGUAGE sql STABLE AS $$
+        SELECT COALESCE(
+            (SELECT rate FROM fx_rates WHERE currency = code AND rate_date <= day
+             ORDER BY rate_date DESC LIMIT 1),
+            (SELECT rate FROM fx_rates WHERE currency = code ORDER BY rate_date LIMIT 1),
+            1
+        )
+    $$
+"""
+
+
+def month_start(value) -> date:
+    """Первое число месяца для даты или datetime"""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    """Сдвиг первого числа месяца на count месяцев"""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"transactions_p{month:%Y_%m}"
+
+
 class DatabaseManager:
     """Менеджер базы данных для финансового бота"""
     
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, replica_urls: Optional[List[str]] = None):
         self.database_url = database_url
         self.pool = None
+        
+        # Реплики для чтения отчетов и истории (DATABASE_REPLICA_URLS через запятую)
+        if replica_urls is None:
+            replica_urls = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+        self.replica_urls = replica_urls
+        self.replicas: Optional[ReplicaRouter] = None
+        
+        # Параметры пула соединений
+        self.pool_min_size = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+        self.pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+        self.command_timeout = float(os.getenv("DB_COMMAND_TIMEOUT", "60"))
+        self.acquire_timeout = float(os.getenv("DB_ACQUIRE_TIMEOUT", "30"))
+        self.statement_cache_size = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+        
+        # Месячные партиции transactions: сколько месяцев создавать заранее
+        self.partitions_ahead = int(os.getenv("TRANSACTION_PARTITIONS_AHEAD", "3"))
+        self.partition_maintenance_interval = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "86400"))
+        self.partitioned = False
+        self._maintenance_task: Optional[asyncio.Task] = None
+        
+        # Размер пачки серверного курсора при выгрузке истории
+        self.export_batch_size = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+        
+        # Кэш чтения балансов и расходов по категориям (CACHE_BACKEND)
+        self.cache = create_cache()
+        
+        # Пакетная запись транзакций (включается через WRITE_BEHIND_ENABLED)
+        self.write_queue: Optional[WriteBehindQueue] = None
+        
+        # Курсы валют в памяти: суммы в валюте пересчитываются в рубли перед записью в агрегаты
+        self.fx = FxRates()
+        self.fx_reload_interval = float(os.getenv("FX_RATES_RELOAD_INTERVAL", "3600"))
+        self._fx_task: Optional[asyncio.Task] = None
+        
+        # Истории пользователей в памяти для /insights, дополняются после каждой записи
+        self.analytics: Optional[SpendingAnalytics] = None
+        if os.getenv("ANALYTICS_ENABLED", "true").lower() == "true":
+            self.analytics = SpendingAnalytics(self)
+        
+        # Пользователи, которые точно есть в таблице users (ограниченный LRU)
+        self._known_users = OrderedDict()
+        self.known_users_limit = int(os.getenv("KNOWN_USERS_CACHE_SIZE", "10000"))
     
     async def initialize(self):
         """Инициализация пула соединений и создание таблиц"""
@@ -21,49 +309,55 @@ class DatabaseManager:
             # Создаем пул соединений
             self.pool = await asyncpg.create_pool(
                 self.database_url,
-                min_size=1,
-                max_size=5,
-                command_timeout=60
+                min_size=self.pool_min_size,
+                max_size=self.pool_max_size,
+                command_timeout=self.command_timeout,
+                statement_cache_size=self.statement_cache_size,
+                init=self._init_connection
             )
             
-            # Создаем таблицы
-            async with self.pool.acquire() as conn:
-                # Таблица пользователей
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        telegram_id BIGINT PRIMARY KEY,
-                        username VARCHAR(255),
-                        first_name VARCHAR(255),
-                        created_at TIMESTAMP DEFAULT NOW(),
-                        settings JSONB DEFAULT '{}'::jsonb
-                    )
-                """)
+            # Схема уже текущей версии - DDL не выполняется (нет лишних блокировок и round trip'ов)
+            async with self._acquire() as conn:
+                version, relkind = await self._schema_state(conn)
+                if version is not None and version >= SCHEMA_VERSION:
+                    needs_backfill = needs_rollups = False
+                    if version > SCHEMA_VERSION:
+                        logger.warning(f"⚠️ Схема БД версии {version} новее кода ({SCHEMA_VERSION})")
+                else:
+                    relkind, needs_backfill, needs_rollups = await self._create_schema(conn, relkind)
                 
-                # Таблица транзакций
-                await conn.execute("""
-                    CREATE TABLE IF NOT EXISTS transactions (
-                        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                        telegram_id BIGINT REFERENCES users(telegram_id),
-                        type VARCHAR(10) NOT NULL CHECK (type IN ('income', 'expense')),
-                        amount DECIMAL(12,2) NOT NULL CHECK (amount > 0),
-                        currency VARCHAR(3) DEFAULT 'RUB',
-                        category_or_source VARCHAR(100) NOT NULL,
-                        comment TEXT,
-                        transaction_date TIMESTAMP DEFAULT NOW(),
-                        created_at TIMESTAMP DEFAULT NOW()
+                self.partitioned = relkind == 'p'
+                if not self.partitioned:
+                    logger.warning(
+                        "⚠️ Таблица transactions не партиционирована, запросы за период сканируют всю историю. "
+                        "Миграция: python manage.py partition-transactions"
                     )
-                """)
-                
-                # Индексы для производительности
-                await conn.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_transactions_user_date 
-                    ON transactions(telegram_id, transaction_date DESC)
-                """)
-                
-                await conn.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_transactions_type 
-                    ON transactions(telegram_id, type)
-                """)
+            
+            await self.reload_fx_rates()
+            if self.fx_reload_interval > 0:
+                self._fx_task = asyncio.create_task(self._fx_reload_loop())
+            
+            if needs_backfill:
+                fixed = await self.reconcile_balances()
+                logger.info(f"✅ Агрегаты балансов заполнены для {fixed} пользователей")
+            
+            if needs_rollups:
+                users = await self.rebuild_rollups()
+                logger.info(f"✅ Помесячные агрегаты заполнены для {users} пользователей")
+            
+            if version is None or version < SCHEMA_VERSION:
+                await self._set_schema_version()
+            
+            if self.partitioned:
+                await self.ensure_partitions()
+                self._maintenance_task = asyncio.create_task(self._partition_maintenance())
+            
+            if os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true":
+                self.write_queue = WriteBehindQueue(self)
+                self.write_queue.start()
+            
+            if self.replica_urls:
+                await self._start_replicas()
             
             logger.info("✅ База данных инициализирована")
             
@@ -71,11 +365,401 @@ class DatabaseManager:
             logger.error(f"❌ Ошибка инициализации БД: {e}")
             raise
     
+    async def _schema_state(self, conn) -> Tuple[Optional[int], Optional[str]]:
+        """Записанная версия схемы (None - схема не создавалась) и relkind таблицы transactions"""
+        
+        row = await conn.fetchrow("""
+            SELECT to_regclass('schema_version') IS NOT NULL AS versioned,
+                   (SELECT relkind::text FROM pg_class WHERE oid = to_regclass('transactions')) AS relkind
+        """)
+        version = await conn.fetchval("SELECT MAX(version) FROM schema_version") if row['versioned'] else None
+        return version, row['relkind']
+    
+    async def _create_schema(self, conn, relkind: Optional[str]) -> Tuple[str, bool, bool]:
+        """Создание таблиц, индексов и функций (идемпотентно)
+        
+        Возвращает relkind transactions и нужно ли заполнить агрегаты балансов
+        и помесячные агрегаты по уже существующим операциям.
+        """
+        
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                telegram_id BIGINT PRIMARY KEY,
+                username VARCHAR(255),
+                first_name VARCHAR(255),
+                created_at TIMESTAMP DEFAULT NOW(),
+                settings JSONB DEFAULT '{}'::jsonb
+            )
+        """)
+        
+        # Таблица транзакций: новая база сразу создается с месячными партициями,
+        # существующая обычная таблица переводится командой manage.py partition-transactions
+        if relkind is None:
+            await self._create_transactions_table(conn)
+            relkind = 'p'
+        else:
+            await self._create_transaction_indexes(conn)
+        
+        # Агрегаты баланса по пользователю - обновляются при каждой записи
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_balances (
+                telegram_id BIGINT PRIMARY KEY REFERENCES users(telegram_id),
+                total_income DECIMAL(14,2) NOT NULL DEFAULT 0,
+                total_expense DECIMAL(14,2) NOT NULL DEFAULT 0,
+                transaction_count INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        
+        # Суммы и число операций по месяцам и категориям - для отчетов за период
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS monthly_rollups (
+                telegram_id BIGINT NOT NULL REFERENCES users(telegram_id),
+                month DATE NOT NULL,
+                type VARCHAR(10) NOT NULL,
+                category_or_source VARCHAR(100) NOT NULL,
+                total DECIMAL(14,2) NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (telegram_id, month, type, category_or_source)
+            )
+        """)
+        
+        # Кэш результатов извлечения по шаблону сообщения (EXTRACTION_CACHE_PERSIST)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                template TEXT PRIMARY KEY,
+                result JSONB NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        
+        # Курсы валют к рублю по дням; пустая таблица заполняется из data/fx_rates.csv
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS fx_rates (
+                currency VARCHAR(3) NOT NULL,
+                rate_date DATE NOT NULL,
+                rate NUMERIC(18,6) NOT NULL CHECK (rate > 0),
+                PRIMARY KEY (currency, rate_date)
+            )
+        """)
+        if await conn.fetchval("SELECT to_regprocedure('fx_rate(text, date)') IS NULL"):
+            await conn.execute(FX_RATE_FUNCTION)
+        if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM fx_rates)"):
+            await self._upsert_fx_rates(conn, read_rates())
+        
+        # Примененные версии схемы (SCHEMA_VERSION) - записываются после заполнения агрегатов
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+        
+        # Первый запуск на существующих данных - заполняем агрегаты
+        needs_backfill = await conn.fetchval("""
+            SELECT NOT EXISTS (SELECT 1 FROM user_balances)
+               AND EXISTS (SELECT 1 FROM transactions)
+        """)
+        needs_rollups = await conn.fetchval("""
+            SELECT NOT EXISTS (SELECT 1 FROM monthly_rollups)
+               AND EXISTS (SELECT 1 FROM transactions)
+        """)
+        return relkind, needs_backfill, needs_rollups
+    
+    async def _set_schema_version(self):
+        async with self._acquire() as conn:
+            await conn.execute(
+                "INSERT INTO schema_version (version) VALUES ($1) ON CONFLICT DO NOTHING", SCHEMA_VERSION
+            )
+        logger.info(f"✅ Схема БД обновлена до версии {SCHEMA_VERSION}")
+    
+    async def _start_replicas(self):
+        """Пулы реплик; недоступная при старте реплика пропускается - читаем с primary"""
+        
+        replicas = []
+        for url in self.replica_urls:
+            try:
+                pool = await asyncpg.create_pool(
+                    url,
+                    min_size=self.pool_min_size,
+                    max_size=self.pool_max_size,
+                    command_timeout=self.command_timeout,
+                    statement_cache_size=self.statement_cache_size,
+                    init=self._init_connection
+                )
+                replicas.append(Replica(url, pool))
+            except Exception as e:
+                logger.error(f"❌ Реплика недоступна, чтение будет идти с primary: {e}")
+        
+        if replicas:
+            self.replicas = ReplicaRouter(self.pool, replicas, sticky_users_limit=self.known_users_limit)
+            await self.replicas.start()
+            logger.info(f"✅ Реплик для чтения: {len(replicas)}")
+    
+    async def _create_transactions_table(self, conn):
+        """Создание партиционированной по месяцам таблицы транзакций
+        
+        Первичный ключ партиционированной таблицы обязан включать ключ
+        партиционирования, поэтому он составной (id, transaction_date).
+        Строки за месяцы без партиции попадают в transactions_default и
+        переносятся в свою партицию при следующем ensure_partitions.
+        """
+        
+        await conn.execute("""
+            CREATE TABLE transactions (
+                id UUID NOT NULL DEFAULT gen_random_uuid(),
+                telegram_id BIGINT REFERENCES users(telegram_id),
+                type VARCHAR(10) NOT NULL CHECK (type IN ('income', 'expense')),
+                amount DECIMAL(12,2) NOT NULL CHECK (amount > 0),
+                currency VARCHAR(3) DEFAULT 'RUB',
+                category_or_source VARCHAR(100) NOT NULL,
+                comment TEXT,
+                transaction_date TIMESTAMP NOT NULL DEFAULT NOW(),
+                created_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (id, transaction_date)
+            ) PARTITION BY RANGE (transaction_date)
+        """)
+        
+        await conn.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+        await self._create_transaction_indexes(conn)
+    
+    async def _create_transaction_indexes(self, conn):
+        """Индексы transactions (на партиционированной таблице наследуются партициями)"""
+        
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_transactions_user_date 
+            ON transactions(telegram_id, transaction_date DESC)
+        """)
+        
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_transactions_type 
+            ON transactions(telegram_id, type)
+        """)
+        
+        # Дублировал ключ idx_transactions_type и только удорожал запись; расходы по
+        # категориям теперь читаются из monthly_rollups
+        await conn.execute("DROP INDEX IF EXISTS idx_transactions_type_category")
+    
+    async def ensure_partitions(self, start=None, end=None, months: Optional[Iterable[date]] = None) -> int:
+        """Создание месячных партиций transactions
+        
+        Покрывает месяцы с start по end включительно (по умолчанию - от текущего
+        месяца на TRANSACTION_PARTITIONS_AHEAD вперед) или только перечисленные
+        months, а также все месяцы, строки которых лежат в transactions_default.
+        Возвращает число новых партиций.
+        """
+        
+        if not self.partitioned:
+            return 0
+        
+        if months is not None:
+            months = {month_start(month) for month in months}
+        else:
+            first = month_start(start or datetime.now())
+            last = month_start(end) if end else add_months(month_start(datetime.now()), self.partitions_ahead)
+            
+            months = set()
+            month = first
+            while month <= last:
+                months.add(month)
+                month = add_months(month, 1)
+        
+        created = 0
+        try:
+            async with self._acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT DISTINCT date_trunc('month', transaction_date)::date AS month
+                    FROM transactions_default
+                """)
+                months.update(row['month'] for row in rows)
+                
+                for month in sorted(months):
+                    if await self._create_partition(conn, month):
+                        created += 1
+            
+            if created:
+                logger.info(f"✅ Создано партиций transactions: {created}")
+            return created
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка создания партиций: {e}")
+            raise
+    
+    async def _create_partition(self, conn, month: date) -> bool:
+        """Создание партиции за месяц с переносом ее строк из transactions_default"""
+        
+        name = _partition_name(month)
+        if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name):
+            return False
+        
+        next_month = add_months(month, 1)
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", PARTITION_LOCK_KEY)
+            if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name):
+                return False
+            
+            # Новая партиция не может пересекаться со строками в default - переносим их
+            await conn.execute(f"""
+                CREATE TABLE {name} (LIKE transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            """)
+            await conn.execute(f"""
+                WITH moved AS (
+                    DELETE FROM transactions_default 
+                    WHERE transaction_date >= $1 AND transaction_date < $2
+                    RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+            """, month, next_month)
+            await conn.execute(f"""
+                ALTER TABLE transactions ATTACH PARTITION {name} 
+                FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')
+            """)
+        return True
+    
+    async def _partition_maintenance(self):
+        """Фоновое создание партиций на будущие месяцы"""
+        
+        while True:
+            await asyncio.sleep(self.partition_maintenance_interval)
+            try:
+                await self.ensure_partitions()
+            except Exception:
+                # Ошибка уже залогирована, следующая попытка - через интервал
+                pass
+    
+    async def partition_transactions(self, keep_legacy: bool = True) -> int:
+        """Перевод существующей обычной таблицы transactions на месячные партиции
+        
+        Выполняется в одной транзакции под эксклюзивной блокировкой: старая таблица
+        переименовывается в transactions_legacy (вместе с индексами), создается
+        партиционированная, данные копируются. Возвращает число перенесенных строк.
+        """
+        
+        try:
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    relkind = await conn.fetchval("SELECT relkind::text FROM pg_class WHERE oid = to_regclass('transactions')")
+                    if relkind == 'p':
+                        logger.info("✅ Таблица transactions уже партиционирована")
+                        return 0
+                    
+                    await conn.execute("LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE")
+                    await conn.execute("ALTER TABLE transactions RENAME TO transactions_legacy")
+                    
+                    # Имена индексов уникальны в схеме - освобождаем их для новой таблицы
+                    indexes = await conn.fetch("""
+                        SELECT indexname FROM pg_indexes 
+                        WHERE schemaname = current_schema() AND tablename = 'transactions_legacy'
+                    """)
+                    for row in indexes:
+                        await conn.execute(f'ALTER INDEX "{row["indexname"]}" RENAME TO "{row["indexname"]}_legacy"')
+                    
+                    await self._create_transactions_table(conn)
+                    
+                    months = await conn.fetch("""
+                        SELECT DISTINCT date_trunc('month', COALESCE(transaction_date, created_at, NOW()))::date AS month
+                        FROM transactions_legacy
+                    """)
+                    for row in months:
+                        await self._create_partition(conn, row['month'])
+                    
+                    moved = await conn.fetchval("""
+                        WITH moved AS (
+                            INSERT INTO transactions 
+                            (id, telegram_id, type, amount, currency, category_or_source, 
+                             comment, transaction_date, created_at)
+                            SELECT 
+                                id, telegram_id, type, amount, currency, category_or_source,
+                                comment, COALESCE(transaction_date, created_at, NOW()), created_at
+                            FROM transactions_legacy
+                            RETURNING 1
+                        )
+                        SELECT COUNT(*) FROM moved
+                    """)
+                    
+                    if not keep_legacy:
+                        await conn.execute("DROP TABLE transactions_legacy")
+            
+            self.partitioned = True
+            await self.ensure_partitions()
+            logger.info(f"✅ Таблица transactions партиционирована, перенесено строк: {moved}")
+            return moved
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка партиционирования transactions: {e}")
+            raise
+    
+    async def _init_connection(self, conn):
+        """Замер каждого запроса соединения (db_query_seconds и этап db.<метка> апдейта)"""
+        conn.add_query_logger(self._observe_query)
+    
+    @staticmethod
+    def _observe_query(record):
+        # asyncpg вызывает логгер через call_soon в контексте запроса - этап попадает в его разбивку
+        label = query_label(record.query)
+        record_stage(f"db.{label}", record.elapsed, DB_QUERY_SECONDS.labels(label))
+    
+    @asynccontextmanager
+    async def _acquire(self, pool=None):
+        """Соединение из пула (по умолчанию primary) с замером времени ожидания"""
+        
+        started = time.perf_counter()
+        async with (pool or self.pool).acquire(timeout=self.acquire_timeout) as conn:
+            record_stage("db.acquire", time.perf_counter() - started, DB_ACQUIRE_SECONDS)
+            yield conn
+    
+    async def _query(self, conn, name: str, method: str, *args):
+        """Выполнение горячего запроса (время замеряет логгер запросов соединения)
+        
+        method - fetch, fetchrow или fetchval. Текст запроса постоянный, поэтому
+        asyncpg подготавливает его один раз на соединение и дальше берет из кэша
+        statement'ов (DB_STATEMENT_CACHE_SIZE; 0 - например, за pgbouncer).
+        """
+        
+        return await getattr(conn, method)(HOT_QUERIES[name], *args)
+    
+    def _read_pool(self, telegram_id: int):
+        """Пул для чтения данных пользователя: реплика или primary (None)"""
+        
+        if self.replicas is None or _primary_reads.get():
+            return None
+        return self.replicas.pool_for(telegram_id)
+    
+    async def _read(self, telegram_id: int, name: str, method: str, *args):
+        """Горячий запрос только на чтение: на реплике, а при ее ошибке - на primary"""
+        
+        pool = self._read_pool(telegram_id)
+        if pool is not None:
+            try:
+                async with self._acquire(pool) as conn:
+                    return await self._query(conn, name, method, *args)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError,
+                    asyncpg.InterfaceError, asyncpg.CannotConnectNowError) as e:
+                self.replicas.mark_failed(pool, e)
+        
+        async with self._acquire() as conn:
+            return await self._query(conn, name, method, *args)
+    
+    def pool_stats(self) -> Dict:
+        """Метрики пула: размер, занятые соединения, ожидание и задержки запросов"""
+        
+        size = self.pool.get_size() if self.pool else 0
+        idle = self.pool.get_idle_size() if self.pool else 0
+        return {
+            "size": size,
+            "max_size": self.pool_max_size,
+            "in_use": size - idle,
+            "acquire": DB_ACQUIRE_SECONDS.summary(),
+            "queries": DB_QUERY_SECONDS.summary(),
+            "reads": self.replicas.stats() if self.replicas is not None else None
+        }
+    
     async def create_user_if_not_exists(self, telegram_id: int, username: str = None, first_name: str = None):
         """Создание пользователя если не существует"""
         
         try:
-            async with self.pool.acquire() as conn:
+            async with self._acquire() as conn:
                 await conn.execute("""
                     INSERT INTO users (telegram_id, username, first_name) 
                     VALUES ($1, $2, $3) 
@@ -83,35 +767,147 @@ class DatabaseManager:
                         username = EXCLUDED.username,
                         first_name = EXCLUDED.first_name
                 """, telegram_id, username, first_name)
+            
+            self._remember_user(telegram_id)
                 
         except Exception as e:
             logger.error(f"❌ Ошибка создания пользователя: {e}")
             raise
     
+    async def get_user(self, telegram_id: int) -> Optional[Dict]:
+        """Строка пользователя из users (для переноса между шардами)"""
+        
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT telegram_id, username, first_name, created_at, settings::text AS settings
+                FROM users WHERE telegram_id = $1
+            """, telegram_id)
+        return dict(row) if row else None
+    
+    async def put_user(self, user: Dict):
+        """Запись строки пользователя из get_user() как есть"""
+        
+        async with self._acquire() as conn:
+            await conn.execute("""
+                INSERT INTO users (telegram_id, username, first_name, created_at, settings)
+                VALUES ($1, $2, $3, $4, $5::jsonb)
+                ON CONFLICT (telegram_id) DO UPDATE SET
+                    username = EXCLUDED.username,
+                    first_name = EXCLUDED.first_name,
+                    settings = EXCLUDED.settings
+            """, user['telegram_id'], user['username'], user['first_name'], user['created_at'], user['settings'])
+        self._remember_user(user['telegram_id'])
+    
+    async def delete_user(self, telegram_id: int) -> int:
+        """Удаление пользователя со всеми операциями и агрегатами; возвращает число удаленных операций"""
+        
+        try:
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    deleted = await conn.fetchval("""
+                        WITH deleted AS (DELETE FROM transactions WHERE telegram_id = $1 RETURNING 1)
+                        SELECT COUNT(*) FROM deleted
+                    """, telegram_id)
+                    await conn.execute("DELETE FROM user_balances WHERE telegram_id = $1", telegram_id)
+                    await conn.execute("DELETE FROM monthly_rollups WHERE telegram_id = $1", telegram_id)
+                    await conn.execute("DELETE FROM users WHERE telegram_id = $1", telegram_id)
+            
+            self._known_users.pop(telegram_id, None)
+            await self._invalidate_cache([telegram_id])
+            return deleted
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления пользователя {telegram_id}: {e}")
+            raise
+    
+    async def list_users(self) -> List[int]:
+        """telegram_id всех пользователей базы"""
+        
+        async with self._acquire() as conn:
+            return [row['telegram_id'] for row in await conn.fetch("SELECT telegram_id FROM users")]
+    
+    async def count_users(self) -> Dict[str, int]:
+        """Число пользователей и оценка числа операций (по статистике таблиц, без полного скана)"""
+        
+        async with self._acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT
+                    (SELECT COUNT(*) FROM users) AS users,
+                    (SELECT COALESCE(SUM(n_live_tup), 0)::bigint
+                     FROM pg_stat_user_tables
+                     WHERE relid = to_regclass('transactions') OR relid IN (
+                         SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass('transactions')
+                     )) AS transactions
+            """)
+        return dict(row)
+    
+    async def _ensure_user(self, conn, telegram_id: int):
+        """Создание пользователя на уже взятом соединении, если он нам еще не встречался
+        
+        Запоминать пользователя нужно только после коммита транзакции - см. _remember_user.
+        """
+        
+        if telegram_id in self._known_users:
+            self._known_users.move_to_end(telegram_id)
+            return
+        
+        await conn.execute("""
+            INSERT INTO users (telegram_id) VALUES ($1)
+            ON CONFLICT (telegram_id) DO NOTHING
+        """, telegram_id)
+    
+    def _remember_user(self, telegram_id: int):
+        """Добавление пользователя в LRU известных пользователей"""
+        
+        self._known_users[telegram_id] = True
+        self._known_users.move_to_end(telegram_id)
+        if len(self._known_users) > self.known_users_limit:
+            self._known_users.popitem(last=False)
+    
     async def save_transaction(self, telegram_id: int, transaction_data: Dict):
         """Сохранение транзакции"""
         
+        # При включенной пакетной записи ждем коммита пакета с этой транзакцией
+        if self.write_queue is not None:
+            with span("db.write_queue"):
+                return await self.write_queue.submit(telegram_id, transaction_data)
+        
         try:
-            async with self.pool.acquire() as conn:
-                # Сначала создаем пользователя если не существует
-                await self.create_user_if_not_exists(telegram_id)
-                
-                # Сохраняем транзакцию
-                transaction_id = await conn.fetchval("""
-                    INSERT INTO transactions 
-                    (telegram_id, type, amount, currency, category_or_source, comment, transaction_date)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7)
-                    RETURNING id
-                """, 
-                    telegram_id,
-                    transaction_data['type'],
-                    float(transaction_data['amount']),
-                    transaction_data.get('currency', 'RUB'),
-                    transaction_data['category_or_source'],
-                    transaction_data.get('comment'),
-                    transaction_data.get('date', datetime.now())
-                )
+            # Одно соединение и одна транзакция БД на всю запись
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    # Создаем пользователя, если он нам еще не встречался
+                    await self._ensure_user(conn, telegram_id)
+                    
+                    transaction_date = transaction_data.get('date') or datetime.now()
+                    currency = transaction_data.get('currency', BASE_CURRENCY)
+                    transaction_id = await self._query(
+                        conn, "insert_transaction", "fetchval",
+                        telegram_id,
+                        transaction_data['type'],
+                        float(transaction_data['amount']),
+                        currency,
+                        transaction_data['category_or_source'],
+                        transaction_data.get('comment'),
+                        transaction_date
+                    )
+                    
+                    # Агрегаты ведутся в рублях по курсу на дату операции
+                    amount = self.fx.to_base(transaction_data['amount'], currency, transaction_date)
+                    await self._apply_to_balance(conn, telegram_id, transaction_data['type'], amount)
+                    await self._query(
+                        conn, "apply_rollup", "fetch",
+                        telegram_id, transaction_date, transaction_data['type'],
+                        transaction_data['category_or_source'], amount
+                    )
                 
+                self._remember_user(telegram_id)
+                await self._invalidate_cache([telegram_id])
+                self._append_history([(
+                    transaction_id, telegram_id, transaction_data['type'], float(transaction_data['amount']),
+                    currency, transaction_data['category_or_source'],
+                    transaction_data.get('comment'), transaction_date
+                )])
                 logger.info(f"✅ Транзакция сохранена: {transaction_id}")
                 return str(transaction_id)
                 
@@ -119,87 +915,611 @@ class DatabaseManager:
             logger.error(f"❌ Ошибка сохранения транзакции: {e}")
             raise
     
+    async def save_transactions_batch(self, rows: List[Tuple[int, Dict]]) -> List[str]:
+        """Сохранение пакета транзакций (возможно, разных пользователей)
+        
+        Одно соединение, одна транзакция БД: COPY всех строк и одно
+        обновление агрегатов на весь пакет. Возвращает id в порядке rows.
+        """
+        
+        records = [
+            (
+                uuid.UUID(data['id']) if data.get('id') else uuid.uuid4(),
+                telegram_id,
+                data['type'],
+                float(data['amount']),
+                data.get('currency', 'RUB'),
+                data['category_or_source'],
+                data.get('comment'),
+                data.get('date') or datetime.now()
+            )
+            for telegram_id, data in rows
+        ]
+        new_users = sorted({telegram_id for telegram_id, _ in rows if telegram_id not in self._known_users})
+        
+        try:
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    if new_users:
+                        await conn.execute("""
+                            INSERT INTO users (telegram_id) SELECT unnest($1::bigint[])
+                            ON CONFLICT (telegram_id) DO NOTHING
+                        """, new_users)
+                    
+                    # COPY и курсоры логгер запросов не видит - замеряем сами
+                    with span("db.copy_transactions", DB_QUERY_SECONDS.labels("copy_transactions")):
+                        await conn.copy_records_to_table(
+                            'transactions', records=records, columns=TRANSACTION_COLUMNS
+                        )
+                    
+                    amounts = self.fx.convert_records(records).tolist()
+                    await self._apply_to_balances(conn, records, amounts)
+                    await self._apply_to_rollups(conn, records, amounts)
+            
+            for telegram_id in new_users:
+                self._remember_user(telegram_id)
+            await self._invalidate_cache({telegram_id for telegram_id, _ in rows})
+            self._append_history(records)
+            
+            return [str(record[0]) for record in records]
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка пакетного сохранения транзакций: {e}")
+            raise
+    
+    async def import_transactions(self, telegram_id: int, transactions: List[Dict],
+                                  append_history: bool = True) -> int:
+        """Загрузка пакета импортированных транзакций пользователя без дублей
+        
+        Пакет идет через COPY во временную таблицу, оттуда в transactions с
+        ON CONFLICT DO NOTHING по первичному ключу ((id, transaction_date) в
+        партиционированной таблице, (id) в старой): у импортированных строк
+        детерминированные id, повторный импорт ничего не добавляет. Агрегаты
+        обновляются только по реально вставленным строкам. Возвращает их число.
+        
+        append_history=False - строки уже есть в истории аналитики (копия
+        пользователя при переносе между шардами).
+        """
+        
+        records = [
+            (
+                uuid.UUID(data['id']),
+                telegram_id,
+                data['type'],
+                float(data['amount']),
+                data.get('currency', 'RUB'),
+                data['category_or_source'],
+                data.get('comment'),
+                data['date']
+            )
+            for data in transactions
+        ]
+        if not records:
+            return 0
+        
+        # Исторические даты - партиции нужны до вставки, иначе строки лягут в default.
+        # Только месяцы, где есть строки: выписка за годы не плодит пустые партиции
+        await self.ensure_partitions(months={month_start(record[7]) for record in records})
+        
+        conflict_key = "id, transaction_date" if self.partitioned else "id"
+        
+        try:
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    await self._ensure_user(conn, telegram_id)
+                    
+                    await conn.execute("""
+                        CREATE TEMP TABLE IF NOT EXISTS import_staging 
+                        (LIKE transactions INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+                    """)
+                    
+                    with span("db.copy_import", DB_QUERY_SECONDS.labels("copy_import")):
+                        await conn.copy_records_to_table(
+                            'import_staging', records=records, columns=TRANSACTION_COLUMNS
+                        )
+                    
+                    inserted = await conn.fetch(f"""
+                        INSERT INTO transactions 
+                        (id, telegram_id, type, amount, currency, category_or_source, comment, transaction_date)
+                        SELECT id, telegram_id, type, amount, currency, category_or_source, comment, transaction_date
+                        FROM import_staging
+                        ON CONFLICT ({conflict_key}) DO NOTHING
+                        RETURNING id, telegram_id, type, amount, currency, category_or_source, comment, transaction_date
+                    """)
+                    
+                    if inserted:
+                        amounts = self.fx.convert_records(inserted).tolist()
+                        await self._apply_to_balances(conn, inserted, amounts)
+                        await self._apply_to_rollups(conn, inserted, amounts)
+            
+            self._remember_user(telegram_id)
+            if inserted:
+                await self._invalidate_cache([telegram_id])
+                if append_history:
+                    self._append_history(inserted)
+            return len(inserted)
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка импорта транзакций: {e}")
+            raise
+    
+    async def _apply_to_balance(self, conn, telegram_id: int, transaction_type: str, amount: float):
+        """Инкрементальное обновление агрегатов баланса (внутри транзакции записи)"""
+        
+        await self._query(conn, "apply_balance", "fetch", telegram_id, transaction_type, amount)
+    
+    async def _apply_to_balances(self, conn, records: List[tuple], amounts: List[float]):
+        """Обновление агрегатов баланса для пакета записей в формате TRANSACTION_COLUMNS
+        
+        amounts - суммы записей в рублях (FxRates.convert_records).
+        """
+        
+        totals = {}
+        for (_, telegram_id, transaction_type, *_), amount in zip(records, amounts):
+            income, expense, count = totals.get(telegram_id, (Decimal(0), Decimal(0), 0))
+            if transaction_type == 'income':
+                income += Decimal(str(amount))
+            else:
+                expense += Decimal(str(amount))
+            totals[telegram_id] = (income, expense, count + 1)
+        
+        # Фиксированный порядок строк - без взаимных блокировок между пакетами
+        user_ids = sorted(totals)
+        await self._query(
+            conn, "apply_balances", "fetch",
+            user_ids,
+            [totals[user_id][0] for user_id in user_ids],
+            [totals[user_id][1] for user_id in user_ids],
+            [totals[user_id][2] for user_id in user_ids]
+        )
+    
+    async def _apply_to_rollups(self, conn, records: List[tuple], amounts: List[float]):
+        """Обновление помесячных агрегатов для пакета записей в формате TRANSACTION_COLUMNS
+        
+        amounts - суммы записей в рублях (FxRates.convert_records).
+        """
+        
+        totals = {}
+        for (_, telegram_id, transaction_type, _, _, category, _, transaction_date), amount in zip(records, amounts):
+            key = (telegram_id, month_start(transaction_date), transaction_type, category)
+            total, count = totals.get(key, (Decimal(0), 0))
+            totals[key] = (total + Decimal(str(amount)), count + 1)
+        
+        # Фиксированный порядок строк - без взаимных блокировок между пакетами
+        keys = sorted(totals)
+        await self._query(
+            conn, "apply_rollups", "fetch",
+            [key[0] for key in keys],
+            [key[1] for key in keys],
+            [key[2] for key in keys],
+            [key[3] for key in keys],
+            [totals[key][0] for key in keys],
+            [totals[key][1] for key in keys]
+        )
+    
+    async def reconcile_balances(self, telegram_id: Optional[int] = None) -> int:
+        """Пересчет агрегатов баланса по таблице транзакций
+        
+        Используется для первичного заполнения и сверки. Возвращает число
+        пользователей, у которых агрегаты были исправлены.
+        """
+        
+        try:
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    # Блокируем вставки на время пересчета, чтобы не потерять новые записи
+                    await conn.execute("LOCK TABLE transactions IN SHARE MODE")
+                    
+                    fixed = await conn.fetch(f"""
+                        INSERT INTO user_balances AS b
+                            (telegram_id, total_income, total_expense, transaction_count)
+                        SELECT 
+                            u.telegram_id,
+                            COALESCE(SUM(CASE WHEN t.type = 'income' THEN {AMOUNT_BASE} ELSE 0 END), 0),
+                            COALESCE(SUM(CASE WHEN t.type = 'expense' THEN {AMOUNT_BASE} ELSE 0 END), 0),
+                            COUNT(t.id)
+                        FROM users u
+                        LEFT JOIN transactions t ON t.telegram_id = u.telegram_id
+                        WHERE $1::bigint IS NULL OR u.telegram_id = $1
+                        GROUP BY u.telegram_id
+                        ON CONFLICT (telegram_id) DO UPDATE SET
+                            total_income = EXCLUDED.total_income,
+                            total_expense = EXCLUDED.total_expense,
+                            transaction_count = EXCLUDED.transaction_count,
+                            updated_at = NOW()
+                        WHERE (b.total_income, b.total_expense, b.transaction_count)
+                            IS DISTINCT FROM
+                            (EXCLUDED.total_income, EXCLUDED.total_expense, EXCLUDED.transaction_count)
+                        RETURNING telegram_id
+                    """, telegram_id)
+                    
+            await self._invalidate_cache([row['telegram_id'] for row in fixed])
+            return len(fixed)
+                    
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересчета балансов: {e}")
+            raise
+    
+    async def rebuild_rollups(self, telegram_id: Optional[int] = None) -> int:
+        """Пересборка помесячных агрегатов по таблице транзакций
+        
+        Используется для первичного заполнения и сверки. Возвращает число
+        пользователей, для которых агрегаты пересобраны. В старой
+        непартиционированной таблице transaction_date может быть NULL - такие
+        операции относятся к месяцу created_at, как и при переносе в партиции.
+        """
+        
+        try:
+            async with self._acquire() as conn:
+                async with conn.transaction():
+                    # Блокируем вставки на время пересборки, чтобы не потерять новые записи
+                    await conn.execute("LOCK TABLE transactions IN SHARE MODE")
+                    
+                    await conn.execute("""
+                        DELETE FROM monthly_rollups WHERE $1::bigint IS NULL OR telegram_id = $1
+                    """, telegram_id)
+                    
+                    rows = await conn.fetch(f"""
+                        INSERT INTO monthly_rollups (telegram_id, month, type, category_or_source, total, count)
+                        SELECT 
+                            telegram_id, date_trunc('month', COALESCE(transaction_date, created_at))::date,
+                            type, category_or_source, SUM({AMOUNT_BASE}), COUNT(*)
+                        FROM transactions
+                        WHERE $1::bigint IS NULL OR telegram_id = $1
+                        GROUP BY 1, 2, 3, 4
+                        RETURNING telegram_id
+                    """, telegram_id)
+            
+            user_ids = {row['telegram_id'] for row in rows}
+            await self._invalidate_cache(user_ids)
+            return len(user_ids)
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересборки помесячных агрегатов: {e}")
+            raise
+    
+    async def _upsert_fx_rates(self, conn, rows: List[Tuple[str, date, float]]):
+        await conn.execute("""
+            INSERT INTO fx_rates (currency, rate_date, rate)
+            SELECT * FROM unnest($1::text[], $2::date[], $3::numeric[])
+            ON CONFLICT (currency, rate_date) DO UPDATE SET rate = EXCLUDED.rate
+        """, [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows])
+    
+    async def reload_fx_rates(self) -> int:
+        """Перечитывание курсов из fx_rates в память; возвращает число курсов"""
+        
+        async with self._acquire() as conn:
+            rows = await conn.fetch("SELECT currency, rate_date, rate FROM fx_rates")
+        self.fx.load((row['currency'], row['rate_date'], float(row['rate'])) for row in rows)
+        return len(rows)
+    
+    async def _fx_reload_loop(self):
+        """Курсы, загруженные другой репликой, подхватываются раз в FX_RATES_RELOAD_INTERVAL секунд"""
+        
+        while True:
+            await asyncio.sleep(self.fx_reload_interval)
+            try:
+                await self.reload_fx_rates()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления курсов валют: {e}")
+    
+    async def import_fx_rates(self, rows: List[Tuple[str, date, float]]) -> int:
+        """Загрузка курсов (валюта, дата, курс) с пересчетом агрегатов
+        
+        Новый курс меняет рублевые суммы уже записанных операций, поэтому
+        балансы, помесячные агрегаты и истории аналитики пользователей с
+        операциями в валюте пересчитываются. Возвращает число таких пользователей.
+        """
+        
+        try:
+            async with self._acquire() as conn:
+                await self._upsert_fx_rates(conn, rows)
+                user_ids = [row['telegram_id'] for row in await conn.fetch(
+                    "SELECT DISTINCT telegram_id FROM transactions WHERE currency <> $1", BASE_CURRENCY
+                )]
+            
+            await self.reload_fx_rates()
+            for telegram_id in user_ids:
+                await self.reconcile_balances(telegram_id)
+                await self.rebuild_rollups(telegram_id)
+            if self.analytics is not None:
+                self.analytics.forget(user_ids)
+            
+            logger.info(f"✅ Загружено курсов: {len(rows)}, пересчитаны агрегаты {len(user_ids)} пользователей")
+            return len(user_ids)
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки курсов валют: {e}")
+            raise
+    
+    async def _invalidate_cache(self, telegram_ids):
+        """Сброс кэша чтения после коммита транзакций пользователей
+        
+        Заодно следующие чтения этих пользователей ненадолго идут на primary
+        (ReplicaRouter), чтобы не прочитать с реплики состояние до записи.
+        """
+        
+        if self.replicas is not None:
+            self.replicas.mark_written(telegram_ids)
+        if self.cache is not None:
+            for telegram_id in telegram_ids:
+                await self.cache.invalidate(telegram_id, CACHED_KINDS)
+    
+    def _append_history(self, records):
+        """Дополнение историй аналитики закоммиченными строками (формат TRANSACTION_COLUMNS)"""
+        
+        if self.analytics is not None:
+            try:
+                self.analytics.append(records)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления истории аналитики: {e}")
+    
+    async def _cached(self, kind: str, telegram_id: int, loader):
+        """Чтение через кэш (если он включен)"""
+        
+        if self.cache is None:
+            return await loader()
+        if self.replicas is not None and self.cache.backend.shared:
+            # Read-your-writes у реплик - только в процессе, который писал: другой
+            # процесс прочитал бы с отстающей реплики и положил в общий кэш старое
+            # значение до следующей записи. Промахи общего кэша читаем с primary
+            async def load_from_primary():
+                token = _primary_reads.set(True)
+                try:
+                    return await loader()
+                finally:
+                    _primary_reads.reset(token)
+            
+            return await self.cache.get_or_load(kind, telegram_id, load_from_primary)
+        return await self.cache.get_or_load(kind, telegram_id, loader)
+    
     async def get_user_transactions(self, telegram_id: int, limit: int = 100) -> List[Dict]:
         """Получение транзакций пользователя"""
         
         try:
-            async with self.pool.acquire() as conn:
-                rows = await conn.fetch("""
-                    SELECT 
-                        id, type, amount, currency, category_or_source, 
-                        comment, transaction_date, created_at
-                    FROM transactions 
-                    WHERE telegram_id = $1 
-                    ORDER BY transaction_date DESC 
-                    LIMIT $2
-                """, telegram_id, limit)
-                
-                return [dict(row) for row in rows]
+            rows = await self._read(telegram_id, "recent_transactions", "fetch", telegram_id, limit)
+            return [dict(row) for row in rows]
                 
         except Exception as e:
             logger.error(f"❌ Ошибка получения транзакций: {e}")
             return []
     
-    async def get_balance(self, telegram_id: int) -> Dict:
-        """Расчет баланса пользователя"""
+    @staticmethod
+    def _period(start: Optional[datetime], end: Optional[datetime]) -> Optional[Tuple[datetime, datetime]]:
+        """Границы периода [start, end) для запроса или None, если период не задан"""
+        
+        if start is None and end is None:
+            return None
+        return start or datetime.min, end or datetime.max
+    
+    async def iter_user_transactions(self, telegram_id: int, batch_size: Optional[int] = None,
+                                     primary: bool = False) -> AsyncIterator[List]:
+        """Вся история пользователя пачками через серверный курсор
+        
+        В памяти одновременно только одна пачка (EXPORT_BATCH_SIZE строк).
+        Курсор работает в read-only транзакции REPEATABLE READ - выгрузка видит
+        согласованный снимок, даже если пользователь тем временем добавляет операции.
+        Соединение занято до конца обхода - закрывайте генератор (aclosing).
+        Читает с реплики, если она есть; primary=True - только с primary
+        (перенос данных, где отставание реплики недопустимо).
+        """
+        
+        batch_size = batch_size or self.export_batch_size
+        
+        async with self._acquire(None if primary else self._read_pool(telegram_id)) as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                cursor = await conn.cursor(HOT_QUERIES["export_transactions"], telegram_id)
+                while True:
+                    with span("db.export_batch", DB_QUERY_SECONDS.labels("export_batch")):
+                        rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        return
+                    yield rows
+    
+    async def get_balance(self, telegram_id: int, start: Optional[datetime] = None,
+                          end: Optional[datetime] = None) -> Dict:
+        """Расчет баланса пользователя за все время или за период [start, end)
+        
+        Баланс за все время берется из агрегатов user_balances (через кэш),
+        за период - суммируется по партициям, попадающим в период.
+        """
+        
+        period = self._period(start, end)
+        
+        async def load():
+            if period is None:
+                result = await self._read(telegram_id, "balance", "fetchrow", telegram_id)
+            else:
+                result = await self._read(telegram_id, "balance_period", "fetchrow", telegram_id, *period)
+            return self._balance_from_row(result)
         
         try:
-            async with self.pool.acquire() as conn:
-                result = await conn.fetchrow("""
-                    SELECT 
-                        COALESCE(SUM(CASE WHEN type = 'income' THEN amount ELSE 0 END), 0) as total_income,
-                        COALESCE(SUM(CASE WHEN type = 'expense' THEN amount ELSE 0 END), 0) as total_expense,
-                        COUNT(*) as transaction_count
-                    FROM transactions 
-                    WHERE telegram_id = $1
-                """, telegram_id)
-                
-                if result and result['transaction_count'] > 0:
-                    balance = float(result['total_income']) - float(result['total_expense'])
-                    return {
-                        'balance': balance,
-                        'total_income': float(result['total_income']),
-                        'total_expense': float(result['total_expense']),
-                        'transaction_count': result['transaction_count']
-                    }
-                else:
-                    return {
-                        'balance': 0.0,
-                        'total_income': 0.0,
-                        'total_expense': 0.0,
-                        'transaction_count': 0
-                    }
+            if period is not None:
+                return await load()
+            return await self._cached("balance", telegram_id, load)
                     
         except Exception as e:
             logger.error(f"❌ Ошибка расчета баланса: {e}")
+            return self._balance_from_row(None)
+    
+    async def get_user_context(self, telegram_id: int, limit: int = 5) -> Dict:
+        """Баланс и последние транзакции пользователя одним запросом"""
+        
+        rows = await self._read(telegram_id, "user_context", "fetch", telegram_id, limit)
+        
+        transaction_fields = (
+            'id', 'type', 'amount', 'currency', 'category_or_source',
+            'comment', 'transaction_date', 'created_at'
+        )
+        
+        return {
+            "balance": self._balance_from_row(rows[0]),
+            "recent_transactions": [
+                {field: row[field] for field in transaction_fields}
+                for row in rows if row['id'] is not None
+            ]
+        }
+    
+    @staticmethod
+    def _balance_from_row(row) -> Dict:
+        """Словарь баланса из строки user_balances (или нулевой баланс)"""
+        
+        if row and row['transaction_count']:
+            total_income = float(row['total_income'])
+            total_expense = float(row['total_expense'])
             return {
-                'balance': 0.0,
-                'total_income': 0.0,
-                'total_expense': 0.0,
-                'transaction_count': 0
+                'balance': total_income - total_expense,
+                'total_income': total_income,
+                'total_expense': total_expense,
+                'transaction_count': row['transaction_count']
             }
+        
+        return {
+            'balance': 0.0,
+            'total_income': 0.0,
+            'total_expense': 0.0,
+            'transaction_count': 0
+        }
     
-    async def get_expenses_by_category(self, telegram_id: int) -> Dict[str, float]:
-        """Получение расходов по категориям"""
+    async def get_expenses_by_category(self, telegram_id: int, start: Optional[datetime] = None,
+                                       end: Optional[datetime] = None) -> Dict[str, float]:
+        """Получение расходов по категориям за все время или за период [start, end)"""
+        
+        period = self._period(start, end)
+        
+        async def load():
+            if period is None:
+                rows = await self._read(telegram_id, "expenses_by_category", "fetch", telegram_id)
+            else:
+                rows = await self._read(telegram_id, "expenses_by_category_period", "fetch", telegram_id, *period)
+            return {row['category_or_source']: float(row['total']) for row in rows}
         
         try:
-            async with self.pool.acquire() as conn:
-                rows = await conn.fetch("""
-                    SELECT category_or_source, SUM(amount) as total
-                    FROM transactions 
-                    WHERE telegram_id = $1 AND type = 'expense'
-                    GROUP BY category_or_source
-                    ORDER BY total DESC
-                """, telegram_id)
-                
-                return {row['category_or_source']: float(row['total']) for row in rows}
+            if period is not None:
+                return await load()
+            return await self._cached("expenses_by_category", telegram_id, load)
                 
         except Exception as e:
             logger.error(f"❌ Ошибка получения расходов по категориям: {e}")
             return {}
     
+    async def get_history_columns(self, telegram_id: int) -> List:
+        """Вся история пользователя массивами по (тип, категория): дни от 1970-01-01 и суммы"""
+        
+        return await self._read(telegram_id, "history_columns", "fetch", telegram_id)
+    
+    async def get_report_data(self, telegram_id: int, recent_limit: int = REPORT_RECENT_LIMIT) -> Dict:
+        """Баланс, расходы по категориям и последние операции одним запросом (через кэш)
+        
+        В кэше отчет лежит в виде, пригодном для JSON (Redis): суммы - float,
+        даты - ISO-строки; даты восстанавливаются при каждом чтении. Кэшируется
+        только отчет с REPORT_RECENT_LIMIT операциями (ключ кэша не учитывает лимит).
+        """
+        
+        async def load():
+            rows = await self._read(telegram_id, "report", "fetch", telegram_id, recent_limit)
+            
+            balance_row = None
+            expenses_by_category = {}
+            recent_transactions = []
+            
+            for row in rows:
+                if row['section'] == 'balance':
+                    balance_row = {
+                        'total_income': row['amount'],
+                        'total_expense': row['total_expense'],
+                        'transaction_count': row['transaction_count']
+                    }
+                elif row['section'] == 'category':
+                    expenses_by_category[row['category_or_source']] = float(row['amount'])
+                else:
+                    recent_transactions.append({
+                        'type': row['type'],
+                        'amount': float(row['amount']),
+                        'currency': row['currency'],
+                        'category_or_source': row['category_or_source'],
+                        'transaction_date': row['transaction_date']
+                    })
+            
+            recent_transactions.sort(key=lambda t: t['transaction_date'] or datetime.min, reverse=True)
+            for transaction in recent_transactions:
+                if transaction['transaction_date'] is not None:
+                    transaction['transaction_date'] = transaction['transaction_date'].isoformat()
+            
+            return {
+                "balance": self._balance_from_row(balance_row),
+                "expenses_by_category": expenses_by_category,
+                "recent_transactions": recent_transactions
+            }
+        
+        if recent_limit == REPORT_RECENT_LIMIT:
+            report = await self._cached("report", telegram_id, load)
+        else:
+            report = await load()
+        return {
+            **report,
+            "recent_transactions": [
+                {
+                    **transaction,
+                    'transaction_date': transaction['transaction_date'] and datetime.fromisoformat(transaction['transaction_date'])
+                }
+                for transaction in report["recent_transactions"]
+            ]
+        }
+    
+    async def get_monthly_rollups(self, telegram_id: int, first_month: date, last_month: date) -> List[Dict]:
+        """Помесячные суммы по категориям за месяцы с first_month по last_month включительно
+        
+        Читает только monthly_rollups - время не зависит от длины истории.
+        """
+        
+        try:
+            rows = await self._read(
+                telegram_id, "rollups", "fetch", telegram_id, month_start(first_month), month_start(last_month)
+            )
+            
+            return [
+                {
+                    'month': row['month'],
+                    'type': row['type'],
+                    'category_or_source': row['category_or_source'],
+                    'total': float(row['total']),
+                    'count': row['count']
+                }
+                for row in rows
+            ]
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения помесячных агрегатов: {e}")
+            raise
+    
+    async def get_cached_extraction(self, template: str, max_age: float) -> Optional[Dict]:
+        """Результат извлечения из постоянного кэша, если он не старше max_age секунд"""
+        
+        async with self._acquire() as conn:
+            result = await self._query(conn, "cached_extraction", "fetchval", template, max_age)
+        return json.loads(result) if result is not None else None
+    
+    async def save_cached_extraction(self, template: str, result: Dict):
+        """Сохранение результата извлечения в постоянный кэш"""
+        
+        async with self._acquire() as conn:
+            await self._query(conn, "save_extraction", "execute", template, json.dumps(result, ensure_ascii=False))
+    
     async def close(self):
         """Закрытие соединений с базой данных"""
+        if self._maintenance_task is not None:
+            self._maintenance_task.cancel()
+            self._maintenance_task = None
+        if self._fx_task is not None:
+            self._fx_task.cancel()
+            self._fx_task = None
+        if self.write_queue is not None:
+            await self.write_queue.stop()
+            self.write_queue = None
+        if self.replicas is not None:
+            await self.replicas.close()
+            self.replicas = None
         if self.pool:
             await self.pool.close()
             logger.info("✅ Соединения с БД закрыты")
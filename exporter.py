@@ -0,0 +1,102 @@
+"""Потоковая выгрузка истории операций пользователя (CSV, Parquet)
+
+История читается серверным курсором пачками по EXPORT_BATCH_SIZE строк и
+сразу пишется в файл, поэтому память не зависит от длины истории. CSV
+совместим с импортом выписок (importer.py).
+"""
+
+import io
+import csv
+import logging
+from contextlib import aclosing
+from typing import BinaryIO, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+CSV_HEADER = ("Дата операции", "Тип", "Сумма операции", "Валюта операции", "Категория", "Описание")
+
+
+async def write_csv(db_manager, telegram_id: int, out: BinaryIO) -> int:
+    """CSV (UTF-8 с BOM, ';') со знаковыми суммами: расходы отрицательные"""
+
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text, delimiter=";")
+    writer.writerow(CSV_HEADER)
+
+    count = 0
+    async with aclosing(db_manager.iter_user_transactions(telegram_id)) as batches:
+        async for batch in batches:
+            writer.writerows(
+                (
+                    f"{row['transaction_date']:%d.%m.%Y %H:%M:%S}",
+                    "Доход" if row['type'] == 'income' else "Расход",
+                    f"{row['amount'] if row['type'] == 'income' else -row['amount']:.2f}".replace(".", ","),
+                    row['currency'],
+                    row['category_or_source'],
+                    row['comment'] or ""
+                )
+                for row in batch
+            )
+            count += len(batch)
+
+    text.flush()
+    text.detach()
+    return count
+
+
+async def write_parquet(db_manager, telegram_id: int, out: BinaryIO) -> int:
+    """Parquet, одна группа строк на пачку курсора (нужен пакет pyarrow)"""
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Для выгрузки в Parquet установите пакет pyarrow: pip install pyarrow") from e
+
+    schema = pa.schema([
+        ("id", pa.string()),
+        ("transaction_date", pa.timestamp("us")),
+        ("type", pa.string()),
+        ("amount", pa.decimal128(12, 2)),
+        ("currency", pa.string()),
+        ("category_or_source", pa.string()),
+        ("comment", pa.string()),
+    ])
+
+    count = 0
+    writer = pq.ParquetWriter(out, schema)
+    try:
+        async with aclosing(db_manager.iter_user_transactions(telegram_id)) as batches:
+            async for batch in batches:
+                writer.write_table(pa.Table.from_pydict(
+                    {
+                        "id": [str(row['id']) for row in batch],
+                        "transaction_date": [row['transaction_date'] for row in batch],
+                        "type": [row['type'] for row in batch],
+                        "amount": [row['amount'] for row in batch],
+                        "currency": [row['currency'] for row in batch],
+                        "category_or_source": [row['category_or_source'] for row in batch],
+                        "comment": [row['comment'] for row in batch],
+                    },
+                    schema=schema
+                ))
+                count += len(batch)
+    finally:
+        writer.close()
+
+    return count
+
+
+# Формат -> функция записи
+EXPORT_FORMATS: Dict[str, Callable] = {
+    "csv": write_csv,
+    "parquet": write_parquet,
+}
+
+
+async def export_transactions(db_manager, telegram_id: int, export_format: str, out: BinaryIO) -> int:
+    """Запись всей истории пользователя в out; возвращает число операций"""
+
+    count = await EXPORT_FORMATS[export_format](db_manager, telegram_id, out)
+    logger.info(f"✅ Выгрузка {export_format} для {telegram_id}: {count} операций")
+    return count
@@ -0,0 +1,105 @@
+import os
+import asyncio
+import logging
+import contextvars
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from models import Transaction
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionBatcher:
+    """Группировка одновременных извлечений разных пользователей в один вызов модели
+
+    Первое сообщение открывает окно LLM_BATCH_WINDOW_MS; все, что пришло за
+    это время (до LLM_BATCH_MAX_MESSAGES штук), уходит в модель одним
+    запросом с пронумерованными сообщениями. Каждый вызывающий получает
+    операции только своего сообщения. Окно добавляет к задержке не больше
+    LLM_BATCH_WINDOW_MS, зато под нагрузкой вызовов модели в разы меньше.
+    Приоритет пакета в очереди к модели - лучший из приоритетов его сообщений.
+    """
+
+    def __init__(
+        self,
+        extract_batch: Callable[[List[str], float], Awaitable[List[List[Transaction]]]],
+        window: Optional[float] = None,
+        max_messages: Optional[int] = None
+    ):
+        self.extract_batch = extract_batch
+        self.window = window if window is not None else float(os.getenv("LLM_BATCH_WINDOW_MS", "0")) / 1000
+        self.max_messages = max_messages or int(os.getenv("LLM_BATCH_MAX_MESSAGES", "10"))
+
+        self._pending: List[Tuple[str, float, asyncio.Future]] = []
+        self._timer: Optional[asyncio.Task] = None
+        self._flushes: Set[asyncio.Task] = set()
+
+        self.calls = 0
+        self.messages = 0
+        self.transactions = 0
+
+    async def submit(self, user_text: str, priority: float = 0.0) -> List[Transaction]:
+        """Постановка сообщения в пакет; возвращает операции этого сообщения"""
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((user_text, priority, future))
+
+        if len(self._pending) >= self.max_messages:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+        return await future
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "messages": self.messages,
+            "transactions": self.transactions,
+            "avg_messages": self.messages / self.calls if self.calls else 0.0,
+            "transactions_per_call": self.transactions / self.calls if self.calls else 0.0,
+            "pending": len(self._pending)
+        }
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        self._flush_now()
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending[:self.max_messages], self._pending[self.max_messages:]
+        if self._pending:
+            self._timer = asyncio.create_task(self._flush_later())
+        if not batch:
+            return
+
+        # Вызов модели не должен отменяться вместе с обработчиком одного из пользователей;
+        # пустой контекст - этапы пакета не попадают в разбивку апдейта, открывшего окно
+        task = asyncio.create_task(self._flush(batch), context=contextvars.Context())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[Tuple[str, float, asyncio.Future]]):
+        try:
+            results = await self.extract_batch(
+                [user_text for user_text, _, _ in batch],
+                min(priority for _, priority, _ in batch)
+            )
+        except Exception as e:
+            # Таймаут или ошибка модели достается всем сообщениям пакета
+            logger.error(f"❌ Ошибка пакетного извлечения ({len(batch)} сообщений): {e!r}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.calls += 1
+        self.messages += len(batch)
+        self.transactions += sum(len(transactions) for transactions in results)
+        for (_, _, future), transactions in zip(batch, results):
+            if not future.done():
+                future.set_result(transactions)
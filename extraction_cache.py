@@ -0,0 +1,145 @@
+import os
+import re
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from models import Transaction
+from cache import MemoryCacheBackend
+from fast_parser import find_amounts, COMPLEX_DATE_RE
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION_RE = re.compile(r"[^\w#]+")
+
+# Допустимые отношения суммы модели к числу в тексте: как написано или в тысячах
+AMOUNT_SCALES = (1.0, 1000.0)
+
+
+class ExtractionCache:
+    """Кэш результатов извлечения транзакций по шаблону сообщения
+
+    Шаблон - текст в нижнем регистре без пунктуации, где сумма заменена на #:
+    "Кофе 150" и "кофе, 200!" дают один шаблон "кофе #". В кэше хранится все,
+    кроме суммы: тип, категория, валюта, комментарий, множитель суммы ("зп 50"
+    -> 50000) и сдвиг даты в днях ("вчера"). Кэшируются только сообщения с
+    одной суммой, которой модель и воспользовалась, и без дат, зависящих от чисел.
+
+    Записи живут EXTRACTION_CACHE_TTL секунд в LRU на EXTRACTION_CACHE_MAX_ENTRIES
+    шаблонов; с EXTRACTION_CACHE_PERSIST=true еще и в таблице extraction_cache,
+    чтобы переживать перезапуски и делиться между репликами.
+    """
+
+    def __init__(self, db_manager=None, max_entries: Optional[int] = None, ttl: Optional[float] = None,
+                 persist: Optional[bool] = None):
+        self.db_manager = db_manager
+        self.ttl = ttl if ttl is not None else float(os.getenv("EXTRACTION_CACHE_TTL", str(7 * 24 * 3600)))
+        self.memory = MemoryCacheBackend(
+            max_entries or int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "10000")), self.ttl
+        )
+        if persist is None:
+            persist = os.getenv("EXTRACTION_CACHE_PERSIST", "false").lower() == "true"
+        self.persist = persist and db_manager is not None
+
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.uncacheable = 0
+
+    @staticmethod
+    def template(user_text: str) -> Tuple[Optional[str], Optional[float]]:
+        """Шаблон сообщения и сумма в нем; (None, None) - если кэшировать нельзя"""
+
+        text = user_text.lower().replace("ё", "е")
+        amounts = find_amounts(text)
+        if len(amounts) != 1 or amounts[0][1] <= 0 or COMPLEX_DATE_RE.search(text):
+            return None, None
+
+        match, amount = amounts[0]
+        text = f"{text[:match.start()]} # {text[match.end():]}"
+        return " ".join(_PUNCTUATION_RE.sub(" ", text).split()), amount
+
+    async def get(self, user_text: str) -> Optional[Transaction]:
+        """Транзакция из кэша для сообщения или None"""
+
+        key, amount = self.template(user_text)
+        if key is None:
+            self.uncacheable += 1
+            return None
+
+        entry = await self.memory.get(key)
+        if entry is None and self.persist:
+            try:
+                entry = await self.db_manager.get_cached_extraction(key, self.ttl)
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения кэша извлечений: {e}")
+                entry = None
+            if entry is not None:
+                self.db_hits += 1
+                await self.memory.set(key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return Transaction(
+            type=entry["type"],
+            amount=round(amount * entry["scale"], 2),
+            currency=entry["currency"],
+            date=datetime.now() + timedelta(days=entry["date_offset"]),
+            category_or_source=entry["category_or_source"],
+            comment=entry["comment"]
+        )
+
+    async def put(self, user_text: str, transaction: Transaction):
+        """Сохранение результата модели для шаблона сообщения"""
+
+        key, amount = self.template(user_text)
+        if key is None:
+            return
+
+        entry = self._entry(transaction, amount)
+        if not any(abs(entry["scale"] - scale) < 1e-9 for scale in AMOUNT_SCALES):
+            # Модель посчитала сумму сама ("два кофе 150") - по шаблону не повторить
+            self.uncacheable += 1
+            return
+
+        await self.memory.set(key, entry)
+        self.stores += 1
+
+        if self.persist:
+            try:
+                await self.db_manager.save_cached_extraction(key, entry)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи кэша извлечений: {e}")
+
+    @staticmethod
+    def _entry(transaction: Transaction, amount: float) -> Dict[str, Any]:
+        # Комментарий с цифрами относится к конкретному сообщению
+        comment = transaction.comment
+        if comment and any(char.isdigit() for char in comment):
+            comment = None
+
+        transaction_date = transaction.date.replace(tzinfo=None)
+        return {
+            "type": transaction.type,
+            "currency": transaction.currency,
+            "category_or_source": transaction.category_or_source,
+            "comment": comment,
+            "scale": transaction.amount / amount,
+            "date_offset": (transaction_date.date() - datetime.now().date()).days
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "uncacheable": self.uncacheable,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            **self.memory.stats()
+        }
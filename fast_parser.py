@@ -0,0 +1,256 @@
+import os
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from models import Transaction, MAX_AMOUNT
+
+# Глаголы, однозначно задающие тип операции
+EXPENSE_VERBS = ("потратил", "заплатил", "купил", "оплатил", "отдал", "потрачено", "списали")
+INCOME_VERBS = ("получил", "заработал", "пришла", "пришло", "пришли", "поступил", "начислили", "вернули")
+
+# Основы слов -> категория расходов
+EXPENSE_LEXICON = {
+    "Продукты": ("продукт", "магазин", "супермаркет", "пятерочк", "перекрест", "овощ", "фрукт", "хлеб", "молок"),
+    "Транспорт": ("такси", "метро", "автобус", "трамва", "электричк", "проезд", "каршеринг", "самокат"),
+    "Жилье": ("аренд", "квартплат", "коммунал", "жкх", "ипотек", "квартир"),
+    "Развлечения": ("кино", "концерт", "театр", "игр", "подписк", "боулинг"),
+    "Здоровье": ("аптек", "лекарств", "врач", "стоматолог", "анализ", "таблетк", "клиник"),
+    "Образование": ("курс", "книг", "учеб", "репетитор", "обучени"),
+    "Одежда": ("одежд", "обув", "куртк", "кроссовк", "джинс", "футболк"),
+    "Связь": ("интернет", "телефон", "мобильн", "связь", "сотов"),
+    "Красота": ("стрижк", "парикмахер", "маникюр", "косметик", "салон"),
+    "Путешествия": ("отел", "гостиниц", "авиабилет", "самолет", "поездк", "отпуск", "билет"),
+    "Подарки": ("подарок", "подарк", "цвет"),
+    "Кафе/Рестораны": ("кафе", "ресторан", "кофе", "обед", "ужин", "завтрак", "бар", "пицц", "доставк", "бургер"),
+    "Спорт": ("спортзал", "фитнес", "тренировк", "бассейн", "абонемент"),
+    "Автомобиль": ("бензин", "заправк", "топлив", "парковк", "автомойк", "шиномонтаж", "штраф"),
+    "Домашние животные": ("корм", "ветеринар", "кот", "собак"),
+    "Дети": ("детск", "садик", "игрушк", "школ"),
+}
+
+# Основы слов -> источник дохода
+INCOME_LEXICON = {
+    "Зарплата": ("зарплат", "зп", "аванс", "оклад", "премия", "премию"),
+    "Фриланс": ("фриланс", "заказчик", "проект"),
+    "Подработка": ("подработк", "халтур", "смен"),
+    "Инвестиции": ("инвестиц", "брокер", "вклад", "процент", "кэшбэк", "кешбэк"),
+    "Дивиденды": ("дивиденд",),
+    "Продажа": ("продал", "продаж", "авито"),
+    "Возврат долга": ("долг",),
+    "Подарок": ("подарили", "подарок"),
+}
+
+CURRENCY_LEXICON = {
+    "RUB": ("руб", "р", "₽", "rub"),
+    "USD": ("$", "usd", "доллар", "бакс"),
+    "EUR": ("€", "eur", "евро"),
+}
+
+DATE_OFFSETS = {"сегодня": 0, "вчера": 1, "позавчера": 2}
+
+# Даты, которые лучше разобрать моделью ("в понедельник", "15 марта", "неделю назад")
+COMPLEX_DATE_RE = re.compile(
+    r"\bво?\s+(понедельник|вторник|среду|четверг|пятницу|субботу|воскресенье)\b"
+    r"|\d+\s*(январ|феврал|март|апрел|ма[яй]|июн|июл|август|сентябр|октябр|ноябр|декабр)"
+    r"|\bназад\b|\bпрошл"
+)
+_AMOUNT_RE = re.compile(
+    r"(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)(?:[.,](\d{1,2}))?"
+    r"(?:(к|k)(?![а-яa-z])|\s*(тыс)[а-я]*\.?)?"
+)
+
+
+def find_amounts(text: str) -> List[Tuple[re.Match, float]]:
+    """Все суммы в тексте (в нижнем регистре) вместе с совпадениями регулярки"""
+
+    return [(match, FastTransactionParser._to_amount(match)) for match in _AMOUNT_RE.finditer(text)]
+
+
+def has_money_context(text: str) -> bool:
+    """Есть ли рядом с числом признак денег: валюта, "к"/"тыс" у суммы или слово из словарей
+
+    Отличает "кофе 150" и "500 руб" от "сообщение #5" и "встреча в 15".
+    """
+
+    words = re.findall(r"[a-zа-я]+", text)
+    if any(match.group(3) or match.group(4) for match in _AMOUNT_RE.finditer(text)):
+        return True
+    if FastTransactionParser._find_currency(text, words) is not None:
+        return True
+    return any(
+        word.startswith(stem)
+        for lexicon in (EXPENSE_LEXICON, INCOME_LEXICON) for stems in lexicon.values()
+        for word in words for stem in stems
+    )
+
+
+class FastTransactionParser:
+    """Детерминированный парсер типовых транзакций без обращения к LLM
+
+    Разбирает сумму, валюту, тип операции и категорию по словарям основ.
+    Если словари молчат, категорию (и тип, если нет глагола) может подсказать
+    classifier с categorize() - локальная модель из intent_classifier; ее
+    ответ принимается при отрыве от второй метки не меньше model_margin.
+    Без глагола и слов из словарей модель сначала должна признать операцией
+    сам текст без суммы (intent_margin), уверенность тогда - по отрывам.
+    Возвращает транзакцию только при достаточной уверенности - остальное
+    уходит в Trustcall экстрактор.
+    """
+
+    def __init__(self, min_confidence: Optional[float] = None, classifier=None,
+                 model_margin: Optional[float] = None):
+        if min_confidence is None:
+            min_confidence = float(os.getenv("FAST_PARSER_MIN_CONFIDENCE", "0.8"))
+        if model_margin is None:
+            model_margin = float(os.getenv("FAST_PARSER_MODEL_MARGIN", "0.4"))
+        self.min_confidence = min_confidence
+        self.classifier = classifier
+        self.model_margin = model_margin
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, user_text: str) -> Optional[Transaction]:
+        """Разбор сообщения; None - если уверенность ниже порога"""
+
+        transaction, confidence = self.parse_with_confidence(user_text)
+
+        if transaction is not None and confidence >= self.min_confidence:
+            self.hits += 1
+            return transaction
+
+        self.misses += 1
+        return None
+
+    def parse_with_confidence(self, user_text: str) -> Tuple[Optional[Transaction], float]:
+        """Разбор сообщения с оценкой уверенности от 0 до 1"""
+
+        text = user_text.lower().replace("ё", "е")
+        words = re.findall(r"[a-zа-я]+", text)
+
+        matches = find_amounts(text)
+        amounts = [amount for _, amount in matches]
+        if len(amounts) != 1 or amounts[0] <= 0:
+            # Нет суммы или несколько операций в одном сообщении
+            return None, 0.0
+
+        if amounts[0] >= MAX_AMOUNT:
+            # Не поместится в БД - пусть агент ответит понятной ошибкой
+            return None, 0.0
+
+        if COMPLEX_DATE_RE.search(text):
+            return None, 0.0
+
+        expense_verb = any(word.startswith(verb) for word in words for verb in EXPENSE_VERBS)
+        income_verb = any(word.startswith(verb) for word in words for verb in INCOME_VERBS)
+
+        if not (expense_verb or income_verb) and self._counted(text, matches[0][0]):
+            # "квартира 3 комнаты" - без глагола это скорее количество, чем сумма
+            return None, 0.0
+        expense_category = self._match(words, EXPENSE_LEXICON)
+        income_source = self._match(words, INCOME_LEXICON)
+
+        if expense_verb and not income_verb:
+            transaction_type, category, confidence = "expense", expense_category, 1.0
+        elif income_verb and not expense_verb:
+            transaction_type, category, confidence = "income", income_source, 1.0
+        elif income_source and not expense_category:
+            transaction_type, category, confidence = "income", income_source, 0.9
+        elif expense_category and not income_source:
+            # "Кофе 150", "Такси 450" - расход без глагола
+            transaction_type, category, confidence = "expense", expense_category, 0.85
+        elif self.classifier is not None and not expense_category and not income_source:
+            # Ни глагола, ни слова из словарей ("шаверма 280") - тип и категория от модели.
+            # Число само по себе тянет к transaction, поэтому намерение оцениваем по
+            # словам без суммы: "сообщение #5", "квартира 3 комнаты" уходят в LLM
+            intent, intent_margin = self.classifier.intent_margin(_AMOUNT_RE.sub(" ", text))
+            if intent != "transaction":
+                return None, 0.0
+            transaction_type, category, confidence = None, None, min(1.0, intent_margin)
+        else:
+            return None, 0.0
+
+        if category is None and self.classifier is not None:
+            transaction_type, category, margin = self.classifier.categorize(text, transaction_type)
+            if margin < self.model_margin:
+                return None, 0.0
+            if not (expense_verb or income_verb):
+                # Отрывы в единицах оценок модели; у категорий меток больше и
+                # отрыв вдвое меньше, чем у намерений при той же надежности
+                confidence = min(confidence, 2 * margin)
+
+        if category is None:
+            return None, 0.0
+
+        date = datetime.now()
+        for word, offset in DATE_OFFSETS.items():
+            if word in words:
+                date -= timedelta(days=offset)
+
+        transaction = Transaction(
+            type=transaction_type,
+            amount=amounts[0],
+            currency=self._currency(text, words),
+            date=date,
+            category_or_source=category
+        )
+        return transaction, confidence
+
+    def categorize(self, text: str, transaction_type: str) -> Optional[str]:
+        """Категория расхода или источник дохода по словарям основ (None - если неоднозначно)"""
+
+        words = re.findall(r"[a-zа-я]+", text.lower().replace("ё", "е"))
+        return self._match(words, EXPENSE_LEXICON if transaction_type == "expense" else INCOME_LEXICON)
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    @staticmethod
+    def _to_amount(match: re.Match) -> float:
+        integer, fraction, short_thousands, thousands = match.groups()
+        amount = float(re.sub(r"\s", "", integer) + ("." + fraction if fraction else ""))
+        if short_thousands or thousands:
+            amount *= 1000
+        return amount
+
+    @staticmethod
+    def _match(words, lexicon: dict) -> Optional[str]:
+        found = {
+            category for category, stems in lexicon.items()
+            for word in words for stem in stems
+            if word.startswith(stem) and (len(stem) > 3 or word == stem or len(word) - len(stem) <= 3)
+        }
+        # Несколько подходящих категорий - пусть решает модель
+        return found.pop() if len(found) == 1 else None
+
+    @staticmethod
+    def _counted(text: str, match: re.Match) -> bool:
+        """Небольшое целое перед словом ("3 комнаты", "в 15 часов") - количество, а не сумма"""
+
+        if FastTransactionParser._to_amount(match) >= 100 or match.group(2):
+            return False
+        following = re.match(r"\s*([a-zа-я]+)", text[match.end():])
+        if following is None or following.group(1) in ("на", "за"):
+            return False
+        return FastTransactionParser._find_currency(following.group(1), [following.group(1)]) is None
+
+    @staticmethod
+    def _currency(text: str, words) -> str:
+        return FastTransactionParser._find_currency(text, words) or "RUB"
+
+    @staticmethod
+    def _find_currency(text: str, words) -> Optional[str]:
+        for currency, markers in CURRENCY_LEXICON.items():
+            for marker in markers:
+                if marker.isalpha():
+                    if any(word == marker or (len(marker) > 2 and word.startswith(marker)) for word in words):
+                        return currency
+                elif marker in text:
+                    return currency
+        return None
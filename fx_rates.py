@@ -0,0 +1,124 @@
+import os
+import csv
+import logging
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+import numpy as np
+
+from analytics import to_day
+
+logger = logging.getLogger(__name__)
+
+# Валюта учета: в ней хранятся агрегаты и выводятся балансы и отчеты
+BASE_CURRENCY = "RUB"
+RATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fx_rates.csv")
+
+
+def read_rates(path: str = RATES_PATH) -> List[Tuple[str, date, float]]:
+    """Курсы из CSV "date,currency,rate": сколько рублей стоит единица валюты на дату"""
+
+    rows = []
+    with open(path, encoding="utf-8", newline="") as source:
+        for line in csv.reader(row for row in source if row.strip() and not row.startswith("#")):
+            if line[0] == "date":
+                continue
+            day, currency, rate = (value.strip() for value in line[:3])
+            rows.append((currency.upper(), datetime.strptime(day, "%Y-%m-%d").date(), float(rate.replace(",", "."))))
+    return rows
+
+
+class FxRates:
+    """Курсы валют к рублю по дням в памяти
+
+    Для каждой валюты - отсортированные массивы NumPy дней и курсов. Курс на
+    дату - последний известный на эту дату, до первого известного - самый
+    ранний (так же считает SQL-функция fx_rate). Валюта без курсов
+    пересчитывается как 1:1 с предупреждением в журнале.
+
+    Пересчет пакета векторный: один searchsorted на каждую валюту пакета,
+    строки в рублях не трогаются вовсе.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, date, float]] = ()):
+        self._days: Dict[str, np.ndarray] = {}
+        self._rates: Dict[str, np.ndarray] = {}
+        self._unknown: Set[str] = set()
+        self.load(rows)
+
+    def load(self, rows: Iterable[Tuple[str, date, float]]):
+        """Замена всех курсов: (валюта, дата, курс)"""
+
+        points: Dict[str, List[Tuple[int, float]]] = {}
+        for currency, day, rate in rows:
+            points.setdefault(currency.upper(), []).append((to_day(day), float(rate)))
+
+        days, rates = {}, {}
+        for currency, values in points.items():
+            values.sort()
+            days[currency] = np.array([day for day, _ in values], dtype=np.int32)
+            rates[currency] = np.array([rate for _, rate in values], dtype=np.float64)
+        # Подмена целиком: параллельный пересчет видит либо старые, либо новые курсы
+        self._days, self._rates = days, rates
+        self._unknown = set()
+
+    @property
+    def currencies(self) -> List[str]:
+        return sorted(self._days)
+
+    def __len__(self) -> int:
+        return sum(len(days) for days in self._days.values())
+
+    def rates(self, currency: str, days: np.ndarray) -> np.ndarray:
+        """Курсы валюты на номера дней от 1970-01-01"""
+
+        days = np.asarray(days)
+        known = self._days.get(currency)
+        if currency == BASE_CURRENCY or known is None:
+            if currency != BASE_CURRENCY and currency not in self._unknown:
+                self._unknown.add(currency)
+                logger.warning(f"⚠️ Нет курса {currency}, суммы в этой валюте считаются как {BASE_CURRENCY}")
+            return np.ones(len(days), dtype=np.float64)
+        index = np.searchsorted(known, days, side="right") - 1
+        return self._rates[currency][np.maximum(index, 0)]
+
+    def rate(self, currency: str, day) -> float:
+        return float(self.rates(currency, [to_day(day)])[0])
+
+    def to_base(self, amount: float, currency: str, day) -> float:
+        """Сумма одной операции в рублях"""
+        if currency == BASE_CURRENCY:
+            return float(amount)
+        return round(float(amount) * self.rate(currency, day), 2)
+
+    def convert(self, amounts, currencies, days) -> np.ndarray:
+        """Суммы в рублях: массивы сумм, валют и номеров дней одной длины"""
+
+        amounts = np.asarray(amounts, dtype=np.float64)
+        currencies = np.asarray(currencies, dtype=object)
+        foreign = currencies != BASE_CURRENCY
+        if not foreign.any():
+            return amounts
+
+        days = np.asarray(days)
+        result = amounts.copy()
+        for currency in set(currencies[foreign]):
+            mask = currencies == currency
+            result[mask] = np.round(amounts[mask] * self.rates(currency, days[mask]), 2)
+        return result
+
+    def convert_records(self, records: Sequence[Sequence]) -> np.ndarray:
+        """Суммы в рублях для строк формата TRANSACTION_COLUMNS
+
+        Даты разбираются только у строк в иностранной валюте.
+        """
+
+        amounts = np.fromiter((record[3] for record in records), dtype=np.float64, count=len(records))
+        currencies = np.array([record[4] for record in records], dtype=object)
+        foreign = np.flatnonzero(currencies != BASE_CURRENCY)
+        if not len(foreign):
+            return amounts
+
+        days = np.zeros(len(records), dtype=np.int32)
+        days[foreign] = [to_day(records[index][7]) for index in foreign]
+        return self.convert(amounts, currencies, days)
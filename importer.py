@@ -0,0 +1,349 @@
+"""Потоковый импорт банковских выписок (CSV и OFX)
+
+Файл читается построчно цепочкой генераторов: строки -> записи выписки ->
+Transaction -> пакеты по IMPORT_CHUNK_SIZE. Каждый пакет загружается в БД
+через COPY, поэтому в памяти держится только текущий пакет и счетчики
+повторов одинаковых строк.
+
+Повторный импорт той же выписки не создает дублей: id транзакции - это
+детерминированный UUID от пользователя и содержимого строки (или FITID в OFX).
+"""
+
+import io
+import os
+import re
+import csv
+import uuid
+import codecs
+import logging
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from models import Transaction, EXPENSE_CATEGORIES, INCOME_SOURCES, MAX_AMOUNT
+from fast_parser import FastTransactionParser
+
+logger = logging.getLogger(__name__)
+
+# Пространство имен для детерминированных id импортированных транзакций
+IMPORT_NAMESPACE = uuid.UUID("5b0e6c2e-8a47-4d0c-9a55-3f1b2f7e9d41")
+
+# Заголовки колонок в выгрузках банков (в нижнем регистре)
+COLUMN_ALIASES = {
+    "date": ("дата операции", "дата", "date", "transaction date", "дата платежа", "дата транзакции"),
+    "amount": ("сумма операции", "сумма", "amount", "сумма платежа", "сумма в валюте счета"),
+    "income": ("приход", "поступление", "зачисление", "credit"),
+    "expense": ("расход", "списание", "debit"),
+    "currency": ("валюта операции", "валюта", "currency"),
+    "category": ("категория", "category", "mcc категория"),
+    "description": ("описание", "description", "назначение платежа", "комментарий", "memo", "контрагент"),
+    "status": ("статус", "status"),
+}
+
+# Неуспешные операции в выписке не импортируются
+SKIPPED_STATUSES = ("failed", "declined", "отклонено", "отменено", "отказ")
+
+# Допустимые даты операций: строки с датами вне диапазона ("0001-01-01",
+# "31.12.9999") пропускаются - иначе под них создавались бы партиции
+MIN_STATEMENT_DATE = datetime(2000, 1, 1)
+MAX_STATEMENT_DAYS_AHEAD = 31
+
+# Категории банков -> наши категории и источники (в нижнем регистре)
+BANK_CATEGORY_MAP = {
+    "expense": {
+        "супермаркеты": "Продукты", "продукты питания": "Продукты",
+        "рестораны": "Кафе/Рестораны", "фастфуд": "Кафе/Рестораны", "кафе": "Кафе/Рестораны",
+        "такси": "Транспорт", "местный транспорт": "Транспорт", "каршеринг": "Транспорт",
+        "аптеки": "Здоровье", "медицина": "Здоровье", "медицинские услуги": "Здоровье",
+        "мобильная связь": "Связь", "интернет": "Связь", "связь, телеком": "Связь",
+        "одежда и обувь": "Одежда", "одежда, обувь": "Одежда",
+        "кино": "Развлечения", "развлечения": "Развлечения", "музыка": "Развлечения",
+        "красота": "Красота", "салоны красоты": "Красота",
+        "авиабилеты": "Путешествия", "отели": "Путешествия", "ж/д билеты": "Путешествия",
+        "турагентства": "Путешествия",
+        "книги": "Образование", "образование": "Образование",
+        "спорттовары": "Спорт", "фитнес": "Спорт",
+        "топливо": "Автомобиль", "азс": "Автомобиль", "автоуслуги": "Автомобиль",
+        "животные": "Домашние животные", "зоотовары": "Домашние животные",
+        "цветы": "Подарки", "сувениры": "Подарки",
+        "жкх": "Жилье", "коммунальные услуги": "Жилье", "дом, ремонт": "Жилье", "дом и ремонт": "Жилье",
+        "детские товары": "Дети",
+    },
+    "income": {
+        "зарплата": "Зарплата", "заработная плата": "Зарплата",
+        "проценты": "Инвестиции", "проценты на остаток": "Инвестиции", "кэшбэк": "Инвестиции",
+        "брокерский счет": "Инвестиции", "дивиденды": "Дивиденды",
+    },
+}
+
+_DATE_FORMATS = (
+    "%d.%m.%y", "%d.%m.%y %H:%M", "%d/%m/%Y", "%m/%d/%Y", "%Y-%m-%dT%H:%M:%S.%f",
+)
+_DATE_RE = re.compile(
+    r"(?:(?P<day>\d{2})\.(?P<month>\d{2})\.(?P<year>\d{4})|(?P<iso_year>\d{4})-(?P<iso_month>\d{2})-(?P<iso_day>\d{2}))"
+    r"(?:[ T](?P<hour>\d{2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?)?$"
+)
+_AMOUNT_JUNK_RE = re.compile(r"[\s ₽$€]|rub|rur|руб\.?", re.IGNORECASE)
+_OFX_FIELD_RE = re.compile(r"<(\w+)>([^<\r\n]*)")
+_OFX_CURRENCY_RE = re.compile(r"<CURDEF>\s*([A-Za-z]{3})")
+
+
+def open_statement(raw: BinaryIO, sample_size: int = 65536) -> TextIO:
+    """Текстовый поток поверх бинарного файла: UTF-8 (с BOM или без) или cp1251"""
+
+    sample = raw.read(sample_size)
+    raw.seek(0)
+
+    encoding = "utf-8-sig"
+    try:
+        # Инкрементальный декодер не спотыкается о символ, разрезанный границей выборки
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        encoding = "cp1251"
+
+    return io.TextIOWrapper(raw, encoding=encoding, errors="replace", newline="")
+
+
+def read_csv(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """Записи CSV-выписки со стандартными ключами (date, amount, description, ...)"""
+
+    lines = iter(lines)
+    header_line = next(lines, None)
+    if header_line is None:
+        return
+
+    delimiter = max((";", ",", "\t"), key=header_line.count)
+    reader = csv.reader(chain([header_line], lines), delimiter=delimiter)
+    header = [column.strip().strip('"').lower() for column in next(reader)]
+
+    columns = {}
+    for key, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in header:
+                columns[key] = header.index(alias)
+                break
+
+    if "date" not in columns or not ("amount" in columns or "income" in columns or "expense" in columns):
+        raise ValueError("Не найдены колонки с датой и суммой операции")
+
+    for values in reader:
+        if not values:
+            continue
+        yield {key: values[index] if index < len(values) else "" for key, index in columns.items()}
+
+
+def read_ofx(chunks: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """Записи OFX-выписки (SGML 1.x и XML 2.x) по блокам <STMTTRN>
+
+    chunks - строки или блоки текста произвольной длины.
+    """
+
+    buffer = ""
+    currency = ""
+
+    for chunk in chunks:
+        buffer += chunk
+
+        if not currency:
+            match = _OFX_CURRENCY_RE.search(buffer)
+            if match:
+                currency = match.group(1).upper()
+
+        while True:
+            start = buffer.find("<STMTTRN>")
+            end = buffer.find("</STMTTRN>", start)
+            if start < 0 or end < 0:
+                break
+
+            fields = dict(_OFX_FIELD_RE.findall(buffer[start + len("<STMTTRN>"):end]))
+            buffer = buffer[end + len("</STMTTRN>"):]
+
+            yield {
+                "date": fields.get("DTPOSTED", "").strip(),
+                "amount": fields.get("TRNAMT", "").strip(),
+                "currency": fields.get("CURRENCY", "").strip() or currency,
+                "description": " ".join(
+                    value.strip() for value in (fields.get("NAME", ""), fields.get("MEMO", "")) if value.strip()
+                ),
+                "fitid": fields.get("FITID", "").strip(),
+            }
+
+        # Вне блоков транзакций хранить нечего - держим только незакрытый хвост
+        if "<STMTTRN>" not in buffer and len(buffer) > 4096:
+            buffer = buffer[-16:]
+
+
+class StatementImporter:
+    """Преобразование записей выписки в Transaction и загрузка пакетами"""
+
+    def __init__(self, db_manager, chunk_size: Optional[int] = None):
+        self.db_manager = db_manager
+        self.chunk_size = chunk_size or int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+        self.categorizer = FastTransactionParser()
+
+        # Категория банка или наше название (в нижнем регистре) -> наша категория
+        self._categories = {
+            "expense": {**BANK_CATEGORY_MAP["expense"], **{name.lower(): name for name in EXPENSE_CATEGORIES}},
+            "income": {**BANK_CATEGORY_MAP["income"], **{name.lower(): name for name in INCOME_SOURCES}},
+        }
+        # Категории по описанию: у одного продавца описания повторяются
+        self._guessed: Dict[tuple, str] = {}
+
+    async def import_file(self, telegram_id: int, raw: BinaryIO, filename: str) -> Dict[str, int]:
+        """Импорт файла выписки; возвращает счетчики rows, imported, duplicates, skipped"""
+
+        stream = open_statement(raw)
+        try:
+            if filename.lower().endswith((".ofx", ".qfx")):
+                # OFX 2.x бывает одной строкой - читаем блоками фиксированного размера
+                entries = read_ofx(iter(lambda: stream.read(65536), ""))
+            else:
+                entries = read_csv(stream)
+            stats = {"rows": 0, "imported": 0, "duplicates": 0, "skipped": 0}
+
+            for chunk in chunked(self.transactions(telegram_id, entries, stats), self.chunk_size):
+                imported = await self.db_manager.import_transactions(telegram_id, chunk)
+                stats["imported"] += imported
+                stats["duplicates"] += len(chunk) - imported
+
+            logger.info(f"✅ Импорт выписки {filename} для {telegram_id}: {stats}")
+            return stats
+        finally:
+            # Файл закрывает вызывающий
+            stream.detach()
+
+    def transactions(self, telegram_id: int, entries: Iterable[Dict[str, str]], stats: Dict[str, int]) -> Iterator[Dict]:
+        """Транзакции в формате save_transactions_batch/import_transactions"""
+
+        occurrences = {}
+
+        for entry in entries:
+            stats["rows"] += 1
+            try:
+                transaction = self.to_transaction(entry)
+            except (ValueError, TypeError):
+                transaction = None
+
+            if transaction is None:
+                stats["skipped"] += 1
+                continue
+
+            # Одинаковые строки (два кофе по 150 в один день) - разные операции:
+            # номер повтора входит в ключ. Счетчики ведутся по всему файлу, а не
+            # по текущему дню: выписка не обязана быть отсортирована по дате
+            key = entry.get("fitid") or "|".join((
+                transaction.date.isoformat(), transaction.type, f"{transaction.amount:.2f}",
+                transaction.currency, transaction.comment or ""
+            ))
+            occurrences[key] = occurrences.get(key, 0) + 1
+            transaction.id = str(uuid.uuid5(IMPORT_NAMESPACE, f"{telegram_id}|{key}|{occurrences[key]}"))
+
+            yield transaction.to_dict()
+
+    def to_transaction(self, entry: Dict[str, str]) -> Optional[Transaction]:
+        """Transaction из записи выписки; None - если строку импортировать не нужно"""
+
+        if entry.get("status", "").strip().lower() in SKIPPED_STATUSES:
+            return None
+
+        if entry.get("amount", "").strip():
+            amount = self._amount(entry["amount"])
+        else:
+            # Раздельные колонки прихода и расхода
+            amount = self._amount(entry.get("income") or "0") - abs(self._amount(entry.get("expense") or "0"))
+
+        if amount == 0 or abs(amount) >= MAX_AMOUNT:
+            return None
+
+        transaction_date = self._date(entry["date"])
+        if not MIN_STATEMENT_DATE <= transaction_date <= datetime.now() + timedelta(days=MAX_STATEMENT_DAYS_AHEAD):
+            return None
+
+        transaction_type = "income" if amount > 0 else "expense"
+        description = entry.get("description", "").strip() or None
+
+        return Transaction(
+            type=transaction_type,
+            amount=abs(amount),
+            currency=self._currency(entry.get("currency", "")),
+            date=transaction_date,
+            category_or_source=self._category(transaction_type, entry.get("category", ""), description),
+            comment=description
+        )
+
+    def _category(self, transaction_type: str, bank_category: str, description: Optional[str]) -> str:
+        bank_category = bank_category.strip()
+
+        mapped = self._categories[transaction_type].get(bank_category.lower())
+        if mapped:
+            return mapped
+
+        key = (transaction_type, bank_category, description)
+        category = self._guessed.get(key)
+        if category is None:
+            text = f"{bank_category} {description or ''}"
+            category = self.categorizer.categorize(text, transaction_type) or "Другое"
+            if len(self._guessed) >= 10_000:
+                self._guessed.clear()
+            self._guessed[key] = category
+        return category
+
+    @staticmethod
+    def _amount(value: str) -> float:
+        value = _AMOUNT_JUNK_RE.sub("", value).replace("−", "-")
+        if "," in value and "." in value:
+            # Десятичный разделитель - последний: 1,234.56 и 1.234,56
+            thousands = "," if value.rfind(",") < value.rfind(".") else "."
+            value = value.replace(thousands, "")
+        elif value.count(".") > 1:
+            value = value.replace(".", "")
+        elif value.count(",") > 1:
+            value = value.replace(",", "")
+        return float(value.replace(",", "."))
+
+    @staticmethod
+    def _currency(value: str) -> str:
+        value = value.strip().upper()
+        if value in ("", "RUR", "₽", "РУБ"):
+            return "RUB"
+        return value[:3]
+
+    @staticmethod
+    def _date(value: str) -> datetime:
+        value = value.strip()
+
+        # OFX: 20240115120000.000[+3:MSK]
+        if value[:8].isdigit():
+            digits = re.match(r"\d+", value).group()
+            return datetime.strptime(digits[:14], "%Y%m%d%H%M%S" if len(digits) >= 14 else "%Y%m%d")
+
+        # Основные форматы разбираем регуляркой - strptime на сотнях тысяч строк заметно медленнее
+        match = _DATE_RE.match(value)
+        if match:
+            parts = match.groupdict()
+            return datetime(
+                int(parts["year"] or parts["iso_year"]),
+                int(parts["month"] or parts["iso_month"]),
+                int(parts["day"] or parts["iso_day"]),
+                int(parts["hour"] or 0),
+                int(parts["minute"] or 0),
+                int(parts["second"] or 0)
+            )
+
+        for date_format in _DATE_FORMATS:
+            try:
+                return datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+        raise ValueError(f"Неизвестный формат даты: {value}")
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """Разбиение потока на списки по size элементов"""
+
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,298 @@
+import os
+import re
+import time
+import zlib
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fast_parser import find_amounts, has_money_context
+
+logger = logging.getLogger(__name__)
+
+INTENTS = ("transaction", "balance_check", "report_request", "general")
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intents.tsv")
+
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+_TOKEN_RE = re.compile(r"[a-zа-я0]+|[?+]")
+
+
+def load_corpus(path: str = CORPUS_PATH) -> List[Tuple[str, str, str]]:
+    """Размеченный корпус: (текст, намерение, "тип:категория" или "")"""
+
+    rows = []
+    with open(path, encoding="utf-8") as corpus:
+        for line in corpus:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            text, intent, category = (line.split("\t") + [""])[:3]
+            rows.append((text, intent, category))
+    return rows
+
+
+class HashingVectorizer:
+    """Признаки сообщения: слова и n-граммы символов внутри слов, захешированные в 2**bits корзин
+
+    Числа сводятся к "0" (важен факт суммы, а не ее значение), "?" и "+" -
+    отдельные токены. Признаки сообщения - сумма признаков его токенов плюс
+    смещение, вес признака - 1/sqrt(их числа). Сумма по токенам позволяет
+    классификатору считать вклад каждого слова один раз и кэшировать его.
+    """
+
+    def __init__(self, bits: int = 14, ngram_range: Tuple[int, int] = (1, 4)):
+        self.dim = 1 << bits
+        self.ngram_range = ngram_range
+        self._mask = self.dim - 1
+        self.bias = self._bucket("<bias>")
+
+    def _bucket(self, feature: str) -> int:
+        # crc32, а не hash(): корзины не должны зависеть от PYTHONHASHSEED
+        return zlib.crc32(feature.encode("utf-8")) & self._mask
+
+    @staticmethod
+    def tokens(text: str) -> List[str]:
+        return _TOKEN_RE.findall(_NUMBER_RE.sub("0", text.lower().replace("ё", "е")))
+
+    def token_features(self, token: str) -> List[int]:
+        """Корзины признаков одного токена: слово целиком и его n-граммы с границами"""
+
+        padded = f" {token} "
+        low, high = self.ngram_range
+        features = {"w:" + token}
+        for n in range(low, high + 1):
+            features.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return [self._bucket(feature) for feature in features]
+
+    def transform(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Разреженная матрица пакета: индексы корзин, веса и начало строки каждого сообщения"""
+
+        rows = []
+        for text in texts:
+            row = [self.bias]
+            for token in self.tokens(text):
+                row.extend(self.token_features(token))
+            rows.append(row)
+
+        lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        starts = np.zeros(len(rows), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        indices = np.fromiter((bucket for row in rows for bucket in row), dtype=np.int64, count=int(lengths.sum()))
+        weights = np.repeat(1.0 / np.sqrt(lengths), lengths)
+        return indices, weights, starts
+
+
+class IntentClassifier:
+    """Намерение и категория сообщения: линейная модель поверх HashingVectorizer
+
+    Две головы: намерение (INTENTS) и "тип:категория" для операций. Обучение -
+    гребневая регрессия one-vs-rest в двойственной форме (решение системы
+    N x N по числу примеров), на корпусе в сотни строк это доли секунды
+    при старте.
+
+    Модель линейна, поэтому вклад токена во все оценки - сумма строк весов
+    по его корзинам - считается один раз и хранится в таблице (до
+    tokens_limit токенов). Оценка сообщения - сумма строк таблицы по его
+    токенам, для пакета - один np.add.reduceat. Переполненная таблица
+    сбрасывается до разбора сообщения или пакета: собранные номера строк
+    должны указывать в ту же таблицу, из которой берутся оценки.
+    """
+
+    def __init__(self, vectorizer: HashingVectorizer, intent_weights: np.ndarray, intent_labels: Sequence[str],
+                 category_weights: np.ndarray, category_labels: Sequence[str], tokens_limit: int = 100_000):
+        self.vectorizer = vectorizer
+        self.intent_labels = list(intent_labels)
+        self.category_labels = list(category_labels)
+        self.tokens_limit = tokens_limit
+
+        # Колонки: оценки намерений, оценки категорий, число признаков
+        self._weights = np.hstack([intent_weights, category_weights]).astype(np.float32)
+        self._intents = slice(0, len(self.intent_labels))
+        self._category_columns = {
+            transaction_type: np.array([
+                len(self.intent_labels) + index for index, label in enumerate(self.category_labels)
+                if label.startswith(transaction_type + ":")
+            ], dtype=np.int64)
+            for transaction_type in ("expense", "income")
+        }
+        self._reset_tokens()
+
+    def _reset_tokens(self):
+        self._rows: Dict[str, int] = {}
+        self._table = np.zeros((1024, self._weights.shape[1] + 1), dtype=np.float32)
+        self._table[0, :-1] = self._weights[self.vectorizer.bias]
+        self._table[0, -1] = 1
+
+    def _row(self, token: str) -> int:
+        row = self._rows.get(token)
+        if row is None:
+            row = len(self._rows) + 1
+            if row >= len(self._table):
+                self._table = np.vstack([self._table, np.zeros_like(self._table)])
+            features = self.vectorizer.token_features(token)
+            self._table[row, :-1] = self._weights[features].sum(axis=0)
+            self._table[row, -1] = len(features)
+            self._rows[token] = row
+        return row
+
+    def _batch_rows(self, texts: Sequence[str]) -> List[List[int]]:
+        """Строки таблицы для токенов каждого сообщения пакета (первая - смещение)"""
+
+        tokenized = [self.vectorizer.tokens(text) for text in texts]
+        rows = self._rows
+        # Новые токены считаем, только если таблица может переполниться
+        if len(rows) + sum(map(len, tokenized)) > self.tokens_limit:
+            new = {token for tokens in tokenized for token in tokens if token not in rows}
+            if len(rows) + len(new) > self.tokens_limit:
+                self._reset_tokens()
+                rows = self._rows
+        return [[0] + [rows.get(token) or self._row(token) for token in tokens] for tokens in tokenized]
+
+    def _token_rows(self, text: str) -> List[int]:
+        return self._batch_rows((text,))[0]
+
+    @classmethod
+    def train(cls, rows: Iterable[Tuple[str, str, str]], bits: int = 14,
+              ngram_range: Tuple[int, int] = (1, 4), alpha: float = 0.3) -> "IntentClassifier":
+        """Обучение на (текст, намерение, "тип:категория") из load_corpus()"""
+
+        rows = list(rows)
+        vectorizer = HashingVectorizer(bits, ngram_range)
+        texts = [text for text, _, _ in rows]
+        intent_weights = cls._fit(vectorizer, texts, [intent for _, intent, _ in rows], INTENTS, alpha)
+
+        categorized = [(text, category) for text, _, category in rows if category]
+        category_labels = sorted({category for _, category in categorized})
+        category_weights = cls._fit(
+            vectorizer, [text for text, _ in categorized], [category for _, category in categorized],
+            category_labels, alpha
+        )
+        return cls(vectorizer, intent_weights, INTENTS, category_weights, category_labels)
+
+    @staticmethod
+    def _fit(vectorizer: HashingVectorizer, texts: Sequence[str], labels: Sequence[str],
+             classes: Sequence[str], alpha: float) -> np.ndarray:
+        indices, weights, starts = vectorizer.transform(texts)
+
+        # Плотная матрица только по встреченным корзинам: N x U вместо N x 2**bits
+        used, columns = np.unique(indices, return_inverse=True)
+        lengths = np.diff(np.append(starts, len(indices)))
+        cells = np.repeat(np.arange(len(texts)), lengths) * len(used) + columns
+        matrix = np.bincount(cells, weights, minlength=len(texts) * len(used)).reshape(len(texts), len(used))
+
+        positions = {label: index for index, label in enumerate(classes)}
+        targets = np.full((len(texts), len(classes)), -1.0)
+        targets[np.arange(len(texts)), [positions[label] for label in labels]] = 1.0
+
+        # W = X^T (X X^T + alpha I)^-1 Y
+        gram = matrix @ matrix.T
+        gram[np.diag_indices_from(gram)] += alpha
+        coefficients = np.linalg.solve(gram, targets)
+
+        result = np.zeros((vectorizer.dim, len(classes)))
+        result[used] = matrix.T @ coefficients
+        return result
+
+    def scores(self, texts: Sequence[str]) -> np.ndarray:
+        """Оценки пакета: строка на сообщение, колонки намерений и категорий"""
+
+        rows = self._batch_rows(texts)
+        lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        starts = np.zeros(len(rows), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        indices = np.fromiter((row for message in rows for row in message), dtype=np.int64, count=int(lengths.sum()))
+
+        sums = np.add.reduceat(self._table[indices], starts, axis=0)
+        return sums[:, :-1] / np.sqrt(sums[:, -1:])
+
+    def predict(self, texts: Sequence[str]) -> List[str]:
+        """Намерения пакета сообщений"""
+        if not texts:
+            return []
+        best = self.scores(texts)[:, self._intents].argmax(axis=1)
+        return [self.intent_labels[index] for index in best]
+
+    def predict_one(self, text: str) -> str:
+        # Сначала строки: _token_rows может сбросить или расширить таблицу
+        rows = self._token_rows(text)
+        scores = self._table[rows, self._intents].sum(axis=0)
+        return self.intent_labels[int(scores.argmax())]
+
+    def intent_margin(self, text: str) -> Tuple[str, float]:
+        """Намерение сообщения и отрыв его оценки от второй по счету"""
+
+        rows = self._token_rows(text)
+        sums = self._table[rows].sum(axis=0)
+        scores = sums[self._intents] / np.sqrt(sums[-1])
+        order = np.argsort(scores)[::-1]
+        return self.intent_labels[order[0]], float(scores[order[0]] - scores[order[1]])
+
+    def categorize(self, text: str, transaction_type: Optional[str] = None) -> Tuple[Optional[str], Optional[str], float]:
+        """Тип операции, категория и отрыв от второй по счету метки
+
+        transaction_type ограничивает выбор категориями этого типа; без него
+        тип выбирается вместе с категорией.
+        """
+
+        if transaction_type is None:
+            columns = np.concatenate(list(self._category_columns.values()))
+        else:
+            columns = self._category_columns.get(transaction_type)
+        if columns is None or not len(columns):
+            return None, None, 0.0
+
+        rows = self._token_rows(text)
+        sums = self._table[rows].sum(axis=0)
+        scores = sums[columns] / np.sqrt(sums[-1])
+        order = np.argsort(scores)[::-1]
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else float(scores[order[0]])
+        label = self.category_labels[columns[order[0]] - len(self.intent_labels)]
+        transaction_type, category = label.split(":", 1)
+        return transaction_type, category, margin
+
+
+class KeywordClassifier:
+    """Прежняя классификация по спискам ключевых слов (INTENT_CLASSIFIER=keywords)"""
+
+    def predict(self, texts: Sequence[str]) -> List[str]:
+        return [self.predict_one(text) for text in texts]
+
+    @staticmethod
+    def predict_one(text: str) -> str:
+        text_lower = text.lower()
+
+        if any(word in text_lower for word in ["баланс", "сколько", "денег", "остаток"]):
+            return "balance_check"
+        elif any(word in text_lower for word in ["отчет", "статистика", "аналитика", "траты"]):
+            return "report_request"
+        elif any(word in text_lower for word in ["потратил", "заплатил", "купил", "получил", "зарплата", "доход"]):
+            return "transaction"
+        elif "?" not in text_lower and find_amounts(text_lower) and has_money_context(text_lower):
+            # "Кофе 150, такси 400" - суммы без глагола и без вопроса; число без валюты
+            # и без слова-категории ("сообщение #5", "встреча в 15") - не операция
+            return "transaction"
+        else:
+            return "general"
+
+
+@lru_cache(maxsize=1)
+def get_classifier():
+    """Классификатор процесса: обучается один раз из data/intents.tsv (INTENT_CLASSIFIER=model|keywords)"""
+
+    if os.getenv("INTENT_CLASSIFIER", "model").lower() == "keywords":
+        return KeywordClassifier()
+
+    try:
+        started = time.perf_counter()
+        rows = load_corpus()
+        classifier = IntentClassifier.train(rows)
+        logger.info(
+            f"✅ Классификатор намерений обучен: {len(rows)} примеров "
+            f"за {(time.perf_counter() - started) * 1000:.0f} мс"
+        )
+        return classifier
+    except Exception as e:
+        logger.error(f"❌ Не удалось обучить классификатор намерений, работаем по ключевым словам: {e}")
+        return KeywordClassifier()
@@ -0,0 +1,224 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LLMOverloaded(Exception):
+    """Запрос к модели отклонен планировщиком; retry_after - через сколько секунд повторить"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"LLM перегружен ({reason}), повтор через {retry_after:.0f} сек")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Корзина токенов: емкость capacity, пополнение per_second в секунду
+
+    Баланс может уходить в минус - это резерв под уже принятые запросы:
+    следующий запрос ждет, пока корзина не пополнится до нуля.
+    """
+
+    def __init__(self, capacity: float, per_second: float):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Сколько секунд ждать, чтобы списать amount (0 - можно сразу)"""
+        self._refill()
+        return max(0.0, (amount - self.tokens) / self.per_second)
+
+    def take(self, amount: float) -> float:
+        """Списание amount с резервом; возвращает время ожидания до его покрытия"""
+        self._refill()
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.per_second)
+
+    def adjust(self, amount: float):
+        """Поправка после вызова: фактический расход минус оценка"""
+        self._refill()
+        self.tokens -= amount
+
+
+def estimate_tokens(texts: Iterable[str], output_tokens: int = 0) -> int:
+    """Грубая оценка токенов запроса: ~3 символа кириллицы на токен плюс ответ"""
+    return sum(len(text) // 3 + 4 for text in texts) + output_tokens
+
+
+class LLMScheduler:
+    """Допуск запросов к модели: лимиты на пользователя и общий бюджет
+
+    - admit(telegram_id) - корзина вызовов на пользователя
+      (USER_LLM_BURST подряд, дальше USER_LLM_PER_MINUTE в минуту);
+      спамящий чат получает отказ сразу, не занимая очередь.
+    - slot(tokens) - общий лимит одновременных вызовов (LLM_MAX_CONCURRENCY)
+      и бюджет токенов в минуту (LLM_TOKENS_PER_MINUTE). Если в очереди уже
+      LLM_MAX_QUEUE запросов или ждать дольше LLM_MAX_WAIT секунд, запрос
+      отклоняется сразу - пользователь получает "повторите позже" вместо таймаута.
+
+    Освободившийся слот достается ожидающему с наименьшим приоритетом - это
+    расход корзины пользователя из admit(): редкие пользователи обгоняют в
+    очереди тех, кто шлет сообщения подряд. При равном приоритете - по порядку.
+
+    Нулевое значение любого лимита отключает его.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        user_per_minute: Optional[float] = None,
+        user_burst: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        max_wait: Optional[float] = None
+    ):
+        self.max_concurrency = max_concurrency if max_concurrency is not None else int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.tokens_per_minute = tokens_per_minute if tokens_per_minute is not None else int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+        self.user_per_minute = user_per_minute if user_per_minute is not None else float(os.getenv("USER_LLM_PER_MINUTE", "10"))
+        self.user_burst = user_burst if user_burst is not None else int(os.getenv("USER_LLM_BURST", "5"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("LLM_MAX_QUEUE", "100"))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("LLM_MAX_WAIT", "10"))
+        self.users_limit = 100_000
+
+        self._free = self.max_concurrency
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._budget = (
+            TokenBucket(self.tokens_per_minute, self.tokens_per_minute / 60)
+            if self.tokens_per_minute else None
+        )
+        self._users: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.completed = 0
+        self.shed: Dict[str, int] = {"user": 0, "queue": 0, "budget": 0, "busy": 0}
+
+    def admit(self, telegram_id: int) -> float:
+        """Проверка лимита пользователя перед обращением к модели (LLMOverloaded при превышении)
+
+        Возвращает приоритет для slot(): сколько корзины пользователь уже израсходовал.
+        """
+
+        if not self.user_per_minute:
+            self.admitted += 1
+            return 0.0
+
+        bucket = self._users.get(telegram_id)
+        if bucket is None:
+            bucket = TokenBucket(max(1, self.user_burst), self.user_per_minute / 60)
+            self._users[telegram_id] = bucket
+            if len(self._users) > self.users_limit:
+                self._users.popitem(last=False)
+        self._users.move_to_end(telegram_id)
+
+        wait = bucket.wait_time(1)
+        if wait > 0:
+            self.shed["user"] += 1
+            raise LLMOverloaded("user", wait)
+
+        bucket.take(1)
+        self.admitted += 1
+        return bucket.capacity - bucket.tokens
+
+    @asynccontextmanager
+    async def slot(self, tokens: int, priority: float = 0.0):
+        """Слот для вызова модели с оценкой tokens токенов (меньше priority - раньше)"""
+
+        if self.max_queue and self.waiting >= self.max_queue:
+            self.shed["queue"] += 1
+            raise LLMOverloaded("queue", self.max_wait)
+
+        # Резервируем бюджет сразу - порядок очереди сохраняется без блокировок
+        if self._budget is not None:
+            wait = self._budget.wait_time(tokens)
+            if wait > self.max_wait:
+                self.shed["budget"] += 1
+                raise LLMOverloaded("budget", wait)
+            wait = self._budget.take(tokens)
+        else:
+            wait = 0.0
+
+        self.waiting += 1
+        acquired = False
+        try:
+            deadline = time.monotonic() + self.max_wait
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if self.max_concurrency:
+                try:
+                    await self._acquire(priority, max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    self.shed["busy"] += 1
+                    raise LLMOverloaded("busy", self.max_wait) from None
+            acquired = True
+        finally:
+            self.waiting -= 1
+            if not acquired and self._budget is not None:
+                # Запрос не состоялся - возвращаем зарезервированный бюджет
+                self._budget.adjust(-tokens)
+
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.completed += 1
+            if self.max_concurrency:
+                self._release()
+
+    async def _acquire(self, priority: float, timeout: float):
+        # Свободный слот означает, что живых ожидающих нет - _release отдал бы его им
+        if self._free > 0:
+            self._free -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await asyncio.wait_for(future, timeout=timeout)
+        except BaseException:
+            # Слот успели передать нам в момент таймаута или отмены - отдаем следующему
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+    def settle(self, estimated: int, actual: int):
+        """Учет фактического расхода токенов по usage ответа модели"""
+        if self._budget is not None and actual:
+            self._budget.adjust(actual - estimated)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "budget": self._budget.tokens if self._budget is not None else None,
+            "shed": sum(self.shed.values()),
+            **{f"shed_{reason}": count for reason, count in self.shed.items()}
+        }
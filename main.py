@@ -1,15 +1,25 @@
-# ПРОСТАЯ СИНХРОННАЯ ВЕРСИЯ main.py для Railway
-# Убираем все сложное управление event loop
+# Точка входа бота для Railway: polling или webhook, параллельная обработка апдейтов
 
 import os
+import asyncio
 import logging
+import tempfile
 from datetime import datetime
-from telegram import Update
+from telegram import InputFile, Update
+from telegram.request import HTTPXRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
 # Импортируем наши модули  
-from database import DatabaseManager
-from agent import FinancialAgent
+from sharding import create_database_manager
+from agent import FinancialAgent, REPORT_MODES
+from intent_classifier import KeywordClassifier, get_classifier
+from update_processing import PerChatUpdateProcessor, InstrumentedRequest
+from metrics import Gauge, start_metrics_server
+from importer import StatementImporter
+from exporter import EXPORT_FORMATS, export_transactions
+
+# Лимит Bot API на отправку файлов ботом
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
 
 # Настройка логирования
 logging.basicConfig(
@@ -18,38 +28,74 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Сколько апдейт, пришедший во время запуска, ждет готовности базы (сек)
+STARTUP_WAIT_SECONDS = float(os.getenv("STARTUP_WAIT_SECONDS", "15"))
+LOADING_MESSAGE = "⏳ Система загружается, попробуйте через 10 секунд..."
+
 # Глобальные переменные для компонентов
 db_manager = None
 agent = None
 is_initialized = False
+components_ready = asyncio.Event()
+agent_warmup = None
 
 async def initialize_components():
-    """Глобальная инициализация компонентов"""
-    global db_manager, agent, is_initialized
+    """Глобальная инициализация компонентов
+    
+    Готовность наступает, как только открыт пул БД и создан агент: команды
+    по базе (/balance, /report, /insights, /export, быстрые операции)
+    обслуживаются сразу, а LLM-библиотеки загружаются в фоне - их ждут
+    только сообщения, которым нужна модель.
+    """
+    global db_manager, agent, is_initialized, agent_warmup
     
     try:
-        logger.info("🔧 Инициализируем базу данных...")
+        # Локальная модель намерений обучается в потоке, пока открывается пул БД
+        training = asyncio.create_task(asyncio.to_thread(get_classifier))
         
-        database_url = os.getenv("DATABASE_URL")
-        if not database_url:
-            raise ValueError("DATABASE_URL не установлен")
+        logger.info("🔧 Инициализируем базу данных...")
         
-        # Инициализируем БД
-        db_manager = DatabaseManager(database_url)
+        # Инициализируем БД (DATABASE_URL или несколько шард в DATABASE_SHARDS)
+        db_manager = create_database_manager()
         await db_manager.initialize()
         
         logger.info("🤖 Инициализируем AI агента...")
         
-        # Инициализируем агента
+        await training
         agent = FinancialAgent(db_manager)
         
         is_initialized = True
+        components_ready.set()
         logger.info("✅ Все компоненты инициализированы!")
         
+        agent_warmup = asyncio.create_task(warmup_agent())
+        
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации: {e}")
         raise
 
+async def warmup_agent():
+    """Фоновая загрузка LLM-библиотек и экстракторов"""
+    try:
+        await agent.warmup()
+    except Exception:
+        # Ошибка уже залогирована, первое извлечение попробует снова
+        pass
+
+async def wait_until_ready(update: Update, message: str = LOADING_MESSAGE) -> bool:
+    """Ожидание запуска не дольше STARTUP_WAIT_SECONDS; не успел - отвечаем, что система загружается"""
+    
+    if not is_initialized:
+        try:
+            await asyncio.wait_for(components_ready.wait(), timeout=STARTUP_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+    
+    if not is_initialized:
+        await update.message.reply_text(message)
+        return False
+    return True
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /start"""
     
@@ -86,7 +132,9 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 **Команды:**
 /help - справка
 /balance - баланс
-/report - отчет
+/report - отчет (/report month, year, delta)
+/insights - темп трат, прогноз и регулярные платежи
+/export - выгрузка истории
 /status - статус
 
 Просто пишите как обычно! 😊
@@ -112,10 +160,18 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • "Покажи отчет"
 • "Статистика по тратам"
 
+**📥 Импорт:**
+Пришлите выписку банка файлом CSV или OFX
+
 **🤖 Команды:**
 /start - начать
 /balance - баланс  
-/report - отчет
+/report - отчет за все время
+/report month - отчет за месяц
+/report year - отчет за год
+/report delta - сравнение с прошлым месяцем
+/insights - темп трат, прогноз на месяц, необычные траты, подписки
+/export - выгрузка истории в CSV (/export parquet)
 /status - статус
 /help - справка
 
@@ -135,8 +191,7 @@ async def balance_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     global agent, is_initialized
     
-    if not is_initialized:
-        await update.message.reply_text("⏳ Система загружается, попробуйте через 10 секунд...")
+    if not await wait_until_ready(update):
         return
     
     try:
@@ -151,17 +206,81 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     global agent, is_initialized
     
-    if not is_initialized:
-        await update.message.reply_text("⏳ Система загружается, попробуйте через 10 секунд...")
+    if not await wait_until_ready(update):
+        return
+    
+    mode = context.args[0].lower() if context.args else None
+    if mode is not None and mode not in REPORT_MODES:
+        await update.message.reply_text("Использование: /report [month|year|delta]")
         return
     
     try:
-        response = await agent.process_message("Покажи подробный отчет", update.effective_chat.id)
+        response = await agent.process_report(update.effective_chat.id, mode)
         await update.message.reply_text(response, parse_mode='Markdown')
     except Exception as e:
         logger.error(f"❌ Ошибка отчета: {e}")
         await update.message.reply_text(f"❌ Ошибка: {str(e)}")
 
+async def insights_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /insights"""
+    
+    global agent, is_initialized
+    
+    if not await wait_until_ready(update):
+        return
+    
+    try:
+        response = await agent.process_insights(update.effective_chat.id)
+        await update.message.reply_text(response, parse_mode='Markdown')
+    except Exception as e:
+        logger.error(f"❌ Ошибка инсайтов: {e}")
+        await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /export [csv|parquet] - вся история операций файлом"""
+    
+    global db_manager, is_initialized
+    
+    if not await wait_until_ready(update):
+        return
+    
+    export_format = context.args[0].lower() if context.args else "csv"
+    if export_format not in EXPORT_FORMATS:
+        await update.message.reply_text(f"Использование: /export [{'|'.join(EXPORT_FORMATS)}]")
+        return
+    
+    chat_id = update.effective_chat.id
+    await context.bot.send_chat_action(chat_id=chat_id, action="upload_document")
+    
+    try:
+        # Файл пишется по мере чтения курсора; большой уходит из памяти на диск
+        with tempfile.SpooledTemporaryFile(max_size=int(os.getenv("EXPORT_SPOOL_BYTES", str(4 * 1024 * 1024)))) as buffer:
+            count = await export_transactions(db_manager, chat_id, export_format, buffer)
+            
+            if not count:
+                await update.message.reply_text("📤 Выгружать нечего - операций пока нет")
+                return
+            if buffer.tell() > TELEGRAM_UPLOAD_LIMIT:
+                await update.message.reply_text("❌ Файл больше 50 МБ - попробуйте /export parquet")
+                return
+            
+            buffer.seek(0)
+            # read_file_handle=False - файл читается при отправке, а не целиком в память
+            await update.message.reply_document(
+                document=InputFile(
+                    buffer,
+                    filename=f"finances_{datetime.now():%Y-%m-%d}.{export_format}",
+                    read_file_handle=False
+                ),
+                caption=f"📤 Выгружено операций: {count}"
+            )
+        
+    except ImportError as e:
+        await update.message.reply_text(f"❌ {e}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка выгрузки: {e}")
+        await update.message.reply_text(f"❌ Ошибка выгрузки: {str(e)}")
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /status"""
     
@@ -170,11 +289,13 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Статусы компонентов
     bot_status = "🟢 Работает"
     db_status = "🟢 Подключена" if db_manager and is_initialized else "🔴 Не готова"
-    ai_status = "🟢 Активен" if agent and is_initialized else "🔴 Не готов"
+    ai_status = "🔴 Не готов"
+    if agent and is_initialized:
+        ai_status = "🟢 Активен" if agent.llm_ready else "🟡 Загружается модель"
     
     # Переменные окружения
     bot_token = "🟢 Есть" if os.getenv("BOT_TOKEN") else "❌ Нет"
-    database_url = "🟢 Есть" if os.getenv("DATABASE_URL") else "❌ Нет"
+    database_url = "🟢 Есть" if os.getenv("DATABASE_URL") or os.getenv("DATABASE_SHARDS") else "❌ Нет"
     openai_key = "🟢 Есть" if os.getenv("OPENAI_API_KEY") else "❌ Нет"
     
     # Статистика пользователя
@@ -186,6 +307,85 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             user_stats = "❌ Ошибка загрузки"
     
+    # Метрики пула соединений
+    pool_stats = "—"
+    if db_manager and is_initialized:
+        stats = db_manager.pool_stats()
+        acquire = stats['acquire']
+        pool_stats = (
+            f"🔌 {stats['in_use']}/{stats['size']} занято (макс. {stats['max_size']}), "
+            f"ожидание p99 {acquire['p99'] * 1000:.1f} мс"
+        )
+        if 'shards' in stats:
+            pool_stats += f", шард: {stats['shards']}"
+        reads = stats.get('reads')
+        if reads:
+            healthy = [replica for replica in reads['replicas'] if replica['healthy']]
+            lag = max((replica['lag'] for replica in healthy), default=0.0)
+            pool_stats += (
+                f"\n📖 Реплики: {len(healthy)}/{len(reads['replicas'])} (отставание до {lag:.1f} с), "
+                f"чтений с реплик {reads['replica']}, с primary после записи {reads['sticky']}, "
+                f"без реплики {reads['fallback']}"
+            )
+    
+    # Очередь апдейтов
+    updates = context.application.update_processor.stats()
+    update_stats = (
+        f"⚙️ {updates['running']} в работе (+{updates['priority_running']} приоритетных), "
+        f"{updates['pending']} в очереди ({updates['chats']} чатов), отброшено {updates['shed']}"
+    )
+    
+    # Планировщик обращений к LLM
+    llm_stats = "—"
+    if agent and is_initialized:
+        stats = agent.llm_scheduler.stats()
+        llm_stats = (
+            f"🧠 {stats['running']} вызовов, {stats['waiting']} ждут, "
+            f"отклонено {stats['shed']} (лимит пользователя {stats['shed_user']}, перегрузка "
+            f"{stats['shed'] - stats['shed_user']})"
+        )
+    
+    # Кэш чтения
+    cache_stats = "⚪ Отключен"
+    if db_manager and db_manager.cache is not None:
+        stats = db_manager.cache.stats()
+        cache_stats = f"🎯 Попаданий {stats['hit_ratio']:.0%} ({stats['hits']}/{stats['hits'] + stats['misses']})"
+        if 'memory_bytes' in stats:
+            cache_stats += f", {stats['entries']} записей, ~{stats['memory_bytes'] / 1024:.0f} КБ"
+    
+    # Статистика быстрого парсера (сообщения, разобранные без LLM)
+    parser_stats = "—"
+    if agent and is_initialized:
+        stats = agent.fast_parser.stats()
+        parser_stats = f"⚡ {stats['hits']} без LLM, 🧠 {stats['misses']} через LLM ({stats['hit_rate']:.0%})"
+    
+    # Кэш ответов модели по шаблонам сообщений
+    extraction_stats = "⚪ Отключен"
+    if agent and agent.extraction_cache is not None:
+        stats = agent.extraction_cache.stats()
+        extraction_stats = (
+            f"♻️ Попаданий {stats['hit_ratio']:.0%} ({stats['hits']}/{stats['hits'] + stats['misses']}, "
+            f"из БД {stats['db_hits']}), {stats['entries']} шаблонов"
+        )
+    
+    # Группировка извлечений разных пользователей в один вызов модели
+    batching_stats = "⚪ Отключена"
+    if agent and agent.extraction_batcher is not None:
+        stats = agent.extraction_batcher.stats()
+        batching_stats = (
+            f"📦 {stats['calls']} вызовов, {stats['avg_messages']:.1f} сообщ./вызов, "
+            f"{stats['transactions_per_call']:.1f} операций/вызов"
+        )
+    
+    # Истории пользователей в памяти для /insights
+    analytics_stats = "⚪ Отключена"
+    if db_manager and db_manager.analytics is not None:
+        stats = db_manager.analytics.stats()
+        analytics_stats = (
+            f"🔎 {stats['users']} историй, {stats['rows']} строк, ~{stats['bytes'] / 1024 / 1024:.1f} МБ, "
+            f"загрузок {stats['loads']}, дописано {stats['appended']}"
+        )
+    
     status_message = f"""
 ⚙️ **Статус системы v3.2:**
 
@@ -202,6 +402,30 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 **👤 Ваши данные:**
 {user_stats}
 
+**📬 Апдейты:**
+{update_stats}
+
+**🧠 LLM:**
+{llm_stats}
+
+**🗄️ Пул соединений:**
+{pool_stats}
+
+**🎯 Кэш:**
+{cache_stats}
+
+**⚡ Быстрый парсер:**
+{parser_stats}
+
+**♻️ Кэш извлечений:**
+{extraction_stats}
+
+**📦 Пакетное извлечение:**
+{batching_stats}
+
+**🔎 Аналитика:**
+{analytics_stats}
+
 **📍 Сервер:**
 🌐 Railway.app
 ⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} UTC
@@ -228,12 +452,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"📝 Сообщение от {user_name} ({chat_id}): {user_text}")
     
     # Проверяем готовность
-    if not is_initialized:
-        await update.message.reply_text(
-            "⏳ **Система загружается...**\n\n"
-            "AI агент и база данных запускаются.\n"
-            "Попробуйте через 15 секунд или /status"
-        )
+    if not await wait_until_ready(
+        update,
+        "⏳ **Система загружается...**\n\n"
+        "AI агент и база данных запускаются.\n"
+        "Попробуйте через 15 секунд или /status"
+    ):
         return
     
     # Показываем, что печатаем
@@ -261,6 +485,44 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         await update.message.reply_text(error_response, parse_mode='Markdown')
 
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Импорт банковской выписки (CSV или OFX), присланной файлом"""
+    
+    global db_manager, is_initialized
+    
+    if not await wait_until_ready(update):
+        return
+    
+    document = update.message.document
+    chat_id = update.effective_chat.id
+    logger.info(f"📥 Выписка от {chat_id}: {document.file_name} ({document.file_size} байт)")
+    
+    await update.message.reply_text("📥 Импортирую выписку...")
+    
+    try:
+        # Небольшие файлы остаются в памяти, большие уходят на диск
+        with tempfile.SpooledTemporaryFile(max_size=int(os.getenv("IMPORT_SPOOL_BYTES", str(4 * 1024 * 1024)))) as buffer:
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_memory(buffer)
+            buffer.seek(0)
+            
+            stats = await StatementImporter(db_manager).import_file(chat_id, buffer, document.file_name or "statement.csv")
+        
+        await update.message.reply_text(
+            f"✅ **Выписка импортирована**\n\n"
+            f"📄 Строк в файле: {stats['rows']}\n"
+            f"➕ Добавлено операций: {stats['imported']}\n"
+            f"🔁 Уже были загружены: {stats['duplicates']}\n"
+            f"⏭ Пропущено: {stats['skipped']}",
+            parse_mode='Markdown'
+        )
+        
+    except ValueError as e:
+        await update.message.reply_text(f"❌ Не удалось разобрать выписку: {e}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка импорта выписки: {e}")
+        await update.message.reply_text(f"❌ Ошибка импорта: {str(e)}")
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     
@@ -275,14 +537,137 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 async def post_init(application):
-    """Инициализация после создания приложения"""
-    await initialize_components()
+    """Инициализация после создания приложения
+    
+    Компоненты запускаются в фоне: апдейты принимаются сразу, обработчики
+    ждут готовности базы (wait_until_ready).
+    """
+    application.bot_data["startup"] = asyncio.create_task(start_components(application))
+    
+    metrics_port = int(os.getenv("METRICS_PORT", "0"))
+    if metrics_port:
+        register_gauges(application)
+        application.bot_data["metrics_server"] = await start_metrics_server(
+            os.getenv("METRICS_HOST", "127.0.0.1"), metrics_port
+        )
+
+async def start_components(application):
+    """Фоновый запуск; без базы бот работать не может - ошибка останавливает приложение"""
+    try:
+        await initialize_components()
+    except Exception:
+        application.stop_running()
+
+async def post_shutdown(application):
+    """Остановка эндпоинта метрик"""
+    server = application.bot_data.get("metrics_server")
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+def register_gauges(application):
+    """Текущее состояние очередей и пула для /metrics (читается при каждом запросе)"""
+    
+    def numeric(stats):
+        return {key: value for key, value in stats.items() if isinstance(value, (int, float))}
+    
+    Gauge("updates", "Очередь апдейтов", lambda: numeric(application.update_processor.stats()), label="state")
+    Gauge("llm_scheduler", "Планировщик обращений к LLM",
+          lambda: numeric(agent.llm_scheduler.stats()) if agent else {}, label="state")
+    Gauge("db_pool", "Пул соединений с БД",
+          lambda: numeric(db_manager.pool_stats()) if db_manager else {}, label="state")
+
+# Команды без обращения к LLM - обрабатываются в приоритетной полосе
+PRIORITY_COMMANDS = ("/start", "/help", "/balance", "/report", "/insights", "/status")
+
+def is_priority_update(update: object) -> bool:
+    """Апдейт, которому не нужна модель: команды баланса/отчета и такие же запросы текстом"""
+    
+    if not isinstance(update, Update) or update.message is None or not update.message.text:
+        return False
+    
+    text = update.message.text
+    if text.startswith("/"):
+        return text.split()[0].split("@")[0] in PRIORITY_COMMANDS
+    # Пока модель намерений обучается (запуск) - по ключевым словам, не блокируя цикл событий
+    classify = FinancialAgent.classify_request if is_initialized else KeywordClassifier.predict_one
+    return classify(text) in ("balance_check", "report_request")
+
+async def reply_overloaded(update: object):
+    """Ответ, когда очередь апдейтов переполнена"""
+    
+    if isinstance(update, Update) and update.effective_message:
+        await update.effective_message.reply_text("⏳ Бот перегружен, повторите запрос через минуту")
+
+# Команды бота и их обработчики
+COMMANDS = {
+    "start": start_command,
+    "help": help_command,
+    "balance": balance_command,
+    "report": report_command,
+    "insights": insights_command,
+    "export": export_command,
+    "status": status_command,
+}
+
+def build_application(bot_token: str, request=None):
+    """Создание приложения с обработчиками и параллельной обработкой апдейтов
+    
+    request - необязательная замена HTTP-клиента Telegram (для нагрузочных тестов).
+    """
+    
+    # Апдейты разных чатов обрабатываются параллельно, одного чата - по порядку
+    update_processor = PerChatUpdateProcessor(
+        max_concurrent_updates=int(os.getenv("MAX_CONCURRENT_UPDATES", "64")),
+        max_pending=int(os.getenv("MAX_PENDING_UPDATES", "1000")),
+        max_pending_per_chat=int(os.getenv("MAX_PENDING_UPDATES_PER_CHAT", "20")),
+        on_overload=reply_overloaded,
+        is_priority=is_priority_update,
+        max_priority_updates=int(os.getenv("MAX_PRIORITY_UPDATES", "16")),
+        commands=COMMANDS
+    )
+    
+    builder = (
+        Application.builder()
+        .token(bot_token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(update_processor)
+    )
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    # Вызовы Telegram API (reply_text, send_chat_action...) - этапы telegram.<метод>;
+    # пул 256 соединений - как у клиента по умолчанию
+    builder = builder.request(InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256)))
+    application = builder.build()
+    
+    # Добавляем обработчики
+    for command, handler in COMMANDS.items():
+        application.add_handler(CommandHandler(command, handler))
+    
+    # Импорт выписок
+    application.add_handler(
+        MessageHandler(
+            filters.Document.FileExtension("csv") | filters.Document.FileExtension("ofx")
+            | filters.Document.FileExtension("qfx"),
+            handle_document
+        )
+    )
+    
+    # Главный обработчик сообщений
+    application.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
+    )
+    
+    # Обработчик ошибок
+    application.add_error_handler(error_handler)
+    
+    return application
 
 def main():
-    """Простой синхронный запуск"""
+    """Запуск бота в режиме polling или webhook (BOT_MODE)"""
     
     print("🤖 Запуск финансового Telegram бота v3.2")
-    print("🧠 Простая версия для Railway")
     
     # Проверяем переменные
     bot_token = os.getenv("BOT_TOKEN")
@@ -290,31 +675,37 @@ def main():
         print("❌ BOT_TOKEN не установлен")
         return
     
+    bot_mode = os.getenv("BOT_MODE", "polling").lower()
+    drop_pending_updates = os.getenv("DROP_PENDING_UPDATES", "false").lower() == "true"
+    
     try:
         logger.info("🔧 Создаем приложение...")
         
-        # Создаем приложение
-        application = Application.builder().token(bot_token).post_init(post_init).build()
-        
-        # Добавляем обработчики
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("balance", balance_command))
-        application.add_handler(CommandHandler("report", report_command))
-        application.add_handler(CommandHandler("status", status_command))
-        
-        # Главный обработчик сообщений
-        application.add_handler(
-            MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
-        )
+        application = build_application(bot_token)
         
-        # Обработчик ошибок
-        application.add_error_handler(error_handler)
-        
-        logger.info("🚀 Запускаем polling...")
-        
-        # ПРОСТОЙ СИНХРОННЫЙ ЗАПУСК
-        application.run_polling(drop_pending_updates=True)
+        if bot_mode == "webhook":
+            webhook_url = os.getenv("WEBHOOK_URL")
+            if not webhook_url:
+                raise ValueError("WEBHOOK_URL не установлен")
+            
+            url_path = os.getenv("WEBHOOK_PATH", "telegram")
+            port = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+            
+            logger.info(f"🚀 Запускаем webhook на порту {port}...")
+            
+            application.run_webhook(
+                listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+                port=port,
+                url_path=url_path,
+                webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+                secret_token=os.getenv("WEBHOOK_SECRET") or None,
+                max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+                drop_pending_updates=drop_pending_updates
+            )
+        else:
+            logger.info("🚀 Запускаем polling...")
+            
+            application.run_polling(drop_pending_updates=drop_pending_updates)
         
     except Exception as e:
         logger.error(f"❌ Критическая ошибка: {e}")
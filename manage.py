@@ -0,0 +1,172 @@
+"""Служебные команды обслуживания базы данных
+
+Примеры:
+    python manage.py reconcile-balances
+    python manage.py reconcile-balances --user 123456789
+    python manage.py rebuild-rollups --user 123456789
+    python manage.py partition-transactions
+    python manage.py ensure-partitions --from 2023-01
+    python manage.py import-fx-rates rates.csv
+    python manage.py shard-stats
+    python manage.py move-user --user 123456789 --to shard1
+    python manage.py rebalance-shards --pin-only
+    python manage.py rebalance-shards --batch 100
+"""
+
+import asyncio
+import argparse
+import logging
+from datetime import datetime
+
+from database import DatabaseManager
+from fx_rates import read_rates
+from sharding import ShardedDatabaseManager, create_database_manager
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+async def reconcile_balances(db_manager: DatabaseManager, args):
+    """Пересчет агрегатов баланса по таблице транзакций"""
+    fixed = await db_manager.reconcile_balances(args.user)
+    logger.info(f"✅ Сверка балансов завершена, исправлено: {fixed}")
+
+
+async def rebuild_rollups(db_manager: DatabaseManager, args):
+    """Пересборка помесячных агрегатов по таблице транзакций"""
+    users = await db_manager.rebuild_rollups(args.user)
+    logger.info(f"✅ Помесячные агрегаты пересобраны для {users} пользователей")
+
+
+async def partition_transactions(db_manager: DatabaseManager, args):
+    """Перевод таблицы транзакций на месячные партиции"""
+    moved = await db_manager.partition_transactions(keep_legacy=not args.drop_legacy)
+    if moved and not args.drop_legacy:
+        logger.info("✅ Старая таблица сохранена как transactions_legacy, после проверки ее можно удалить")
+
+
+async def ensure_partitions(db_manager: DatabaseManager, args):
+    """Создание недостающих месячных партиций"""
+    created = await db_manager.ensure_partitions(start=args.start)
+    logger.info(f"✅ Новых партиций: {created}")
+
+
+async def import_fx_rates(db_manager: DatabaseManager, args):
+    """Загрузка курсов валют из CSV с пересчетом агрегатов операций в валюте"""
+    rows = read_rates(args.path)
+    users = await db_manager.import_fx_rates(rows)
+    logger.info(f"✅ Курсов загружено: {len(rows)}, агрегаты пересчитаны для {users} пользователей")
+
+
+def require_shards(db_manager) -> ShardedDatabaseManager:
+    if not isinstance(db_manager, ShardedDatabaseManager):
+        raise ValueError("Команда работает только с шардами: задайте DATABASE_SHARDS")
+    return db_manager
+
+
+async def shard_stats(db_manager: ShardedDatabaseManager, args):
+    """Пользователи и операции по шардам (запросы ко всем шардам параллельно)"""
+    stats = await require_shards(db_manager).shard_stats()
+    for name, item in stats.items():
+        logger.info(f"✅ {name}: пользователей {item['users']}, операций ~{item['transactions']}")
+    logger.info(f"✅ Всего: пользователей {sum(item['users'] for item in stats.values())}, "
+                f"закреплено за шардами вне кольца {len(db_manager._placements)}")
+
+
+async def move_user(db_manager: ShardedDatabaseManager, args):
+    """Перенос одного пользователя в другую шарду"""
+    if args.to not in require_shards(db_manager).shards:
+        raise ValueError(f"Нет шарды {args.to}, есть: {', '.join(db_manager.shards)}")
+    source = db_manager.shard_name(args.user)
+    if source == args.to:
+        logger.info(f"✅ Пользователь {args.user} уже в шарде {args.to}")
+        return
+    copied = await db_manager.move_users([(args.user, source, args.to)], grace=args.grace)
+    logger.info(f"✅ Пользователь {args.user} перенесен {source} -> {args.to}, скопировано операций: {copied}")
+
+
+async def rebalance_shards(db_manager: ShardedDatabaseManager, args):
+    """Перенос пользователей туда, куда их ведет кольцо шард (после добавления шарды)"""
+    moves, current = await require_shards(db_manager).plan_rebalance()
+    logger.info(f"✅ Пользователей не на своей шарде: {len(current)}")
+    if args.pin_only:
+        pinned = await db_manager.pin_users(current)
+        logger.info(f"✅ Закреплено за текущими шардами: {pinned}. Теперь можно перезапустить бота с новым DATABASE_SHARDS")
+        return
+    if args.dry_run:
+        for telegram_id, source, target in moves[:20]:
+            logger.info(f"   {telegram_id}: {source} -> {target}")
+        return
+    for start in range(0, len(moves), args.batch):
+        copied = await db_manager.move_users(moves[start:start + args.batch], grace=args.grace)
+        logger.info(f"✅ Перенесено {min(start + args.batch, len(moves))}/{len(moves)}, операций в пачке: {copied}")
+
+
+COMMANDS = {
+    "reconcile-balances": reconcile_balances,
+    "rebuild-rollups": rebuild_rollups,
+    "partition-transactions": partition_transactions,
+    "ensure-partitions": ensure_partitions,
+    "import-fx-rates": import_fx_rates,
+    "shard-stats": shard_stats,
+    "move-user": move_user,
+    "rebalance-shards": rebalance_shards,
+}
+
+
+async def run(args):
+    db_manager = create_database_manager()
+    await db_manager.initialize()
+
+    try:
+        await COMMANDS[args.command](db_manager, args)
+    finally:
+        await db_manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reconcile = subparsers.add_parser("reconcile-balances", help="пересчитать агрегаты балансов")
+    reconcile.add_argument("--user", type=int, default=None, help="telegram_id одного пользователя")
+
+    rollups = subparsers.add_parser("rebuild-rollups", help="пересобрать помесячные агрегаты")
+    rollups.add_argument("--user", type=int, default=None, help="telegram_id одного пользователя")
+
+    partition = subparsers.add_parser("partition-transactions", help="перевести transactions на месячные партиции")
+    partition.add_argument("--drop-legacy", action="store_true", help="удалить старую таблицу после переноса")
+
+    partitions = subparsers.add_parser("ensure-partitions", help="создать недостающие месячные партиции")
+    partitions.add_argument(
+        "--from", dest="start", type=lambda value: datetime.strptime(value, "%Y-%m"), default=None,
+        help="первый месяц (ГГГГ-ММ), по умолчанию текущий"
+    )
+
+    fx = subparsers.add_parser("import-fx-rates", help="загрузить курсы валют и пересчитать агрегаты")
+    fx.add_argument("path", help='CSV с колонками "date,currency,rate" (рублей за единицу валюты)')
+
+    subparsers.add_parser("shard-stats", help="пользователи и операции по шардам")
+
+    move = subparsers.add_parser("move-user", help="перенести пользователя в другую шарду")
+    move.add_argument("--user", type=int, required=True, help="telegram_id пользователя")
+    move.add_argument("--to", required=True, help="имя шарды из DATABASE_SHARDS")
+    move.add_argument("--grace", type=float, default=None,
+                      help="пауза между копированием и удалением, с (по умолчанию SHARD_DIRECTORY_REFRESH + 5)")
+
+    rebalance = subparsers.add_parser("rebalance-shards", help="перенести пользователей по кольцу шард")
+    rebalance.add_argument("--pin-only", action="store_true",
+                           help="только закрепить пользователей за текущими шардами (перед сменой DATABASE_SHARDS)")
+    rebalance.add_argument("--dry-run", action="store_true", help="только показать план")
+    rebalance.add_argument("--batch", type=int, default=100, help="пользователей в одной пачке переноса")
+    rebalance.add_argument("--grace", type=float, default=None,
+                           help="пауза между копированием и удалением, с (по умолчанию SHARD_DIRECTORY_REFRESH + 5)")
+
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import os
+import time
+import bisect
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Префикс имен в выдаче /metrics
+METRICS_PREFIX = "finbot_"
+
+# Корзины для задержек в секундах: от 0.1 мс до 30 сек
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+# Все созданные метрики в порядке регистрации
+REGISTRY = []
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами (как в Prometheus)"""
+
+    def __init__(self, name: str = "", help: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+                 register: bool = True):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        if register and name:
+            REGISTRY.append(self)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля q (0..100) по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        threshold = q / 100 * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return bound
+        return float("inf")
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99)
+        }
+
+
+class LabeledHistogram:
+    """Набор гистограмм с одной меткой (например, имя запроса)"""
+
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.children: Dict[str, Histogram] = {}
+        REGISTRY.append(self)
+
+    def labels(self, value: str) -> Histogram:
+        child = self.children.get(value)
+        if child is None:
+            child = self.children[value] = Histogram(buckets=self.buckets, register=False)
+        return child
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {value: child.summary() for value, child in sorted(self.children.items())}
+
+
+
+class Counter:
+    """Монотонный счетчик"""
+
+    def __init__(self, name: str = "", help: str = "", register: bool = True):
+        self.name = name
+        self.help = help
+        self.value = 0
+        if register and name:
+            REGISTRY.append(self)
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class LabeledCounter:
+    """Набор счетчиков с одной меткой"""
+
+    def __init__(self, name: str, help: str, label: str):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.children: Dict[str, Counter] = {}
+        REGISTRY.append(self)
+
+    def labels(self, value: str) -> Counter:
+        child = self.children.get(value)
+        if child is None:
+            child = self.children[value] = Counter(register=False)
+        return child
+
+
+class Gauge:
+    """Текущее значение, которое читается функцией в момент выдачи метрик
+
+    Функция возвращает число или словарь {значение метки: число}.
+    """
+
+    def __init__(self, name: str, help: str, read: Callable[[], Union[float, Dict[str, float]]],
+                 label: str = ""):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.label = label
+        REGISTRY.append(self)
+
+
+# Этапы обработки апдейта: classify, user_context, llm.wait, llm.invoke, telegram.<метод>...
+STAGE_SECONDS = LabeledHistogram("stage_seconds", "Время этапов обработки апдейта", "stage")
+REQUEST_SECONDS = LabeledHistogram("request_seconds", "Полное время обработки апдейта", "handler")
+SLOW_REQUESTS = LabeledCounter("slow_requests_total", "Апдейты дольше SLOW_REQUEST_MS", "handler")
+
+# Порог журнала медленных апдейтов с разбивкой по этапам (0 - выключен)
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_MS", "0")) / 1000
+
+
+class Trace:
+    """Разбивка времени одного апдейта по этапам"""
+
+    __slots__ = ("kind", "started", "stages")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+
+    def add(self, stage: str, seconds: float):
+        entry = self.stages.get(stage)
+        if entry is None:
+            self.stages[stage] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def breakdown(self, elapsed: float) -> str:
+        """Строка вида: llm.invoke 812 мс, db.balance 3 мс ×2, ..., прочее 15 мс"""
+        parts = [
+            f"{stage} {total * 1000:.0f} мс" + (f" ×{count}" if count > 1 else "")
+            for stage, (total, count) in sorted(self.stages.items(), key=lambda item: -item[1][0])
+        ]
+        other = elapsed - sum(total for total, _ in self.stages.values())
+        parts.append(f"прочее {max(0.0, other) * 1000:.0f} мс")
+        return ", ".join(parts)
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+def record_stage(stage: str, seconds: float, histogram: Optional[Histogram] = None):
+    """Учет этапа в гистограмме (по умолчанию stage_seconds) и в разбивке текущего апдейта"""
+
+    (histogram or STAGE_SECONDS.labels(stage)).observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str, histogram: Optional[Histogram] = None):
+    """Замер этапа: with span("user_context"): ..."""
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started, histogram)
+
+
+@contextmanager
+def request_trace(kind: str):
+    """Разбивка одного апдейта; медленные пишутся в журнал с этапами"""
+
+    trace = Trace(kind)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        elapsed = time.perf_counter() - trace.started
+        REQUEST_SECONDS.labels(kind).observe(elapsed)
+        if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+            SLOW_REQUESTS.labels(kind).inc()
+            logger.warning(f"⚠️ Медленный апдейт {kind}: {elapsed * 1000:.0f} мс - {trace.breakdown(elapsed)}")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _histogram_lines(name: str, histogram: Histogram, **labels: str) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=repr(bound))} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+
+def render_prometheus() -> str:
+    """Все метрики REGISTRY в текстовом формате Prometheus"""
+
+    lines = []
+    for metric in REGISTRY:
+        name = METRICS_PREFIX + metric.name
+        if isinstance(metric, (Histogram, LabeledHistogram)):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} histogram")
+            if isinstance(metric, Histogram):
+                lines.extend(_histogram_lines(name, metric))
+            else:
+                for value, child in sorted(metric.children.items()):
+                    lines.extend(_histogram_lines(name, child, **{metric.label: value}))
+        elif isinstance(metric, (Counter, LabeledCounter)):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} counter")
+            if isinstance(metric, Counter):
+                lines.append(f"{name} {metric.value}")
+            else:
+                for value, child in sorted(metric.children.items()):
+                    lines.append(f"{name}{_labels(**{metric.label: value})} {child.value}")
+        elif isinstance(metric, Gauge):
+            try:
+                value = metric.read()
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения метрики {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for label_value, number in sorted(value.items()):
+                    lines.append(f"{name}{_labels(**{metric.label: label_value})} {number}")
+            else:
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    """HTTP-эндпоинт GET /metrics для Prometheus (без внешних зависимостей)"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", render_prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"❌ Ошибка ответа /metrics: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"✅ Метрики Prometheus: http://{host}:{port}/metrics")
+    return server
@@ -16,6 +16,9 @@ INCOME_SOURCES = [
     "Дивиденды", "Продажа", "Возврат долга", "Подарок", "Другое"
 ]
 
+# Суммы от 10^10 не помещаются в transactions.amount DECIMAL(12,2)
+MAX_AMOUNT = 10 ** 10
+
 class Transaction(BaseModel):
     """Модель финансовой транзакции"""
     
@@ -51,6 +54,15 @@ class Transaction(BaseModel):
             "Комментарий": self.comment or "-"
         }
 
+class BatchTransaction(Transaction):
+    """Транзакция из пакета сообщений разных пользователей (один вызов модели на пакет)"""
+
+    message: int = Field(description="id сообщения в пакете, из которого извлечена операция")
+
+    def to_transaction(self) -> Transaction:
+        """Обычная транзакция без номера сообщения"""
+        return Transaction(**self.model_dump(exclude={"message"}))
+
 class UpdateMemory(TypedDict):
     """Инструмент для агента - определяет тип обновления памяти"""
     update_type: Literal['transaction', 'report_request', 'balance_check']
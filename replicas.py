@@ -0,0 +1,158 @@
+import os
+import time
+import asyncio
+import logging
+from collections import Counter, OrderedDict, deque
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Позиция WAL в байтах: на primary - текущая запись, на реплике - последняя примененная
+PRIMARY_LSN_QUERY = "SELECT (pg_current_wal_lsn() - '0/0'::pg_lsn)::bigint"
+REPLAY_LSN_QUERY = "SELECT (pg_last_wal_replay_lsn() - '0/0'::pg_lsn)::bigint"
+
+
+class Replica:
+    """Пул соединений одной реплики и ее отставание"""
+
+    def __init__(self, url: str, pool):
+        self.url = url
+        self.pool = pool
+        self.lag = float("inf")
+        self.healthy = False
+        self.reads = 0
+
+
+class ReplicaRouter:
+    """Выбор пула для чтения: реплика или primary
+
+    Чтение идет на primary, если:
+    - пользователь писал меньше max(REPLICA_STICKY_SECONDS, отставание
+      реплики) секунд назад (read-your-writes в пределах процесса; промахи
+      общего кэша в Redis DatabaseManager всегда читает с primary);
+    - нет здоровой реплики с отставанием не больше REPLICA_MAX_LAG.
+
+    Отставание меряется раз в REPLICA_LAG_CHECK_INTERVAL секунд по WAL:
+    позиция primary запоминается вместе со временем замера, отставание
+    реплики - время с последнего замера, позицию которого она уже
+    применила (с точностью до интервала, в большую сторону). Простаивающий
+    primary не дает ложного отставания, в отличие от
+    now() - pg_last_xact_replay_timestamp().
+    """
+
+    def __init__(self, primary, replicas: List[Replica], sticky_window: Optional[float] = None,
+                 max_lag: Optional[float] = None, check_interval: Optional[float] = None,
+                 sticky_users_limit: int = 10000):
+        self.primary = primary
+        self.replicas = replicas
+        self.sticky_window = sticky_window if sticky_window is not None else float(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+        self.max_lag = max_lag if max_lag is not None else float(os.getenv("REPLICA_MAX_LAG", "10"))
+        self.check_interval = check_interval or float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "2"))
+        self.sticky_users_limit = sticky_users_limit
+
+        self._written: "OrderedDict[int, float]" = OrderedDict()
+        self._samples: deque = deque(maxlen=2048)
+        self._next = 0
+        self._task: Optional[asyncio.Task] = None
+        self.routes = Counter()
+
+    async def start(self):
+        await self.check()
+        self._task = asyncio.create_task(self._check_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.gather(*(replica.pool.close() for replica in self.replicas), return_exceptions=True)
+
+    def mark_written(self, telegram_ids: Iterable[int]):
+        """Запись пользователей закоммичена - их чтения какое-то время идут на primary"""
+
+        now = time.monotonic()
+        for telegram_id in telegram_ids:
+            self._written[telegram_id] = now
+            self._written.move_to_end(telegram_id)
+        while len(self._written) > self.sticky_users_limit:
+            self._written.popitem(last=False)
+
+    def mark_failed(self, pool, error: Exception):
+        """Ошибка соединения с репликой: до следующей проверки читаем с primary"""
+
+        for replica in self.replicas:
+            if replica.pool is pool and replica.healthy:
+                replica.healthy = False
+                logger.warning(f"⚠️ Реплика недоступна, чтение переключено на primary: {error!r}")
+
+    def pool_for(self, telegram_id: int):
+        """Пул реплики для чтения данных пользователя или None - читать с primary"""
+
+        candidates = [replica for replica in self.replicas if replica.healthy and replica.lag <= self.max_lag]
+        if not candidates:
+            self.routes["fallback"] += 1
+            return None
+
+        replica = candidates[self._next % len(candidates)]
+        self._next += 1
+
+        written = self._written.get(telegram_id)
+        if written is not None and time.monotonic() - written < max(self.sticky_window, replica.lag):
+            self.routes["sticky"] += 1
+            return None
+
+        self.routes["replica"] += 1
+        replica.reads += 1
+        return replica.pool
+
+    def _lag(self, replay_lsn: Optional[int], now: float) -> float:
+        if replay_lsn is None:
+            # Не standby (например, DSN самого primary) - отставания нет
+            return 0.0
+        # Оценка сверху: реплика применила все, что было записано до последнего
+        # замера, который она догнала, - отставание не больше времени с него
+        caught_up_at = None
+        for sampled_at, primary_lsn in self._samples:
+            if primary_lsn > replay_lsn:
+                return now - (caught_up_at if caught_up_at is not None else sampled_at)
+            caught_up_at = sampled_at
+        return 0.0
+
+    async def check(self):
+        """Замер отставания всех реплик"""
+
+        async with self.primary.acquire() as conn:
+            primary_lsn = await conn.fetchval(PRIMARY_LSN_QUERY)
+        now = time.monotonic()
+        self._samples.append((now, primary_lsn))
+
+        for replica in self.replicas:
+            try:
+                async with replica.pool.acquire(timeout=self.check_interval) as conn:
+                    replay_lsn = await conn.fetchval(REPLAY_LSN_QUERY, timeout=self.check_interval)
+                replica.lag = self._lag(replay_lsn, now)
+                if not replica.healthy:
+                    logger.info(f"✅ Реплика доступна, отставание {replica.lag:.1f} с")
+                replica.healthy = True
+            except Exception as e:
+                if replica.healthy:
+                    logger.warning(f"⚠️ Реплика не отвечает, чтение переключено на primary: {e!r}")
+                replica.healthy = False
+
+    async def _check_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"❌ Ошибка замера отставания реплик: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "replicas": [
+                {"healthy": replica.healthy, "lag": replica.lag, "reads": replica.reads}
+                for replica in self.replicas
+            ],
+            "replica": self.routes["replica"],
+            "sticky": self.routes["sticky"],
+            "fallback": self.routes["fallback"],
+        }
@@ -0,0 +1,423 @@
+import os
+import re
+import bisect
+import asyncio
+import hashlib
+import logging
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from cache import create_cache
+from analytics import SpendingAnalytics
+from database import DB_ACQUIRE_SECONDS, DB_QUERY_SECONDS, REPORT_RECENT_LIMIT, DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+_SHARD_NAME_RE = re.compile(r"^([A-Za-z0-9_-]+)=(.+)$")
+
+
+def parse_shards(spec: str) -> List[Tuple[str, str]]:
+    """Шарды из DATABASE_SHARDS: "имя=DSN, имя=DSN" (без имени - shard0, shard1, ...)
+
+    DSN может продолжаться репликами шарды для чтения через "|".
+
+    Имена, а не позиции, определяют место шарды на кольце - по ним
+    пользователи и распределяются, поэтому менять имя шарды нельзя.
+    """
+
+    shards = []
+    for index, entry in enumerate(part.strip() for part in spec.split(",")):
+        if not entry:
+            continue
+        match = _SHARD_NAME_RE.match(entry)
+        if match:
+            shards.append((match.group(1), match.group(2).strip()))
+        else:
+            shards.append((f"shard{index}", entry))
+
+    names = [name for name, _ in shards]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Повторяются имена шард в DATABASE_SHARDS: {names}")
+    return shards
+
+
+class HashRing:
+    """Консистентное хеширование пользователей по шардам
+
+    Каждая шарда - vnodes точек на кольце; пользователь принадлежит первой
+    точке по часовой стрелке от хеша его telegram_id. При добавлении шарды
+    к ней переходит примерно 1/N пользователей, остальные остаются на месте.
+    """
+
+    def __init__(self, names: Sequence[str], vnodes: int = 256):
+        points = sorted((self._hash(f"{name}#{index}"), name) for name in names for index in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # blake2b, а не hash(): размещение не должно зависеть от PYTHONHASHSEED
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def shard(self, telegram_id: int) -> str:
+        index = bisect.bisect(self._points, self._hash(str(telegram_id)))
+        return self._names[index % len(self._names)]
+
+
+class ShardedDatabaseManager:
+    """Данные пользователей на нескольких PostgreSQL (DATABASE_SHARDS)
+
+    Тот же интерфейс, что у DatabaseManager: запросы пользователя идут в его
+    шарду (свой DatabaseManager и свой пул на каждую), пакеты разных
+    пользователей делятся по шардам и пишутся параллельно, служебные
+    операции (сверка, партиции, курсы, подсчет пользователей) выполняются
+    на всех шардах одновременно.
+
+    Шарда пользователя - по кольцу HashRing, кроме закрепленных в таблице
+    shard_directory на первой шарде (справочник перечитывается раз в
+    SHARD_DIRECTORY_REFRESH секунд). Закрепления нужны на время
+    перебалансировки: см. move_users и plan_rebalance. Первая шарда в списке
+    должна оставаться первой.
+
+    Кэш чтения и истории аналитики общие для всех шард.
+    """
+
+    def __init__(self, shards: Sequence[Tuple[str, str]], vnodes: Optional[int] = None):
+        if not shards:
+            raise ValueError("Не задано ни одной шарды")
+
+        # "primary|реплика|реплика" - реплики шарды для чтения
+        self.shards: Dict[str, DatabaseManager] = {
+            name: DatabaseManager(dsn.split("|")[0].strip(), [url.strip() for url in dsn.split("|")[1:]])
+            for name, dsn in shards
+        }
+        self.directory = self.shards[shards[0][0]]
+        self.ring = HashRing(list(self.shards), vnodes or int(os.getenv("SHARD_VNODES", "256")))
+        self.directory_refresh = float(os.getenv("SHARD_DIRECTORY_REFRESH", "30"))
+        self._placements: Dict[int, str] = {}
+        self._directory_task: Optional[asyncio.Task] = None
+
+        self.cache = create_cache()
+        self.analytics: Optional[SpendingAnalytics] = None
+        if os.getenv("ANALYTICS_ENABLED", "true").lower() == "true":
+            self.analytics = SpendingAnalytics(self)
+        for shard in self.shards.values():
+            shard.cache = self.cache
+            shard.analytics = self.analytics
+
+    async def initialize(self):
+        """Инициализация всех шард и загрузка справочника закреплений"""
+
+        try:
+            await asyncio.gather(*(shard.initialize() for shard in self.shards.values()))
+
+            async with self.directory._acquire() as conn:
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS shard_directory (
+                        telegram_id BIGINT PRIMARY KEY,
+                        shard VARCHAR(64) NOT NULL,
+                        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+                    )
+                """)
+            await self.reload_directory()
+            if self.directory_refresh > 0:
+                self._directory_task = asyncio.create_task(self._directory_loop())
+
+            logger.info(f"✅ Шардирование: {len(self.shards)} шард ({', '.join(self.shards)}), "
+                        f"закреплено пользователей: {len(self._placements)}")
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка инициализации шард: {e}")
+            raise
+
+    async def reload_directory(self) -> int:
+        """Перечитывание закреплений из shard_directory; возвращает их число"""
+
+        async with self.directory._acquire() as conn:
+            rows = await conn.fetch("SELECT telegram_id, shard FROM shard_directory")
+
+        placements = {}
+        for row in rows:
+            if row['shard'] in self.shards:
+                placements[row['telegram_id']] = row['shard']
+            else:
+                logger.warning(f"⚠️ Пользователь {row['telegram_id']} закреплен за неизвестной шардой {row['shard']}")
+        self._placements = placements
+        return len(placements)
+
+    async def _directory_loop(self):
+        while True:
+            await asyncio.sleep(self.directory_refresh)
+            try:
+                await self.reload_directory()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления справочника шард: {e}")
+
+    def shard_name(self, telegram_id: int) -> str:
+        return self._placements.get(telegram_id) or self.ring.shard(telegram_id)
+
+    def shard_for(self, telegram_id: int) -> DatabaseManager:
+        return self.shards[self.shard_name(telegram_id)]
+
+    @property
+    def fx(self):
+        # Курсы одинаковы на всех шардах (import_fx_rates загружает их везде)
+        return self.directory.fx
+
+    async def _fan_out(self, method: str, *args) -> Dict[str, object]:
+        """Один и тот же вызов на всех шардах одновременно: {имя шарды: результат}"""
+
+        results = await asyncio.gather(*(getattr(shard, method)(*args) for shard in self.shards.values()))
+        return dict(zip(self.shards, results))
+
+    # Запросы одного пользователя - в его шарду
+
+    async def create_user_if_not_exists(self, telegram_id: int, username: str = None, first_name: str = None):
+        return await self.shard_for(telegram_id).create_user_if_not_exists(telegram_id, username, first_name)
+
+    async def save_transaction(self, telegram_id: int, transaction_data: Dict):
+        return await self.shard_for(telegram_id).save_transaction(telegram_id, transaction_data)
+
+    async def import_transactions(self, telegram_id: int, transactions: List[Dict]) -> int:
+        return await self.shard_for(telegram_id).import_transactions(telegram_id, transactions)
+
+    async def get_user_transactions(self, telegram_id: int, limit: int = 100) -> List[Dict]:
+        return await self.shard_for(telegram_id).get_user_transactions(telegram_id, limit)
+
+    async def iter_user_transactions(self, telegram_id: int, batch_size: Optional[int] = None,
+                                     primary: bool = False) -> AsyncIterator[List]:
+        shard = self.shard_for(telegram_id)
+        async with aclosing(shard.iter_user_transactions(telegram_id, batch_size, primary)) as batches:
+            async for rows in batches:
+                yield rows
+
+    async def get_balance(self, telegram_id: int, start=None, end=None) -> Dict:
+        return await self.shard_for(telegram_id).get_balance(telegram_id, start, end)
+
+    async def get_user_context(self, telegram_id: int, limit: int = 5) -> Dict:
+        return await self.shard_for(telegram_id).get_user_context(telegram_id, limit)
+
+    async def get_expenses_by_category(self, telegram_id: int, start=None, end=None) -> Dict[str, float]:
+        return await self.shard_for(telegram_id).get_expenses_by_category(telegram_id, start, end)
+
+    async def get_history_columns(self, telegram_id: int) -> List:
+        return await self.shard_for(telegram_id).get_history_columns(telegram_id)
+
+    async def get_report_data(self, telegram_id: int, recent_limit: int = REPORT_RECENT_LIMIT) -> Dict:
+        return await self.shard_for(telegram_id).get_report_data(telegram_id, recent_limit)
+
+    async def get_monthly_rollups(self, telegram_id: int, first_month, last_month) -> List[Dict]:
+        return await self.shard_for(telegram_id).get_monthly_rollups(telegram_id, first_month, last_month)
+
+    # Общие для всех пользователей данные - на первой шарде
+
+    async def get_cached_extraction(self, template: str, max_age: float) -> Optional[Dict]:
+        return await self.directory.get_cached_extraction(template, max_age)
+
+    async def save_cached_extraction(self, template: str, result: Dict):
+        await self.directory.save_cached_extraction(template, result)
+
+    # Пакеты и служебные операции - на всех шардах
+
+    async def save_transactions_batch(self, rows: List[Tuple[int, Dict]]) -> List[str]:
+        """Пакет разных пользователей: части по шардам пишутся параллельно
+
+        Каждая часть атомарна на своей шарде, весь пакет - нет: при ошибке
+        одной шарды части других уже сохранены.
+        """
+
+        positions: Dict[str, List[int]] = {}
+        for index, (telegram_id, _) in enumerate(rows):
+            positions.setdefault(self.shard_name(telegram_id), []).append(index)
+
+        results = await asyncio.gather(*(
+            self.shards[name].save_transactions_batch([rows[index] for index in indexes])
+            for name, indexes in positions.items()
+        ))
+
+        ids: List[str] = [""] * len(rows)
+        for indexes, shard_ids in zip(positions.values(), results):
+            for index, transaction_id in zip(indexes, shard_ids):
+                ids[index] = transaction_id
+        return ids
+
+    async def reconcile_balances(self, telegram_id: Optional[int] = None) -> int:
+        if telegram_id is not None:
+            return await self.shard_for(telegram_id).reconcile_balances(telegram_id)
+        return sum((await self._fan_out("reconcile_balances")).values())
+
+    async def rebuild_rollups(self, telegram_id: Optional[int] = None) -> int:
+        if telegram_id is not None:
+            return await self.shard_for(telegram_id).rebuild_rollups(telegram_id)
+        return sum((await self._fan_out("rebuild_rollups")).values())
+
+    async def ensure_partitions(self, start=None, end=None, months=None) -> int:
+        return sum((await self._fan_out("ensure_partitions", start, end, months)).values())
+
+    async def partition_transactions(self, keep_legacy: bool = True) -> int:
+        return sum((await self._fan_out("partition_transactions", keep_legacy)).values())
+
+    async def import_fx_rates(self, rows) -> int:
+        return sum((await self._fan_out("import_fx_rates", rows)).values())
+
+    async def reload_fx_rates(self) -> int:
+        return min((await self._fan_out("reload_fx_rates")).values())
+
+    async def shard_stats(self) -> Dict[str, Dict[str, int]]:
+        """Пользователи и операции на каждой шарде (запросы ко всем шардам параллельно)"""
+        return await self._fan_out("count_users")
+
+    async def count_users(self) -> Dict[str, int]:
+        stats = await self.shard_stats()
+        return {key: sum(shard[key] for shard in stats.values()) for key in ("users", "transactions")}
+
+    def pool_stats(self) -> Dict:
+        """Метрики пулов всех шард: суммарный размер и занятость, ожидание и запросы - общие"""
+
+        stats = [shard.pool_stats() for shard in self.shards.values()]
+        return {
+            "shards": len(stats),
+            "size": sum(item["size"] for item in stats),
+            "max_size": sum(item["max_size"] for item in stats),
+            "in_use": sum(item["in_use"] for item in stats),
+            "acquire": DB_ACQUIRE_SECONDS.summary(),
+            "queries": DB_QUERY_SECONDS.summary(),
+            "reads": self._read_stats([item["reads"] for item in stats])
+        }
+
+    @staticmethod
+    def _read_stats(stats: List[Optional[Dict]]) -> Optional[Dict]:
+        stats = [item for item in stats if item is not None]
+        if not stats:
+            return None
+        return {
+            "replicas": [replica for item in stats for replica in item["replicas"]],
+            **{key: sum(item[key] for item in stats) for key in ("replica", "sticky", "fallback")}
+        }
+
+    # Перенос пользователей между шардами
+
+    async def _place(self, telegram_id: int, name: str):
+        """Закрепление пользователя за шардой (или снятие, если туда и так ведет кольцо)"""
+
+        async with self.directory._acquire() as conn:
+            if name == self.ring.shard(telegram_id):
+                await conn.execute("DELETE FROM shard_directory WHERE telegram_id = $1", telegram_id)
+                self._placements.pop(telegram_id, None)
+            else:
+                await conn.execute("""
+                    INSERT INTO shard_directory (telegram_id, shard) VALUES ($1, $2)
+                    ON CONFLICT (telegram_id) DO UPDATE SET shard = EXCLUDED.shard, updated_at = NOW()
+                """, telegram_id, name)
+                self._placements[telegram_id] = name
+
+    async def _copy_user(self, telegram_id: int, source: DatabaseManager, target: DatabaseManager) -> int:
+        """Копия пользователя и его операций; повторный вызов докопирует только новые строки
+
+        Аналитика общая для шард, и скопированные строки уже попали в историю
+        при записи в старую шарду - в историю они не дописываются.
+        """
+
+        user = await source.get_user(telegram_id)
+        if user is not None:
+            await target.put_user(user)
+
+        copied = 0
+        async with aclosing(source.iter_user_transactions(telegram_id, primary=True)) as batches:
+            async for rows in batches:
+                copied += await target.import_transactions(telegram_id, [
+                    {
+                        'id': str(row['id']),
+                        'type': row['type'],
+                        'amount': row['amount'],
+                        'currency': row['currency'],
+                        'category_or_source': row['category_or_source'],
+                        'comment': row['comment'],
+                        'date': row['transaction_date']
+                    }
+                    for row in rows
+                ], append_history=False)
+        return copied
+
+    async def move_users(self, moves: Sequence[Tuple[int, str, str]], grace: Optional[float] = None) -> int:
+        """Перенос пользователей (telegram_id, откуда, куда) без остановки бота
+
+        1. Пользователь и его операции копируются в новую шарду (повторы по id
+           пропускаются, агрегаты считаются по вставленным строкам), пользователь
+           закрепляется за ней в shard_directory.
+        2. Ждем grace секунд (по умолчанию SHARD_DIRECTORY_REFRESH + 5) - все
+           реплики бота перечитали справочник и пишут уже в новую шарду.
+        3. Докопируются операции, записанные в старую шарду за это время, и
+           пользователь удаляется из старой шарды.
+
+        Возвращает число скопированных операций.
+        """
+
+        if grace is None:
+            grace = self.directory_refresh + 5
+
+        copied = 0
+        for telegram_id, source, target in moves:
+            copied += await self._copy_user(telegram_id, self.shards[source], self.shards[target])
+            await self._place(telegram_id, target)
+
+        if moves and grace > 0:
+            await asyncio.sleep(grace)
+
+        for telegram_id, source, target in moves:
+            copied += await self._copy_user(telegram_id, self.shards[source], self.shards[target])
+            await self.shards[source].delete_user(telegram_id)
+            logger.info(f"✅ Пользователь {telegram_id} перенесен: {source} -> {target}")
+
+        if self.analytics is not None:
+            self.analytics.forget([telegram_id for telegram_id, _, _ in moves])
+        return copied
+
+    async def plan_rebalance(self) -> Tuple[List[Tuple[int, str, str]], Dict[int, str]]:
+        """Что перенести, чтобы пользователи жили там, куда ведет кольцо
+
+        Возвращает переносы (telegram_id, откуда, куда) и текущее
+        местоположение пользователей, которых нужно перенести. Пользователь,
+        найденный на двух шардах (прерванный перенос), переносится со всех
+        лишних.
+        """
+
+        located: Dict[int, List[str]] = {}
+        for name, users in (await self._fan_out("list_users")).items():
+            for telegram_id in users:
+                located.setdefault(telegram_id, []).append(name)
+
+        moves, current = [], {}
+        for telegram_id, names in located.items():
+            target = self.ring.shard(telegram_id)
+            for name in names:
+                if name != target:
+                    moves.append((telegram_id, name, target))
+                    current[telegram_id] = name
+        return moves, current
+
+    async def pin_users(self, current: Dict[int, str]) -> int:
+        """Закрепление пользователей за шардами, где они сейчас (перед сменой списка шард)"""
+
+        for telegram_id, name in current.items():
+            await self._place(telegram_id, name)
+        return len(current)
+
+    async def close(self):
+        if self._directory_task is not None:
+            self._directory_task.cancel()
+            self._directory_task = None
+        await asyncio.gather(*(shard.close() for shard in self.shards.values()))
+
+
+def create_database_manager():
+    """Менеджер БД по настройкам окружения: DATABASE_SHARDS (несколько баз) или DATABASE_URL"""
+
+    spec = os.getenv("DATABASE_SHARDS", "").strip()
+    if spec:
+        return ShardedDatabaseManager(parse_shards(spec))
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL не установлен")
+    return DatabaseManager(database_url)
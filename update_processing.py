@@ -0,0 +1,193 @@
+import re
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from telegram import Bot, Update
+from telegram.ext import BaseUpdateProcessor
+from telegram.request import BaseRequest, RequestData
+
+from metrics import record_stage, request_trace, span
+
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов с сохранением порядка внутри чата
+
+    Апдейты разных чатов обрабатываются одновременно (не больше
+    max_concurrent_updates), апдейты одного чата - строго по очереди.
+    Слот общего лимита занимается только когда подошла очередь чата, так что
+    длинная очередь одного пользователя не держит слоты остальных.
+
+    Ограничение очереди: если ожидающих апдейтов больше max_pending (всего)
+    или max_pending_per_chat (в одном чате), новый апдейт отбрасывается и
+    вызывается on_overload - например, чтобы ответить "попробуйте позже".
+
+    Приоритетная полоса: апдейты, для которых is_priority(update) истинно
+    (баланс, отчет - только запросы к БД), занимают отдельные
+    max_priority_updates слотов и не ждут, пока общие слоты освободятся от
+    апдейтов, ждущих LLM. Порядок внутри чата сохраняется и для них.
+
+    Каждый апдейт обрабатывается внутри request_trace: ожидание очереди -
+    этап updates.queue, дальше этапы обработчика (LLM, БД, Telegram).
+
+    Вся логика - в do_process_update: process_update базового класса
+    финальный. Его семафор рассчитан на всю очередь (max_pending + слоты) и
+    только ограничивает число апдейтов в работе, лимит параллельной
+    обработки - собственный семафор max_concurrent_updates.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates: int,
+        max_pending: int = 1000,
+        max_pending_per_chat: int = 20,
+        on_overload: Optional[Callable[[object], Awaitable[None]]] = None,
+        is_priority: Optional[Callable[[object], bool]] = None,
+        max_priority_updates: int = 0,
+        commands: Iterable[str] = ()
+    ):
+        super().__init__(max_pending + max_concurrent_updates + max(0, max_priority_updates))
+        self.max_running = max_concurrent_updates
+        self._running_semaphore = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self.running = 0
+        self.max_pending = max_pending
+        self.max_pending_per_chat = max_pending_per_chat
+        self.on_overload = on_overload
+        self.is_priority = is_priority if max_priority_updates > 0 else None
+        self._priority_semaphore = asyncio.BoundedSemaphore(max(1, max_priority_updates))
+        self.priority_running = 0
+        # Известные команды - метки в метриках (остальные - /unknown, чтобы не плодить метки)
+        self.commands = {f"/{command}" for command in commands}
+
+        self._chat_locks: Dict[object, asyncio.Lock] = {}
+        self._chat_pending: Dict[object, int] = {}
+        self.pending = 0
+        self.shed = 0
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        chat_key = self._chat_key(update)
+
+        if self.pending >= self.max_pending or self._chat_pending.get(chat_key, 0) >= self.max_pending_per_chat:
+            coroutine.close()
+            self.shed += 1
+            logger.warning(f"⚠️ Очередь переполнена, апдейт чата {chat_key} отброшен")
+            if self.on_overload is not None:
+                try:
+                    await self.on_overload(update)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка ответа о перегрузке: {e}")
+            return
+
+        self.pending += 1
+        self._chat_pending[chat_key] = self._chat_pending.get(chat_key, 0) + 1
+        lock = self._chat_locks.setdefault(chat_key, asyncio.Lock())
+        priority = self.is_priority is not None and self.is_priority(update)
+        queued = time.perf_counter()
+
+        try:
+            with request_trace(self._update_kind(update)):
+                # asyncio.Lock будит ожидающих в порядке очереди - порядок апдейтов чата сохраняется
+                async with lock:
+                    if priority:
+                        async with self._priority_semaphore:
+                            record_stage("updates.queue", time.perf_counter() - queued)
+                            self.priority_running += 1
+                            try:
+                                await coroutine
+                            finally:
+                                self.priority_running -= 1
+                    else:
+                        async with self._running_semaphore:
+                            record_stage("updates.queue", time.perf_counter() - queued)
+                            self.running += 1
+                            try:
+                                await coroutine
+                            finally:
+                                self.running -= 1
+        finally:
+            self.pending -= 1
+            self._chat_pending[chat_key] -= 1
+            if not self._chat_pending[chat_key]:
+                del self._chat_pending[chat_key]
+                del self._chat_locks[chat_key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "priority_running": self.priority_running,
+            "pending": self.pending,
+            "chats": len(self._chat_pending),
+            "shed": self.shed
+        }
+
+    def _update_kind(self, update: object) -> str:
+        """Метка апдейта в метриках: /команда, document, message или other"""
+        if isinstance(update, Update) and update.message is not None:
+            text = update.message.text or ""
+            if text.startswith("/"):
+                command = text.split()[0].split("@")[0]
+                return command if command in self.commands else "/unknown"
+            if update.message.document is not None:
+                return "document"
+            return "message"
+        return "other"
+
+    @staticmethod
+    def _chat_key(update: object):
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        # Апдейты без чата упорядочивать не нужно
+        return id(update)
+
+
+# Методы Bot API для меток этапов: camelCase-псевдонимы методов Bot в PTB
+# (sendMessage, getUpdates, ...). Остальные URL - в общие метки, чтобы число
+# меток не зависело от имен файлов и опечаток в путях.
+TELEGRAM_METHODS = frozenset(
+    name for name in dir(Bot)
+    if re.fullmatch(r"[a-z]+(?:[A-Z][a-z0-9]*)+", name) and callable(getattr(Bot, name))
+)
+
+
+def telegram_stage(url: str) -> str:
+    """Метка этапа для URL Bot API: telegram.<метод>, telegram.file или telegram.other"""
+
+    if "/file/bot" in url:
+        return "telegram.file"
+    method = url.rsplit("/", 1)[-1]
+    return "telegram." + (method if method in TELEGRAM_METHODS else "other")
+
+
+class InstrumentedRequest(BaseRequest):
+    """HTTP-клиент Telegram с замером каждого вызова API (этап telegram.<метод>)"""
+
+    def __init__(self, request: BaseRequest):
+        self.request = request
+
+    @property
+    def read_timeout(self):
+        return self.request.read_timeout
+
+    async def initialize(self) -> None:
+        await self.request.initialize()
+
+    async def shutdown(self) -> None:
+        await self.request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        with span(telegram_stage(url)):
+            return await self.request.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
@@ -0,0 +1,116 @@
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Очередь записи транзакций с группировкой в пакеты
+
+    Пока сохраняется один пакет, вставки от разных пользователей копятся
+    в следующий (до WRITE_BATCH_SIZE штук; WRITE_BATCH_DELAY_MS - сколько
+    дополнительно подождать добора пакета). Пакет сохраняется одним COPY
+    в одной транзакции БД. Вызывающий ждет коммита своего пакета, поэтому баланс,
+    прочитанный сразу после добавления, уже учитывает новую запись.
+    """
+
+    def __init__(self, db_manager, max_batch: Optional[int] = None, max_delay: Optional[float] = None):
+        self.db_manager = db_manager
+        self.max_batch = max_batch or int(os.getenv("WRITE_BATCH_SIZE", "500"))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv("WRITE_BATCH_DELAY_MS", "0")) / 1000
+
+        self._pending: List[Tuple[int, Dict, asyncio.Future]] = []
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self.batches = 0
+        self.rows = 0
+
+    def start(self):
+        """Запуск фоновой задачи сброса пакетов"""
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"✅ Пакетная запись включена: до {self.max_batch} строк / {self.max_delay * 1000:.0f} мс")
+
+    async def stop(self):
+        """Остановка с сохранением всего, что осталось в очереди"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._has_items.set()
+        await self._task
+        self._task = None
+
+    async def submit(self, telegram_id: int, transaction_data: Dict) -> str:
+        """Постановка транзакции в очередь; возвращает id после коммита пакета"""
+
+        if self._task is None or self._stopping:
+            raise RuntimeError("Очередь записи не запущена")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((telegram_id, transaction_data, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch:
+            self._batch_full.set()
+        return await future
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch": self.rows / self.batches if self.batches else 0.0,
+            "pending": len(self._pending)
+        }
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+
+            if not self._pending:
+                self._has_items.clear()
+                if self._stopping:
+                    return
+                continue
+
+            # Даем пакету накопиться, если он еще не полон
+            if self.max_delay > 0 and len(self._pending) < self.max_batch and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), timeout=self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            self._batch_full.clear()
+            if len(self._pending) >= self.max_batch:
+                self._batch_full.set()
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[int, Dict, asyncio.Future]]):
+        rows = [(telegram_id, data) for telegram_id, data, _ in batch]
+
+        try:
+            ids = await self.db_manager.save_transactions_batch(rows)
+        except Exception as e:
+            # Одна плохая строка не должна ронять весь пакет - сохраняем по одной
+            logger.error(f"❌ Ошибка пакетной записи ({len(batch)} строк), сохраняем по одной: {e}")
+            for telegram_id, data, future in batch:
+                try:
+                    [result] = await self.db_manager.save_transactions_batch([(telegram_id, data)])
+                except Exception as row_error:
+                    if not future.done():
+                        future.set_exception(row_error)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            return
+
+        self.batches += 1
+        self.rows += len(batch)
+        for (_, _, future), transaction_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(transaction_id)